@@ -1,10 +1,15 @@
-import re
+import re, threading
+from bisect import bisect_left, insort
 from common import fuzzy_match
 
 class CommandHistory:
     """
     Handle all things related to managing and navigating the command history
     """
+    # Number of (most recent) lines kept in memory when the history is loaded
+    # from a store; older lines are only searched on disk
+    max_loaded = 1000
+
     def __init__(self):
         # The actual command list
         self.list = []
@@ -18,18 +23,64 @@ class CommandHistory:
         # A trail of visited indices (while navigating)
         self.trail = []
 
+        # Generator of the remaining matches for the current filter
+        self.matches = None
+
+        # Whether the matches are only searched for as the user navigates
+        # through them, instead of all at once when the search starts
+        self.lazy = True
+
+        # Inverted indexes of the history lines, mapping lowercase words to
+        # the set of lines that contain them; words are split on whitespace
+        # and on non-alphanumeric characters, like the two families of search
+        # patterns in start(). The whitespace-split words are also kept
+        # sorted, for prefix lookups.
+        self.space_index = {}
+        self.space_words = []
+        self.alnum_index = {}
+
+        # The list that the indexes describe (the list might be replaced
+        # altogether, e.g. when the history is loaded from disk)
+        self.indexed_list = None
+
+        # The on-disk history store (see HistoryStore.py), if any, and the
+        # lines added since it was last written to; these are handed over to
+        # the writer thread (see HistoryWriter.py) under unsaved_lock
+        self.store = None
+        self.unsaved = []
+        self.unsaved_lock = threading.Lock()
+
+    def load(self, store):
+        """Load the most recent lines from a history store"""
+        self.store = store
+        self.list = store.recent(self.max_loaded)
+
+    def save(self, length):
+        """
+        Append the new lines to the attached store, which keeps at most length
+        of them
+        """
+        if self.store is not None:
+            # Take the lines first, this may run on a background thread while
+            # new lines are being added
+            with self.unsaved_lock:
+                (lines, self.unsaved) = (self.unsaved, [])
+            self.store.append(lines, length)
+
     def start(self, line):
         """
         Start history navigation
         """
         #print '\n\nStart\n\n'
+        self.sync()
         self.filter = line
 
         # Create a list of regex patterns to use when navigating the history
         # using a filter
         # A. First use just the space as word separator; these are the most
         # useful matches (think acronyms 'g c m' for 'git checkout master' etc)
-        words = [re.escape(w) for w in re.findall('[^\\s]+', line)] # Split the filter into words
+        space_words = re.findall('[^\\s]+', line)   # Split the filter into words
+        words = [re.escape(w) for w in space_words]
         boundary = '[\\s]+'
         patterns = [
             # Prefixes match for each word in the command (strongest, these will be the
@@ -41,7 +92,8 @@ class CommandHistory:
         ]
 
         # B. Then split based on other separator characters as well
-        words = [re.escape(w) for w in re.findall('[a-zA-Z0-9]+', line)] # Split the filter into words
+        alnum_words = re.findall('[a-zA-Z0-9]+', line)  # Split the filter into words
+        words = [re.escape(w) for w in alnum_words]
         boundary = '[\\s\\.\\-\\\\_]+'   # Word boundary characters
         patterns += [
             # Prefixes match for each word in the command (strongest, these will be the
@@ -67,23 +119,68 @@ class CommandHistory:
             # as these filters will yield a long list of matched lines!
             patterns = [patterns[4]]
 
-        # Traverse the history and build the filtered list
-        self.filtered_list = []
-        for pattern in patterns:
+        # The matches are generated as the user navigates through them (or
+        # all at once, if not in lazy mode)
+        self.matches = self._search(patterns, space_words, alnum_words)
+        if self.lazy:
+            self.filtered_list = []
+        else:
+            self.filtered_list = list(self.matches)
+            self.filtered_list.reverse()
+
+        # We use the trail to navigate back in the same order
+        self.trail = [(self.filter, [(0, len(self.filter))])]
+
+    def _search(self, patterns, space_words, alnum_words):
+        """
+        Traverse the history and generate the (line, match spans) pairs that
+        match the patterns, in order of priority
+        """
+        # Use the indexes to narrow down the lines that can possibly match:
+        #  * every pattern requires the alphanumeric words of the filter to
+        #    appear in the line (as substrings of its alphanumeric words)
+        #  * the first two patterns (split on whitespace) also require each
+        #    whitespace-separated word of the filter but the first to be a
+        #    prefix of a word in the line
+        self._sync_index()
+        alnum_candidates = self._lines_containing(alnum_words)
+        prefix_candidates = self._lines_with_prefixes(space_words[1:])
+        if prefix_candidates is None:
+            # A single word, only the alphanumeric words narrow it down
+            prefix_candidates = alnum_candidates
+        elif alnum_candidates is not None:
+            prefix_candidates &= alnum_candidates
+
+        seen = set()
+        cold_lines = None
+        for (pattern_index, pattern) in enumerate(patterns):
             #print '\n\n', pattern, '\n\n'
+            regex = re.compile(pattern, re.IGNORECASE)
+            if len(patterns) > 1 and pattern_index < 2:
+                candidates = prefix_candidates
+            else:
+                candidates = alnum_candidates
             for line in reversed(self.list):
-                if line in [l for (l, p) in self.filtered_list]:
-                    # We already added this line, skip
+                if line in seen or candidates is not None and not line in candidates:
+                    # We already added this line or it can't match, skip
                     continue
-                # No need to re.compile() this, the re library automatically caches compiled
-                # versions of the recently used expressions
-                matches = re.search(pattern, line, re.IGNORECASE)
+                matches = regex.search(line)
                 if matches:
-                    self.filtered_list.insert(0, (line, [matches.span(i) for i in range(1, matches.lastindex + 1)]))
-                    #print '\n\n', self.filtered_list[-1], '\n\n'
+                    seen.add(line)
+                    yield (line, [matches.span(i) for i in range(1, matches.lastindex + 1)])
 
-        # We use the trail to navigate back in the same order
-        self.trail = [(self.filter, [(0, len(self.filter))])]
+            if self.store is not None:
+                # Lines that are not loaded in memory are looked up on disk
+                # (once per search, and only when the loaded ones run out)
+                if cold_lines is None:
+                    cold_lines = self.store.search(alnum_words, exclude = set(self.list))
+                for line in cold_lines:
+                    if line in seen:
+                        continue
+                    matches = regex.search(line)
+                    if matches:
+                        seen.add(line)
+                        yield (line, [matches.span(i) for i in range(1, matches.lastindex + 1)])
 
     def up(self):
         """
@@ -91,6 +188,10 @@ class CommandHistory:
         """
         if self.filtered_list:
             self.trail.append(self.filtered_list.pop())
+        elif self.matches is not None:
+            match = next(self.matches, None)
+            if match is not None:
+                self.trail.append(match)
 
     def down(self):
         """
@@ -103,17 +204,104 @@ class CommandHistory:
         """Reset browsing through the history"""
         self.filter = ''
         self.filtered_list = []
+        self.matches = None
         self.trail = []
 
     def add(self, line):
         """Add a new line to the history"""
         if line:
             #print 'Adding "' + line + '"'
-            if line in self.list:
-                self.list.remove(line)
-            self.list.append(line)
+            self._sync_index()
+            self._move_to_end(line)
+            if self.store is not None:
+                with self.unsaved_lock:
+                    self.unsaved.append(line)
             self.reset()
 
+    def sync(self):
+        """
+        Merge the lines saved by other sessions since the history was loaded
+        (or last synced)
+        """
+        if self.store is None:
+            return
+        lines = self.store.tail()
+        if lines is None:
+            # The history file has been rewritten, load it again (keeping
+            # the lines that haven't been saved yet)
+            with self.unsaved_lock:
+                unsaved = list(self.unsaved)
+            self.list = self.store.recent(self.max_loaded)
+            self._sync_index()
+            lines = unsaved
+        else:
+            self._sync_index()
+        for line in lines:
+            if line:
+                self._move_to_end(line)
+
+    def _move_to_end(self, line):
+        """Add a line to the end of the history, or move it there"""
+        if line in self.list:
+            self.list.remove(line)
+        else:
+            self._index_line(line)
+        self.list.append(line)
+        self.indexed_list = self.list
+
     def current(self):
         """Return the current history item"""
-        return self.trail[-1] if self.trail else ('', [])
\ No newline at end of file
+        return self.trail[-1] if self.trail else ('', [])
+
+    def _sync_index(self):
+        """Rebuild the word indexes if the history list was replaced"""
+        if self.indexed_list is not self.list:
+            self.space_index = {}
+            self.space_words = []
+            self.alnum_index = {}
+            for line in self.list:
+                self._index_line(line)
+            self.indexed_list = self.list
+
+    def _index_line(self, line):
+        """Add a line to the word indexes"""
+        for word in re.findall('[^\\s]+', line):
+            word = word.lower()
+            if not word in self.space_index:
+                self.space_index[word] = set()
+                insort(self.space_words, word)
+            self.space_index[word].add(line)
+        for word in re.findall('[a-zA-Z0-9]+', line):
+            self.alnum_index.setdefault(word.lower(), set()).add(line)
+
+    def _lines_containing(self, words):
+        """
+        Return the set of lines that contain all the given alphanumeric words
+        (ignoring case), or None if there are no words to look for
+        """
+        result = None
+        for word in words:
+            word = word.lower()
+            lines = set()
+            for indexed_word, indexed_lines in self.alnum_index.iteritems():
+                if word in indexed_word:
+                    lines.update(indexed_lines)
+            result = lines if result is None else result & lines
+        return result
+
+    def _lines_with_prefixes(self, prefixes):
+        """
+        Return the set of lines that contain, for each of the given prefixes,
+        a whitespace-separated word starting with it (ignoring case); returns
+        None if there are no prefixes to look for
+        """
+        result = None
+        for prefix in prefixes:
+            prefix = prefix.lower()
+            lines = set()
+            i = bisect_left(self.space_words, prefix)
+            while i < len(self.space_words) and self.space_words[i].startswith(prefix):
+                lines.update(self.space_index[self.space_words[i]])
+                i += 1
+            result = lines if result is None else result & lines
+        return result
\ No newline at end of file
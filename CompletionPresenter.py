@@ -0,0 +1,118 @@
+#
+# Display of the suggestions of a Tab completion, in columns
+#
+# A completion can yield many thousand suggestions; rather than sizing the
+# columns over all of them and printing everything at once (which blocks the
+# shell for seconds), the lines are rendered lazily, one screen at a time,
+# and the user is asked before each further screen, so that the display can
+# be stopped midway.
+#
+from FuzzyIndex import fuzzy_positions
+
+def prefix_highlighter(prefix_len):
+    """Highlight the first prefix_len characters of the suggestions"""
+    return lambda s: [(s[:prefix_len], s[prefix_len:])]
+
+
+def wildcard_highlighter(matcher):
+    """Highlight the parts of the suggestions that the wildcards don't match"""
+    def highlight(s):
+        match = matcher.match(s)
+        if match is None:
+            return [('', s)]
+        parts = []
+        current_index = 0
+        for i in range(1, match.lastindex + 1):
+            parts.append((s[current_index : match.start(i)], s[match.start(i) : match.end(i)]))
+            current_index = match.end(i)
+        return parts
+    return highlight
+
+
+def fuzzy_highlighter(query):
+    """Highlight the characters of the suggestions that a fuzzy query matches"""
+    query = query.lower()
+    def highlight(s):
+        positions = fuzzy_positions(query, s)
+        if not positions:
+            return [('', s)]
+        parts = [('', s[:positions[0]])]
+        start = positions[0]
+        for (i, pos) in enumerate(positions):
+            following = positions[i + 1] if i + 1 < len(positions) else len(s)
+            if following != pos + 1:
+                # End of a run of matched characters
+                parts.append((s[start : pos + 1], s[pos + 1 : following]))
+                start = following
+        return parts
+    return highlight
+
+
+class CompletionPresenter:
+    """
+    Lay out a list of suggestions in columns, and render it screen by screen
+    """
+    # How many suggestions are measured to size the columns; the rare longer
+    # ones just push the rest of their line to the right
+    sample_size = 1000
+
+    # Space added after the longest suggestion
+    column_spacing = 10
+
+    def __init__(self, suggestions, highlight, width, height, colors=('', '')):
+        """
+        Lay out the suggestions for a buffer of the given width and a window
+        of the given height; highlight(s) splits a suggestion into
+        (highlighted, plain) parts, and colors holds the escape sequences of
+        the plain and highlighted text
+        """
+        self.suggestions = suggestions
+        self.highlight = highlight
+        self.height = max(height, 2)
+        (self.color_default, self.color_match) = colors
+
+        self.column_width = min(max([len(s) for s in self.sample()]) + self.column_spacing, width - 1)
+        if len(suggestions) > self.height / 4:
+            # We print multiple columns to save space
+            self.num_columns = max((width - 1) / self.column_width, 1)
+        else:
+            # We print a single column for clarity
+            self.num_columns = 1
+        self.num_lines = (len(suggestions) + self.num_columns - 1) / self.num_columns
+
+    def sample(self):
+        """The suggestions measured to size the columns, evenly spread"""
+        step = max(len(self.suggestions) / self.sample_size, 1)
+        return self.suggestions[::step]
+
+    def line(self, line):
+        """Render one line"""
+        cells = []
+        for index in range(line, len(self.suggestions), self.num_lines):
+            s = self.suggestions[index]
+            for (match, rest) in self.highlight(s):
+                cells.append(self.color_default + self.color_match + match + self.color_default + rest)
+            cells.append(self.color_default + ' ' * (self.column_width - len(s)))
+        return ''.join(cells)
+
+    def lines(self):
+        """Generate the rendered lines, in order"""
+        for line in range(self.num_lines):
+            yield self.line(line)
+
+    def show(self, write, more):
+        """
+        Write the lines with write(); when they don't fit in a screen (less a
+        line for prompting), call more(screens_left) before each further
+        screen, stopping if it returns False. Return the number of lines
+        written.
+        """
+        page_size = self.height - 1
+        written = 0
+        for line in range(self.num_lines):
+            if written > 0 and written % page_size == 0:
+                if not more((self.num_lines - written + page_size - 1) / page_size):
+                    break
+            write('\r' + self.line(line) + '\n')
+            written += 1
+        return written
@@ -0,0 +1,134 @@
+#
+# Tab completion on worker threads
+#
+# Completing a path on a slow network share can block in os.listdir for
+# seconds; run on the input thread, that left the keyboard dead. Instead, the
+# completions are computed here on worker threads: the input thread waits for
+# them only up to a short budget, then goes back to reading keys. A newer
+# completion (or any key press) cancels the pending one, and a result is only
+# used if the line it was computed for is still the one being edited.
+#
+import sys, threading
+from Queue import Queue
+
+class CompletionRequest(object):
+    """The completion of a line, computed on a worker thread"""
+    def __init__(self, line, complete):
+        self.line = line
+        self.complete = complete
+        self.cancelled = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+        # Set when the input thread stopped waiting for the result
+        self.detached = False
+        self.lock = threading.Lock()
+
+    def wait(self, timeout = None):
+        """
+        Wait for the result, up to timeout seconds; True if it's there,
+        otherwise the worker notifies when it is
+        """
+        self.done.wait(timeout)
+        with self.lock:
+            self.detached = not self.done.is_set()
+            return not self.detached
+
+    def cancel(self):
+        """Drop the request: it's not run if it hasn't started yet"""
+        self.cancelled = True
+
+    def get(self):
+        """The result, or the exception raised while completing"""
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+    def run(self):
+        """Compute the result; True if nobody is waiting for it"""
+        if not self.cancelled:
+            try:
+                self.result = self.complete(self.line)
+            except Exception:
+                self.error = sys.exc_info()
+        with self.lock:
+            self.done.set()
+            return self.detached
+
+
+class CompletionWorker:
+    """
+    Run completions on a pool of worker threads; only the latest request is
+    current, submitting a new one cancels it
+    """
+    # A completion stuck on an unresponsive share ties up its thread until it
+    # returns, so the pool grows as needed, up to this many threads
+    max_threads = 4
+
+    def __init__(self, notify = None):
+        # Called (on the worker thread) with each request that completes,
+        # without being cancelled, after the input thread stopped waiting for
+        # it, to wake up the input thread
+        self.notify = notify
+
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.idle = 0
+        self.current = None
+
+    def submit(self, line, complete):
+        """Queue the completion of a line with complete(line)"""
+        request = CompletionRequest(line, complete)
+        with self.lock:
+            if self.current is not None:
+                self.current.cancel()
+            self.current = request
+            if self.idle == 0 and len(self.threads) < self.max_threads:
+                thread = threading.Thread(target = self._run)
+                thread.daemon = True
+                self.threads.append(thread)
+                self.idle += 1
+                thread.start()
+        self.queue.put(request)
+        return request
+
+    def cancel(self):
+        """Cancel the current request, if any"""
+        with self.lock:
+            if self.current is not None:
+                self.current.cancel()
+                self.current = None
+
+    def result(self, line):
+        """
+        The result of the current request if it's ready and was made for this
+        line (None otherwise); the request is then no longer current
+        """
+        with self.lock:
+            request = self.current
+            if request is None or not request.done.is_set() or request.cancelled:
+                return None
+            self.current = None
+        if request.line != line:
+            return None
+        return request.get()
+
+    def _run(self):
+        """Body of the worker threads"""
+        while True:
+            request = self.queue.get()
+            with self.lock:
+                self.idle -= 1
+            try:
+                detached = request.run()
+            finally:
+                with self.lock:
+                    self.idle += 1
+            if detached and self.notify is not None:
+                # Under the lock, so that the request can't be cancelled (and
+                # the input thread move on) between the check and the notify
+                with self.lock:
+                    if not request.cancelled:
+                        self.notify(request)
@@ -0,0 +1,159 @@
+#
+# Cache of directory listings, for completing file names
+#
+# Completing used to list the directory and then stat every entry twice (is
+# it a directory? a file?) on each Tab press. The listings are cached here,
+# with the type of each entry, and taken again only when the modification
+# time of the directory changes; the current directory and the directories
+# completed lately are (re)listed ahead of time on a background thread.
+#
+import os, stat, time, threading
+from collections import OrderedDict
+from common import exec_exts
+
+try:
+    # Gets the type of the entries along with their names, without a stat
+    # per entry (on Windows)
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+class Candidate(object):
+    """An entry of a directory, as a completion candidate"""
+    __slots__ = ['name', 'key', 'is_dir', 'is_file', 'is_exec']
+
+    def __init__(self, name, is_dir, is_file):
+        self.name = name
+        self.key = name.lower()     # For case-insensitive matching
+        self.is_dir = is_dir
+        self.is_file = is_file
+        dot = self.key.rfind('.')
+        self.is_exec = is_file and dot >= 0 and self.key[dot:] in _exec_exts()
+
+
+def _exec_exts():
+    global _exec_exts_set
+    if _exec_exts_set is None:
+        _exec_exts_set = frozenset(exec_exts())
+    return _exec_exts_set
+
+_exec_exts_set = None
+
+
+def list_dir(dir):
+    """The entries of a directory, as Candidates (empty if it can't be listed)"""
+    try:
+        if scandir is not None:
+            return [Candidate(entry.name, entry.is_dir(), entry.is_file()) for entry in scandir(dir)]
+        return [_stat_candidate(dir, name) for name in os.listdir(dir)]
+    except OSError:
+        # Cannot complete, probably access denied
+        return []
+
+
+def _stat_candidate(dir, name):
+    """A Candidate typed by a single stat of the entry"""
+    try:
+        mode = os.stat(os.path.join(dir, name)).st_mode
+    except OSError:
+        # E.g. a broken link
+        return Candidate(name, False, False)
+    return Candidate(name, stat.S_ISDIR(mode), stat.S_ISREG(mode))
+
+
+class DirCache:
+    """
+    Listings of directories, as lists of Candidates, validated against the
+    modification time of the directory
+    """
+    # How many recently completed directories are refreshed in the background
+    max_recent = 16
+
+    # How many listings are kept (the least recently used are dropped)
+    max_listings = 32
+
+    # A listing taken this soon (in seconds) after the directory last changed
+    # may miss a change made within the same tick of its modification time,
+    # so it isn't trusted
+    mtime_slack = 2
+
+    def __init__(self):
+        # Listings as directory -> (mtime, entries), least recently used first
+        self.listings = OrderedDict()
+        self.lock = threading.Lock()
+
+        # The directories completed lately, most recent last
+        self.recent = OrderedDict()
+
+        # The directories to list in the background
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def listing(self, dir):
+        """The entries of a directory (empty if it can't be listed)"""
+        dir = self._key(dir)
+        with self.condition:
+            if dir in self.recent:
+                del self.recent[dir]
+            self.recent[dir] = True
+            if len(self.recent) > self.max_recent:
+                self.recent.popitem(last = False)
+        return self._refresh(dir)
+
+    def prefetch(self, dir):
+        """List a directory, and refresh the recent ones, in the background"""
+        with self.condition:
+            for d in [self._key(dir)] + list(self.recent):
+                self.pending[d] = True
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target = self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        """Body of the background thread"""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                dir = self.pending.popitem(last = False)[0]
+            try:
+                self._refresh(dir)
+            except Exception:
+                # Keep the thread alive, the directory will be listed when
+                # completing in it
+                pass
+
+    def _refresh(self, dir):
+        """The cached listing of a directory, taken again if out of date"""
+        mtime = self._mtime(dir)
+        if mtime is None:
+            with self.lock:
+                self.listings.pop(dir, None)
+            return []
+        with self.lock:
+            cached = self.listings.pop(dir, None)
+            if cached is not None and cached[0] == mtime:
+                self.listings[dir] = cached
+                return cached[1]
+        entries = self._list(dir)
+        if time.time() - mtime > self.mtime_slack:
+            with self.lock:
+                self.listings[dir] = (mtime, entries)
+                if len(self.listings) > self.max_listings:
+                    self.listings.popitem(last = False)
+        return entries
+
+    def _key(self, dir):
+        return os.path.normcase(os.path.abspath(dir))
+
+    def _mtime(self, dir):
+        try:
+            return os.stat(dir).st_mtime
+        except OSError:
+            return None
+
+    def _list(self, dir):
+        return list_dir(dir)
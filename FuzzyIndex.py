@@ -0,0 +1,163 @@
+#
+# Fuzzy matching of completion candidates
+#
+# In the 'fuzzy' completion mode, a name matches when it holds the typed
+# characters in order (e.g. "rdme" matches "README.txt"), and the matches are
+# ranked by how well the characters fall on the starts of the "words" of the
+# name (see name_word_starts) and on runs of consecutive characters.
+#
+# Matching the names one by one in Python is too slow for directories with
+# tens of thousands of entries; instead, the lowercase names of a listing are
+# joined into a single string once, so that a regex finds all the matches in
+# one pass, and only those are scored.
+#
+import re, sys
+from bisect import bisect_right
+from common import word_starts
+
+# Score of a matched character, and the bonuses and penalties on top of it
+SCORE_MATCH = 1
+BONUS_WORD_START = 8
+BONUS_FIRST_CHAR = 4
+BONUS_CONSECUTIVE = 5
+PENALTY_GAP = 1
+MAX_GAP_PENALTY = 3
+
+def _text(string):
+    """Bring a (possibly undecodable) name to unicode"""
+    if isinstance(string, unicode):
+        return string
+    return string.decode(sys.getfilesystemencoding() or 'ascii', 'replace')
+
+
+def _is_subsequence(query, key, start):
+    """Check whether the characters of query appear in order in key[start:]"""
+    for char in query:
+        start = key.find(char, start) + 1
+        if start == 0:
+            return False
+    return True
+
+
+def name_word_starts(name):
+    """
+    The starts of the "words" of a file name, as word_starts() finds them
+    except that a run of capitals is a single word (as in README or
+    XMLParser) and the extension has none, so that it doesn't outrank the
+    name itself
+    """
+    dot = name.rfind('.')
+    stem = name[:dot] if dot > 0 else name
+    return [i for i in word_starts(stem)
+            if not (i > 0 and stem[i].isupper() and stem[i - 1].isupper()
+                    and not stem[i + 1 : i + 2].islower())]
+
+
+def fuzzy_score(query, name, starts = None):
+    """
+    Score how well a (lowercase) query matches a name, higher is better; None
+    if the name doesn't hold the characters of the query in order. starts are
+    the word starts of the name, if already known.
+    """
+    match = _match(query, name, starts)
+    return match[0] if match is not None else None
+
+
+def fuzzy_positions(query, name):
+    """
+    The positions of the characters of a name that a (lowercase) query
+    matches, as scored by fuzzy_score(); None if it doesn't match
+    """
+    match = _match(query, name)
+    return match[1] if match is not None else None
+
+
+def _match(query, name, starts = None):
+    """The score of a match and the positions of the matched characters"""
+    key = name.lower()
+    if starts is None:
+        starts = name_word_starts(name)
+    score = 0
+    positions = []
+    pos = 0
+    prev = -2
+    for i, char in enumerate(query):
+        found = key.find(char, pos)
+        if found < 0:
+            return None
+        if found != prev + 1 and not found in starts:
+            # Rather take the character at the start of a later word, as long
+            # as the rest of the query still matches after it
+            for start in starts:
+                if start > found and key[start] == char and _is_subsequence(query[i + 1:], key, start + 1):
+                    found = start
+                    break
+        score += SCORE_MATCH
+        if found in starts:
+            score += BONUS_WORD_START
+            if found == 0:
+                score += BONUS_FIRST_CHAR
+        if found == prev + 1:
+            score += BONUS_CONSECUTIVE
+        elif prev >= 0:
+            score -= min(found - prev - 1, MAX_GAP_PENALTY) * PENALTY_GAP
+        prev = found
+        pos = found + 1
+        positions.append(found)
+    return (score, positions)
+
+
+class FuzzyIndex:
+    """
+    The lowercase names of a directory listing (a list of Candidates), joined
+    for fuzzy lookups
+    """
+    # How many of the matches (the closest ones) are scored
+    max_scored = 1000
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        keys = [_text(candidate.key).replace(u'\n', u' ') for candidate in candidates]
+        self.keys = u'\n'.join(keys)
+
+        # Where the key of each candidate starts in keys
+        self.offsets = []
+        pos = 0
+        for key in keys:
+            self.offsets.append(pos)
+            pos += len(key) + 1
+
+        # The word starts of the names scored so far, by candidate
+        self.starts = {}
+
+    def search(self, query):
+        """The candidates that match query, best first"""
+        query = _text(query).lower()
+        if query == u'':
+            return []
+
+        # Find the matches, noting where the query ends in each key: the
+        # sooner, the closer together (and to the start) its characters
+        pattern = re.compile(u'(' + re.escape(query[0])
+                             + u''.join([u'[^\n%s]*%s' % (re.escape(char), re.escape(char)) for char in query[1:]])
+                             + u')[^\n]*')
+        offsets = self.offsets
+        matches = []
+        for match in pattern.finditer(self.keys):
+            i = bisect_right(offsets, match.start()) - 1
+            matches.append((match.end(1) - offsets[i], i))
+
+        # Only the best of them are scored, the rest follow in that order
+        matches.sort()
+        ranked = [(-self._score(query, i), len(self.candidates[i].key), self.candidates[i].key, i)
+                  for (end, i) in matches[:self.max_scored]]
+        ranked.sort()
+        return [self.candidates[i] for (score, length, key, i) in ranked] \
+            + [self.candidates[i] for (end, i) in matches[self.max_scored:]]
+
+    def _score(self, query, i):
+        name = _text(self.candidates[i].name)
+        starts = self.starts.get(i)
+        if starts is None:
+            starts = self.starts[i] = name_word_starts(name)
+        return fuzzy_score(query, name, starts)
@@ -0,0 +1,361 @@
+#
+# Disk storage for the command history
+#
+# The history is kept in a plain UTF-8 text file, one command per line (the
+# same format PyCmd has always used), next to a compact index of the offsets at
+# which the lines start. Both files are memory-mapped when reading, so that the
+# history can be searched without decoding every line into a unicode object.
+#
+# The history file is a journal: executed commands are appended to it as they
+# come, from all the PyCmd sessions, and the most recent occurrence of a line
+# is the one that counts. Every now and then the journal is compacted, dropping
+# the duplicates and the lines beyond the history size. The sessions pick up
+# the lines appended by the others by reading the end of the file, and use a
+# lock file to keep out of each other's way while writing.
+#
+import os, sys, mmap, struct, zlib, threading
+from array import array
+from contextlib import contextmanager
+
+from common import replace_file, lock_file, unlock_file
+
+# Layout of the index file: a header (magic string, size of the indexed part of
+# the history file, CRC32 of the last indexed line) followed by the start
+# offset of each line, as little-endian 32-bit integers
+INDEX_MAGIC = 'PyCmdHI1'
+INDEX_HEADER = struct.Struct('<8sIi')
+INDEX_OFFSET = struct.Struct('<I')
+
+# Number of lines read at once when walking the history backwards
+BLOCK_LINES = 1024
+
+# The journal is compacted when it holds this many times more records than
+# the maximum history size
+COMPACT_FACTOR = 2
+
+
+class MappedOffsets(object):
+    """Read-only sequence view over the offsets in a mapped index file"""
+    def __init__(self, index_map):
+        self.index_map = index_map
+        self.count = (len(index_map) - INDEX_HEADER.size) / INDEX_OFFSET.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError('offset index out of range')
+        return INDEX_OFFSET.unpack_from(self.index_map, INDEX_HEADER.size + i * INDEX_OFFSET.size)[0]
+
+
+class HistoryStore:
+    """
+    Access the command history file through a memory-mapped line index
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.lock_filename = filename + '.lock'
+
+        # Serializes the writes to the history and index files between the
+        # threads of this session (the history is saved from a background
+        # thread, see HistoryWriter.py); the lock file does the same between
+        # sessions. The lock file is open while this session holds the lock.
+        self.lock = threading.RLock()
+        self.lock_file = None
+
+        # The position up to which this session has read the history file,
+        # as a (start, end, CRC32) triple describing the last line read; used
+        # to read the lines added by other sessions since then
+        self.position = None
+
+    @contextmanager
+    def locked(self):
+        """
+        Lock the history files against changes by other threads and sessions
+        (the lock can be taken again while held)
+        """
+        with self.lock:
+            if self.lock_file is not None:
+                yield
+                return
+            self.lock_file = open(self.lock_filename, 'a+b')
+            try:
+                lock_file(self.lock_file)
+                try:
+                    yield
+                finally:
+                    unlock_file(self.lock_file)
+            finally:
+                self.lock_file.close()
+                self.lock_file = None
+
+    @contextmanager
+    def mapped(self):
+        """
+        Map the history file and its (up to date) index for reading; yields a
+        (data, offsets) pair. The files are unmapped right afterwards, so that
+        other PyCmd sessions are free to rewrite them in the meantime.
+        """
+        data_file = None
+        data = None
+        index_map = None
+        try:
+            with self.locked():
+                if os.path.isfile(self.filename) and os.path.getsize(self.filename) > 0:
+                    data_file = open(self.filename, 'rb')
+                    data = mmap.mmap(data_file.fileno(), 0, access = mmap.ACCESS_READ)
+                    (offsets, index_map) = self._load_index(data)
+                else:
+                    (data, offsets) = ('', [])
+            yield data, offsets
+        finally:
+            if index_map is not None:
+                index_map.close()
+            if isinstance(data, mmap.mmap):
+                data.close()
+            if data_file is not None:
+                data_file.close()
+
+    def __len__(self):
+        """Number of records in the history file (including duplicates)"""
+        with self.mapped() as (data, offsets):
+            return len(offsets)
+
+    def recent(self, count):
+        """
+        Return the most recent (distinct) lines in the history, at most count
+        of them, oldest first
+        """
+        with self.mapped() as (data, offsets):
+            lines = [self._decode(raw) for raw in self._distinct_lines(data, offsets, count)]
+            end = data.rfind('\n') + 1
+            start = offsets[-1] if offsets else 0
+            self.position = (start, end, zlib.crc32(data[start : end]))
+        lines.reverse()
+        return lines
+
+    def tail(self):
+        """
+        Return the lines appended to the history file (by any session) since
+        it was last read through recent() or tail(), oldest first. Returns
+        None if the file has been rewritten in the meantime (e.g. compacted),
+        in which case it should be read again.
+        """
+        if self.position is None:
+            return None
+        (start, end, crc) = self.position
+        try:
+            history_file = open(self.filename, 'rb')
+        except IOError:
+            return [] if end == 0 else None
+        try:
+            # Check that the last line we have read is still in place, then
+            # read what comes after it
+            history_file.seek(start)
+            last_line = history_file.read(end - start)
+            if len(last_line) != end - start or zlib.crc32(last_line) != crc:
+                return None
+            new_data = history_file.read()
+        finally:
+            history_file.close()
+
+        # Skip the last line, if it is still being written
+        new_end = new_data.rfind('\n') + 1
+        if new_end == 0:
+            return []
+        raw_lines = new_data[: new_end - 1].split('\n')
+        new_start = new_end - len(raw_lines[-1]) - 1
+        self.position = (end + new_start, end + new_end, zlib.crc32(new_data[new_start : new_end]))
+        return [self._decode(raw) for raw in raw_lines]
+
+    def search(self, words, exclude = ()):
+        """
+        Return the distinct lines in the history that contain all the given
+        (ASCII alphanumeric) words, ignoring case, most recent first. Lines in
+        exclude are skipped. Only the matching lines are decoded.
+        """
+        words = [str(w).lower() for w in words]
+        lines = []
+        seen = set()
+        with self.mapped() as (data, offsets):
+            for raw in self._reversed_lines(data, offsets):
+                if raw in seen:
+                    continue
+                seen.add(raw)
+                raw_lower = raw.lower()
+                for word in words:
+                    if not word in raw_lower:
+                        break
+                else:
+                    line = self._decode(raw)
+                    if not line in exclude:
+                        lines.append(line)
+        return lines
+
+    def append(self, lines, length):
+        """
+        Append a list of lines to the history journal; the journal is compacted
+        once it grows well over length records
+        """
+        if not lines:
+            return
+        with self.locked():
+            history_file = open(self.filename, 'ab')
+            history_file.write(''.join([line.encode('utf8') + '\n' for line in lines]))
+            history_file.close()
+        if len(self) > COMPACT_FACTOR * length:
+            try:
+                self.compact(length)
+            except (IOError, OSError):
+                # The file is busy (e.g. mapped by another session), try again
+                # on the next command
+                pass
+
+    def compact(self, length):
+        """
+        Rewrite the history file without duplicates, keeping the most recent
+        length lines
+        """
+        with self.locked():
+            with self.mapped() as (data, offsets):
+                size = data.rfind('\n') + 1
+                history = self._distinct_lines(data, offsets, length)
+                tail = data[size :]     # An unfinished line, if any
+            history.reverse()
+            self._write(history, tail)
+
+    def _write(self, raw_lines, tail = ''):
+        """
+        Write the history file and its index from a list of encoded lines,
+        followed by a tail of raw (not yet indexed) records
+        """
+        offsets = array('I')
+        size = 0
+        for raw in raw_lines:
+            offsets.append(size)
+            size += len(raw) + 1
+        replace_file(self.filename, ''.join([raw + '\n' for raw in raw_lines]) + tail)
+        last_crc = zlib.crc32(raw_lines[-1]) if raw_lines else 0
+        self._write_index(offsets, size, last_crc)
+
+    def _write_index(self, offsets, size, last_crc, append = False):
+        """Write (or append to) the index file"""
+        if sys.byteorder != 'little':
+            offsets = array('I', offsets)
+            offsets.byteswap()
+        header = INDEX_HEADER.pack(INDEX_MAGIC, size, last_crc)
+        if append:
+            index_file = open(self.index_filename, 'r+b')
+            index_file.seek(0, os.SEEK_END)
+            index_file.write(offsets.tostring())
+            index_file.seek(0)
+            index_file.write(header)
+            index_file.close()
+        else:
+            replace_file(self.index_filename, header + offsets.tostring())
+
+    def _load_index(self, data):
+        """
+        Make sure the index matches the (mapped) history file, updating or
+        rebuilding it if needed; return the offsets and the index mapping
+        """
+        (offsets, index_map) = self._map_index()
+        indexed_size = 0
+        if offsets is not None:
+            (_, indexed_size, last_crc) = INDEX_HEADER.unpack_from(index_map)
+            if indexed_size > len(data) \
+                    or indexed_size > 0 and (len(offsets) == 0
+                                             or data[indexed_size - 1] != '\n'
+                                             or zlib.crc32(data[offsets[-1] : indexed_size - 1]) != last_crc):
+                # The history file has been rewritten, start from scratch
+                index_map.close()
+                (offsets, index_map) = (None, None)
+                indexed_size = 0
+
+        # Index the lines added at the end of the file since the last time
+        (new_offsets, size) = self._scan_lines(data, indexed_size)
+        if offsets is not None and not new_offsets:
+            return offsets, index_map
+
+        if index_map is not None:
+            index_map.close()
+        if new_offsets:
+            last_crc = zlib.crc32(data[new_offsets[-1] : size - 1])
+        elif offsets is None:
+            last_crc = 0
+        try:
+            self._write_index(new_offsets, size, last_crc, append = offsets is not None)
+            (offsets, index_map) = self._map_index()
+        except (IOError, OSError):
+            (offsets, index_map) = (None, None)
+        if offsets is None:
+            # Can't use the index file, index the whole history in memory
+            offsets = self._scan_lines(data, 0)[0]
+        return offsets, index_map
+
+    def _scan_lines(self, data, start):
+        """
+        Find the start offsets of the (complete) lines in data from the given
+        position onwards; returns them together with the end of the last line
+        """
+        offsets = array('I')
+        end = data.find('\n', start)
+        while end >= 0:
+            offsets.append(start)
+            start = end + 1
+            end = data.find('\n', start)
+        return offsets, start
+
+    def _map_index(self):
+        """Map the index file, if present and valid"""
+        if not os.path.isfile(self.index_filename) \
+                or os.path.getsize(self.index_filename) < INDEX_HEADER.size:
+            return None, None
+        index_file = open(self.index_filename, 'rb')
+        try:
+            index_map = mmap.mmap(index_file.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            index_file.close()
+        if INDEX_HEADER.unpack_from(index_map)[0] != INDEX_MAGIC:
+            index_map.close()
+            return None, None
+        return MappedOffsets(index_map), index_map
+
+    def _reversed_lines(self, data, offsets):
+        """
+        Generate the (complete) lines of the history file as encoded strings,
+        most recent first; the file is split in blocks of lines at a time
+        """
+        end = data.rfind('\n')
+        last = len(offsets)
+        while last > 0:
+            first = max(0, last - BLOCK_LINES)
+            block = data[offsets[first] : end].split('\n')
+            block.reverse()
+            for raw in block:
+                yield raw
+            end = offsets[first] - 1
+            last = first
+
+    def _distinct_lines(self, data, offsets, count):
+        """
+        Return the most recent distinct lines in the history, at most count
+        of them, as encoded strings, most recent first
+        """
+        lines = []
+        seen = set()
+        for raw in self._reversed_lines(data, offsets):
+            if len(lines) >= count:
+                break
+            if not raw in seen:
+                seen.add(raw)
+                lines.append(raw)
+        return lines
+
+    def _decode(self, raw):
+        """Decode a line of the history file"""
+        return raw.decode('utf8', 'replace').rstrip(u'\r')
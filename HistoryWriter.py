@@ -0,0 +1,86 @@
+#
+# Background persistence of the command and directory histories
+#
+# Saving the histories after each command used to delay the next prompt by
+# the time it takes to write them to disk; instead, the writes are queued here
+# and done from a background thread.
+#
+import sys, time, threading
+from collections import OrderedDict
+
+class HistoryWriter:
+    """
+    Run queued history writes on a background thread, at most once per
+    interval (in seconds); queued writes with the same key are coalesced, only
+    the last one is run
+    """
+    def __init__(self, interval = 0.5):
+        self.interval = interval
+
+        # The queued writes, as key -> (function, arguments)
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+
+        # Serializes the writes done by the thread and by flush()
+        self.write_lock = threading.Lock()
+
+        # An exception raised by a background write, passed on to the main
+        # thread by the next call to schedule() or flush()
+        self.error = None
+
+        self.thread = None
+
+    def schedule(self, key, func, *args):
+        """Queue a write, replacing any pending write with the same key"""
+        self._raise_error()
+        with self.condition:
+            if key in self.pending:
+                del self.pending[key]
+            self.pending[key] = (func, args)
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target = self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def flush(self):
+        """Run the pending writes right away; call before exiting"""
+        self._write_pending()
+        self._raise_error()
+
+    def _run(self):
+        """Body of the writer thread"""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            try:
+                self._write_pending()
+            except Exception:
+                self.error = sys.exc_info()
+            time.sleep(self.interval)
+
+    def _write_pending(self):
+        """
+        Run the queued writes, in the order they were queued; a failed write
+        doesn't prevent the others from running
+        """
+        error = None
+        with self.write_lock:
+            with self.condition:
+                pending = self.pending
+                self.pending = OrderedDict()
+            for (func, args) in pending.itervalues():
+                try:
+                    func(*args)
+                except Exception:
+                    if error is None:
+                        error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def _raise_error(self):
+        """Re-raise an exception from the background thread, if any"""
+        if self.error is not None:
+            (error, self.error) = (self.error, None)
+            raise error[0], error[1], error[2]
@@ -0,0 +1,239 @@
+#
+# Index of the executables found in the PATH, for completing the first token
+# of a command
+#
+# Listing every directory of the PATH (and checking every entry in it) on each
+# Tab press is slow when the PATH is long; instead, the executables are
+# indexed once, and a directory is listed again only when its modification
+# time changes, or when it is added to the PATH.
+#
+# The index is also saved to a file, shared by all the sessions, so that the
+# first Tab press in a new window doesn't have to list the whole PATH either.
+# The file is read whole and closed right away (a session keeping it open, or
+# mapped, would keep the others from replacing it on Windows), then looked up
+# in place, without parsing the entries: it holds
+#    * a header: the magic, the length of the PATH the index was built for,
+#      the number of directories in it and the number of executables
+#    * that PATH
+#    * for each of its directories: the modification time (-1 if missing) and
+#      the position and length of the list of its executables
+#    * the positions of the index entries, plus the end of the last one
+#    * the lists of executables of the directories, '\0'-separated
+#    * the index entries, "lowercase name\0name\0", sorted
+# all in UTF-8.
+#
+import os, sys, struct, threading
+from bisect import bisect_left
+from common import expand_env_vars, replace_file
+from DirCache import list_dir
+
+INDEX_MAGIC = 'PyCmdPX1'
+INDEX_HEADER = struct.Struct('<8sIII')
+INDEX_DIR = struct.Struct('<dII')
+INDEX_OFFSET = struct.Struct('<I')
+
+
+class SavedPathIndex(object):
+    """Read-only view of the contents of an index file"""
+    def __init__(self, data):
+        self.data = data
+        (magic, path_len, dir_count, self.count) = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            raise ValueError('not a PATH index')
+        pos = INDEX_HEADER.size
+        self.path = data[pos : pos + path_len]
+        pos += path_len
+        self.dirs = [INDEX_DIR.unpack_from(data, pos + i * INDEX_DIR.size) for i in range(dir_count)]
+        self.offsets = pos + dir_count * INDEX_DIR.size
+        if self.offsets + (self.count + 1) * INDEX_OFFSET.size > len(data) \
+                or self._offset(self.count) != len(data):
+            raise ValueError('truncated PATH index')
+
+    def mtime(self, i):
+        """The modification time of the i-th directory of the PATH"""
+        mtime = self.dirs[i][0]
+        return None if mtime < 0 else mtime
+
+    def listing(self, i):
+        """The executables of the i-th directory of the PATH"""
+        (mtime, start, length) = self.dirs[i]
+        if length == 0:
+            return []
+        return self.data[start : start + length].decode('utf8').split(u'\0')
+
+    def complete(self, prefix):
+        prefix = prefix.lower().encode('utf8')
+        # The matching entries are contiguous, and '\xff' never appears in UTF-8
+        start = self._offset(self._bisect(prefix))
+        stop = self._offset(self._bisect(prefix + '\xff'))
+        return self.data[start : stop].decode('utf8').split(u'\0')[1::2]
+
+    def _bisect(self, key):
+        """The position of the first entry not below key"""
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _offset(self, i):
+        return INDEX_OFFSET.unpack_from(self.data, self.offsets + i * INDEX_OFFSET.size)[0]
+
+    def _key(self, i):
+        start = self._offset(i)
+        return self.data[start : self.data.find('\0', start)]
+
+
+class PathIndex:
+    """
+    The executables in the directories of the PATH, sorted by lowercase name
+    for prefix lookups; when several directories hold the same name, the
+    first one in the PATH wins, as it does when running the command
+    """
+    def __init__(self, filename = None):
+        # The file the index is saved to (and read from first), if any
+        self.filename = filename
+        self.loaded = False
+
+        # The PATH the index was built for
+        self.path = None
+
+        # The executables of each directory, as dir -> (mtime, names); names
+        # is None for a directory only listed in the saved index
+        self.dirs = {}
+
+        # The lowercase names, sorted, and the names they stand for
+        self.keys = []
+        self.names = {}
+
+        # The contents of the index file, while it's up to date
+        self.saved = None
+        self.saved_dirs = {}
+
+        # Completions may run on several threads at once
+        self.lock = threading.Lock()
+
+    def update(self):
+        """Bring the index up to date with the PATH and its directories"""
+        with self.lock:
+            self._update()
+
+    def _update(self):
+        if self.filename is not None and not self.loaded:
+            self.loaded = True
+            self._load()
+        path = os.environ.get('PATH', '')
+        changed = path != self.path
+        dirs = self._path_dirs(path)
+        for dir in dirs:
+            mtime = self._mtime(dir)
+            if not dir in self.dirs or self.dirs[dir][0] != mtime:
+                self.dirs[dir] = (mtime, self._list(dir))
+                changed = True
+        if changed:
+            for dir in self.dirs.keys():
+                if not dir in dirs:
+                    del self.dirs[dir]
+            names = {}
+            for dir in dirs:
+                for name in self._listing(dir):
+                    names.setdefault(name.lower(), name)
+            self.keys = sorted(names)
+            self.names = names
+            self.path = path
+            self.saved = None
+            self.saved_dirs = {}
+            if self.filename is not None:
+                self._save(dirs)
+
+    def complete(self, prefix):
+        """The executables whose name starts with prefix (case ignored), sorted"""
+        with self.lock:
+            if self.saved is not None:
+                return self.saved.complete(prefix)
+            prefix = prefix.lower()
+            start = bisect_left(self.keys, prefix)
+            stop = bisect_left(self.keys, prefix + u'\uffff')
+            return [self.names[key] for key in self.keys[start:stop]]
+
+    def _listing(self, dir):
+        """The executables of a directory of the PATH"""
+        names = self.dirs[dir][1]
+        if names is None:
+            names = self.saved.listing(self.saved_dirs[dir])
+            self.dirs[dir] = (self.dirs[dir][0], names)
+        return names
+
+    def _load(self):
+        """Start from the index file, if it can be read"""
+        try:
+            index_file = open(self.filename, 'rb')
+        except IOError:
+            return
+        try:
+            saved = SavedPathIndex(index_file.read())
+        except (ValueError, EnvironmentError, struct.error):
+            # Empty or damaged, it will be rewritten
+            return
+        finally:
+            index_file.close()
+        dirs = self._path_dirs(saved.path)
+        if len(dirs) != len(saved.dirs):
+            return
+        self.saved = saved
+        self.saved_dirs = dict([(dir, i) for (i, dir) in enumerate(dirs)])
+        self.dirs = dict([(dir, (saved.mtime(i), None)) for (i, dir) in enumerate(dirs)])
+        self.path = saved.path
+
+    def _save(self, dirs):
+        """Save the index to the file"""
+        path = self.path
+        listings = [u'\0'.join(self.dirs[dir][1]).encode('utf8') for dir in dirs]
+        entries = sorted([key.encode('utf8') + '\0' + name.encode('utf8') + '\0'
+                          for (key, name) in self.names.iteritems()])
+        pos = INDEX_HEADER.size + len(path) + len(dirs) * INDEX_DIR.size \
+              + (len(entries) + 1) * INDEX_OFFSET.size
+        table = []
+        for (dir, listing) in zip(dirs, listings):
+            mtime = self.dirs[dir][0]
+            table.append(INDEX_DIR.pack(-1 if mtime is None else mtime, pos, len(listing)))
+            pos += len(listing)
+        offsets = []
+        for entry in entries + ['']:
+            offsets.append(INDEX_OFFSET.pack(pos))
+            pos += len(entry)
+        data = ''.join([INDEX_HEADER.pack(INDEX_MAGIC, len(path), len(dirs), len(entries)), path]
+                       + table + offsets + listings + entries)
+        try:
+            replace_file(self.filename, data)
+        except EnvironmentError:
+            # Another session may have it open; it's only a cache
+            pass
+
+    def _path_dirs(self, path):
+        """The directories of the PATH, without duplicates"""
+        dirs = []
+        for dir in path.split(os.pathsep):
+            if dir != '':
+                try:
+                    dir = expand_env_vars(dir.decode(sys.getfilesystemencoding()))
+                except UnicodeDecodeError:
+                    continue
+                if not dir in dirs:
+                    dirs.append(dir)
+        return dirs
+
+    def _mtime(self, dir):
+        try:
+            return os.stat(dir).st_mtime
+        except OSError:
+            return None
+
+    def _list(self, dir):
+        """The executables of a directory"""
+        # (Names that can't be decoded are returned as str, skip them)
+        return [candidate.name for candidate in list_dir(dir)
+                if candidate.is_exec and isinstance(candidate.name, unicode)]
@@ -7,11 +7,15 @@ import console
 from common import *
 from InputState import ActionCode, InputState
 from DirHistory import DirHistory
+from CompletionPresenter import CompletionPresenter, prefix_highlighter, wildcard_highlighter, fuzzy_highlighter
+from CompletionWorker import CompletionWorker
+from HistoryStore import HistoryStore
+from HistoryWriter import HistoryWriter
 from console import *
 from completion import *
 from pycmd_public import color
 from configuration import appearance, behavior, apply_settings, sanitize as sanitize_settings, get_hooks, hook_types
-from aliases import get_alias, alias_main
+from aliases import get_alias, load_aliases, alias_main
 from userconfig import init_user, get_custom_command
 import win32api
 
@@ -20,6 +24,16 @@ pycmd_install_dir = None
 state = None
 dir_hist = None
 tmpfile = None
+history_writer = None
+
+# How long (in seconds) Tab waits for the completion before giving the
+# keyboard back
+completion_budget = 0.3
+
+# Virtual key code (unassigned by Windows) of the event posted to the console
+# input when a completion finishes in the background
+completion_ready_key = 0xE8
+completion_worker = CompletionWorker(notify = lambda request: write_input(completion_ready_key, 0))
 
 def init():
     sys.stdout = ColorOutputStream()
@@ -46,8 +60,15 @@ def init():
     global state
     state = InputState()
 
+    # Histories are saved in the background
+    global history_writer
+    history_writer = HistoryWriter()
+
     # Read/initialize command history
-    state.history.list = read_history(pycmd_data_dir + '\\history')
+    state.history.load(HistoryStore(pycmd_data_dir + '\\history'))
+
+    # The index of the executables in the PATH is shared by the sessions
+    path_index.filename = pycmd_data_dir + '\\path_index'
 
     # Read/initialize directory history
     global dir_hist
@@ -65,6 +86,7 @@ def init():
     signal.signal(signal.SIGINT, signal_handler)
 
 def deinit():
+    history_writer.flush()
     os.remove(tmpfile)
 
 def main():
@@ -149,6 +171,10 @@ def main():
         dir_hist.shown = False
         print
 
+        # List the current directory (and refresh the ones completed lately)
+        # ahead of the next Tab
+        dir_cache.prefetch(os.getcwd())
+
         while True:
             # Update console title and environment
             curdir = os.getcwd()
@@ -205,6 +231,9 @@ def main():
 
             # Read and process a keyboard event
             rec = read_input()
+            if rec.VirtualKeyCode != completion_ready_key and not is_control_only(rec):
+                # The line is about to change, drop any pending completion
+                completion_worker.cancel()
             select = auto_select or is_shift_pressed(rec)
 
             # Will be overriden if Shift-PgUp/Dn is pressed
@@ -231,9 +260,7 @@ def main():
                         scrolling = False
                     else:
                         state.handle(ActionCode.ACTION_ESCAPE)
-                        save_history(state.history.list,
-                                     pycmd_data_dir + '\\history',
-                                     1000)
+                        save_command_history()
                         auto_select = False
                 elif rec.VirtualKeyCode == 65:          # Ctrl-A
                     state.handle(ActionCode.ACTION_HOME, select)
@@ -295,9 +322,7 @@ def main():
                         if changed:
                             state.prev_prompt = state.prompt
                             state.prompt = appearance.prompt()
-                        save_history(dir_hist.locations,
-                                     pycmd_data_dir + '\\dir_history',
-                                     dir_hist.max_len)
+                        save_dir_history()
                         if dir_hist.shown:
                             dir_hist.display()
                             sys.stdout.write(state.prev_prompt)
@@ -357,6 +382,8 @@ def main():
                         state.handle(ActionCode.ACTION_NEXT)
                     elif rec.VirtualKeyCode == 46:      # Delete
                         state.handle(ActionCode.ACTION_DELETE)
+                    elif rec.VirtualKeyCode == completion_ready_key:   # Background completion done
+                        show_completion(completion_worker.result(state.before_cursor))
                 elif recChar == chr(13):               # Enter
                     state.history.reset()
                     break
@@ -365,94 +392,27 @@ def main():
                         scrolling = False
                     else:
                         state.handle(ActionCode.ACTION_ESCAPE)
-                        save_history(state.history.list,
-                                     pycmd_data_dir + '\\history',
-                                     1000)
+                        save_command_history()
                         auto_select = False
                 elif recChar == '\t':                  # Tab
-                    sys.stdout.write(state.after_cursor)        # Move cursor to the end
-
-                    tokens = parse_line(state.before_cursor)
-                    if tokens == [] or state.before_cursor[-1] in sep_chars:
-                        tokens.append('')   # This saves some checks later on
-                    if tokens[-1].strip('"').count('%') % 2 == 1:
-                        (completed, suggestions) = complete_env_var(state.before_cursor)
-                    elif has_wildcards(tokens[-1]):
-                        (completed, suggestions)  = complete_wildcard(state.before_cursor)
-                    else:
-                        (completed, suggestions)  = complete_file(state.before_cursor)
-
-                    # Show multiple completions if available
-                    if len(suggestions) > 1:
-                        dir_hist.shown = False  # The displayed dirhist is no longer valid
-                        column_width = max([len(s) for s in suggestions]) + 10
-                        if column_width > console.get_buffer_size()[0] - 1:
-                            column_width = console.get_buffer_size()[0] - 1
-                        if len(suggestions) > (get_viewport()[3] - get_viewport()[1]) / 4:
-                            # We print multiple columns to save space
-                            num_columns = (console.get_buffer_size()[0] - 1) / column_width
-                        else:
-                            # We print a single column for clarity
-                            num_columns = 1
-                        num_lines = len(suggestions) / num_columns
-                        if len(suggestions) % num_columns != 0:
-                            num_lines += 1
-
-                        num_screens = 1.0 * num_lines / (get_viewport()[3] - get_viewport()[1])
-                        if num_screens >= 0.9:
-                            # We ask for confirmation before displaying many completions
-                            (c_x, c_y) = get_cursor()
-                            offset_from_bottom = console.get_buffer_size()[1] - c_y
-                            message = ' Scroll ' + str(int(round(num_screens))) + ' screens? [Tab] '
-                            sys.stdout.write('\n' + message)
-                            rec = read_input()
-                            move_cursor(c_x, console.get_buffer_size()[1] - offset_from_bottom)
-                            sys.stdout.write('\n' + ' ' * len(message))
-                            move_cursor(c_x, console.get_buffer_size()[1] - offset_from_bottom)
-                            if recChar != '\t':
-                                continue
-
-                        sys.stdout.write('\n')
-                        for line in range(0, num_lines):
-                            # Print one line
-                            sys.stdout.write('\r')
-                            for column in range(0, num_columns):
-                                if line + column * num_lines < len(suggestions):
-                                    s = suggestions[line + column * num_lines]
-                                    if has_wildcards(tokens[-1]):
-                                        # Print wildcard matches in a different color
-                                        tokens = parse_line(completed.rstrip('\\'))
-                                        token = tokens[-1].replace('"', '')
-                                        (_, _, prefix) = token.rpartition('\\')
-                                        match = wildcard_to_regex(prefix + '*').match(s)
-                                        current_index = 0
-                                        for i in range(1, match.lastindex + 1):
-                                            sys.stdout.write(color.Fore.DEFAULT + color.Back.DEFAULT +
-                                                         appearance.colors.completion_match +
-                                                         s[current_index : match.start(i)] +
-                                                         color.Fore.DEFAULT + color.Back.DEFAULT +
-                                                         s[match.start(i) : match.end(i)])
-                                            current_index = match.end(i)
-                                        sys.stdout.write(color.Fore.DEFAULT + color.Back.DEFAULT + ' ' * (column_width - len(s)))
-                                    else:
-                                        # Print the common part in a different color
-                                        common_prefix_len = len(find_common_prefix(state.before_cursor, suggestions))
-                                        sys.stdout.write(color.Fore.DEFAULT + color.Back.DEFAULT +
-                                                     appearance.colors.completion_match +
-                                                     s[:common_prefix_len] +
-                                                     color.Fore.DEFAULT + color.Back.DEFAULT +
-                                                     s[common_prefix_len : ])
-                                        sys.stdout.write(color.Fore.DEFAULT + color.Back.DEFAULT + ' ' * (column_width - len(s)))
-                            sys.stdout.write('\n')
-                        state.reset_prev_line()
-                    state.handle(ActionCode.ACTION_COMPLETE, completed)
+                    # Complete on a worker thread, so that a slow file system
+                    # doesn't freeze the keyboard; a completion that takes
+                    # longer than the budget is shown when it's ready
+                    load_aliases()
+                    request = completion_worker.submit(state.before_cursor,
+                                                       lambda line: complete_line(line, behavior.completion_mode))
+                    if request.wait(completion_budget):
+                        show_completion(completion_worker.result(state.before_cursor))
                 elif rec.Char == chr(8):                # Backspace
                     state.handle(ActionCode.ACTION_BACKSPACE)
                 else:                                   # Regular character
                     state.handle(ActionCode.ACTION_INSERT, rec.Char)
 
 
-        # Done reading line, now execute
+        # Done reading line, now execute; drop the notification of a
+        # completion that finished in the meantime, so that the command
+        # doesn't read it as a key press
+        discard_input(completion_ready_key)
         sys.stdout.write(state.after_cursor)        # Move cursor to the end
         sys.stdout.write(color.Fore.DEFAULT + color.Back.DEFAULT)
         line = (state.before_cursor + state.after_cursor).strip()
@@ -465,16 +425,59 @@ def main():
 
         # Add to history
         state.history.add(line)
-        save_history(state.history.list,
-                     pycmd_data_dir + '\\history',
-                     1000)
+        save_command_history()
 
 
         # Add to dir history
         dir_hist.visit_cwd()
-        save_history(dir_hist.locations,
-                     pycmd_data_dir + '\\dir_history',
-                     dir_hist.max_len)
+        save_dir_history()
+
+
+def show_completion(result):
+    """Apply a completion, showing the suggestions if there are several"""
+    if result is None:
+        # Cancelled, or computed for a line since edited
+        return
+    (completed, suggestions) = result
+    sys.stdout.write(state.after_cursor)        # Move cursor to the end
+
+    # Show multiple completions if available
+    if len(suggestions) > 1:
+        dir_hist.shown = False  # The displayed dirhist is no longer valid
+        tokens = parse_line(state.before_cursor)
+        if tokens == [] or state.before_cursor[-1] in sep_chars:
+            tokens.append('')   # This saves some checks later on
+        if has_wildcards(tokens[-1]):
+            # Print wildcard matches in a different color
+            token = parse_line(completed.rstrip('\\'))[-1].replace('"', '')
+            (_, _, prefix) = token.rpartition('\\')
+            highlight = wildcard_highlighter(wildcard_to_regex(prefix + '*'))
+        elif isinstance(suggestions, FuzzyCompletions):
+            # Print the characters matched by the fuzzy completion
+            highlight = fuzzy_highlighter(suggestions.query)
+        else:
+            # Print the common part in a different color
+            highlight = prefix_highlighter(len(find_common_prefix(state.before_cursor, suggestions)))
+        presenter = CompletionPresenter(suggestions, highlight,
+                                        console.get_buffer_size()[0],
+                                        get_viewport()[3] - get_viewport()[1],
+                                        (color.Fore.DEFAULT + color.Back.DEFAULT,
+                                         appearance.colors.completion_match))
+
+        def more(screens_left):
+            # Ask before displaying each further screen
+            message = ' Scroll ' + str(screens_left) + ' more screens? [Tab] '
+            sys.stdout.write('\r' + message)
+            rec = read_input()
+            while rec.VirtualKeyCode == completion_ready_key:
+                rec = read_input()
+            sys.stdout.write('\r' + ' ' * len(message) + '\r')
+            return (rec.CU.Char if PYPY else rec.Char) == '\t'
+
+        sys.stdout.write('\n')
+        presenter.show(sys.stdout.write, more)
+        state.reset_prev_line()
+    state.handle(ActionCode.ACTION_COMPLETE, completed)
 
 
 def internal_cd(args):
@@ -649,6 +652,20 @@ def signal_handler(signum, frame):
         write_input(67, 0x0008)
 
 
+def save_command_history():
+    """Save the new commands in the history (in the background)"""
+    history_writer.schedule('history', state.history.save, behavior.history_size)
+
+
+def save_dir_history():
+    """Save the directory history (in the background)"""
+    history_writer.schedule('dir_history',
+                            save_history,
+                            list(dir_hist.locations),
+                            pycmd_data_dir + '\\dir_history',
+                            dir_hist.max_len)
+
+
 def save_history(lines, filename, length):
     """
     Save a list of unique lines into a history file and truncate the
@@ -712,6 +729,12 @@ if __name__ == '__main__':
         init()
         main()
     except Exception, e:
+        if history_writer is not None:
+            # Don't lose the history, if at all possible
+            try:
+                history_writer.flush()
+            except Exception:
+                pass
         if pycmd_data_dir is None:
             pycmd_data_dir = os.path.abspath(os.path.dirname(__file__))
         report_file_name = (pycmd_data_dir
@@ -17,8 +17,14 @@ To Public License, Version 2, as published by Sam Hocevar. See
 http://sam.zoy.org/wtfpl/COPYING for more details.
 """
 from string import letters, digits
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+import copy, os, struct, zlib
 
 from os import path as fs
+from common import replace_file, lock_file, unlock_file
 
 try:
     import cPickle as pickle
@@ -40,6 +46,159 @@ def _validate_key(key, silent=False):
 def get_db_backend(data_dir, dbname, backend='pickle'): pass
 
 
+class PickleCodec(object):
+    """Serializes the values with pickle"""
+    def encode(self, val):
+        return pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class CompactCodec(PickleCodec):
+    """
+    Serializes lists of strings (the token lists of the aliases) as the
+    items joined with NULs (which can't appear in a command line), in UTF-8
+    for unicode items, after a tag that never starts a pickle and a byte
+    telling the type of the items; any other value (lists mixing str and
+    unicode, or holding a NUL, included) is pickled, so values stored by
+    PickleCodec are still read back. This is smaller than a pickle, decoded
+    by a couple of C calls, and stable across Python versions.
+    """
+    __tag__ = '\xfe'
+
+    def encode(self, val):
+        if type(val) is list and val:
+            if all([type(item) is unicode and not u'\0' in item for item in val]):
+                return self.__tag__ + 'u' + u'\0'.join(val).encode('utf8')
+            if all([type(item) is str and not '\0' in item for item in val]):
+                return self.__tag__ + 's' + '\0'.join(val)
+        return PickleCodec.encode(self, val)
+
+    def decode(self, data):
+        if data[:1] != self.__tag__:
+            return PickleCodec.decode(self, data)
+        if data[1:2] == 'u':
+            return data[2:].decode('utf8').split(u'\0')
+        return data[2:].split('\0')
+
+
+class SortedKeys(object):
+    """
+    The keys of a database, kept sorted (with bisect) for prefix and range
+    lookups in O(log n)
+    """
+    def __init__(self, keys=()):
+        self.keys = sorted(keys)
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.keys.insert(i, key)
+
+    def remove(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def clear(self):
+        del self.keys[:]
+
+    def range(self, start=None, stop=None):
+        """The keys from start (included) to stop (excluded)"""
+        lo = 0 if start is None else bisect_left(self.keys, start)
+        hi = len(self.keys) if stop is None else bisect_left(self.keys, stop)
+        return self.keys[lo:hi]
+
+    def prefix(self, prefix):
+        """The keys that start with prefix"""
+        # The keys are plain ASCII (see _validate_key)
+        return self.range(prefix, prefix + '\xff')
+
+
+class ZlibCompressor(object):
+    """zlib, from the standard library, so always available"""
+    name = 'zlib'
+
+    def compressobj(self):
+        return zlib.compressobj(zlib.Z_BEST_SPEED)
+
+    def decompressobj(self):
+        return zlib.decompressobj()
+
+
+class SnappyCompressor(object):
+    """The snappy framing format, from python-snappy"""
+    name = 'snappy'
+
+    def __init__(self, snappy):
+        self.snappy = snappy
+
+    def compressobj(self):
+        return self.snappy.StreamCompressor()
+
+    def decompressobj(self):
+        return self.snappy.StreamDecompressor()
+
+
+class LZ4Compressor(object):
+    """The LZ4 frame format, from python-lz4"""
+    name = 'lz4'
+
+    class _Compressor(object):
+        def __init__(self, lz4frame):
+            self.compressor = lz4frame.LZ4FrameCompressor()
+            self.header = self.compressor.begin()
+
+        def compress(self, data):
+            (header, self.header) = (self.header, '')
+            return header + self.compressor.compress(data)
+
+        def flush(self):
+            return self.header + self.compressor.flush()
+
+    class _Decompressor(object):
+        def __init__(self, lz4frame):
+            self.decompressor = lz4frame.LZ4FrameDecompressor()
+
+        def decompress(self, data):
+            return self.decompressor.decompress(data)
+
+        def flush(self):
+            return ''
+
+    def __init__(self, lz4frame):
+        self.lz4frame = lz4frame
+
+    def compressobj(self):
+        return self._Compressor(self.lz4frame)
+
+    def decompressobj(self):
+        return self._Decompressor(self.lz4frame)
+
+
+# The compression libraries that are installed, fastest first
+compressors = [ZlibCompressor()]
+try:
+    import lz4.frame
+    compressors.insert(0, LZ4Compressor(lz4.frame))
+except ImportError:
+    pass
+try:
+    import snappy
+    if hasattr(snappy, 'StreamCompressor'):
+        compressors.insert(0, SnappyCompressor(snappy))
+except ImportError:
+    pass
+
+
 def unimplemented(func):
     def not_implemented_func(*args, **kwargs):
         raise NotImplementedError('This method is not currently implemented on this backend!')
@@ -72,10 +231,12 @@ class dbbackend(object):
         args = []
         for depk in argkeys:
             dep = self.__deps__[depk]
+            # Dependencies shipped as DLLs (e.g. clib.snappy) fail with an
+            # OSError when they can't be loaded on this platform
             try: self.__imports__[depk] = __import__(dep)
-            except ImportError:
+            except (ImportError, OSError):
                 try: self.__imports__[depk] = __import__(depk)
-                except ImportError: return get_db_backend
+                except (ImportError, OSError): return get_db_backend
             args.append(self.__imports__[depk])
 
         def backendf(data_dir, dbname):
@@ -93,12 +254,16 @@ class BaseBackend(object):
     # We can iterate by index regardless. This is just to tell whether or not we should
     # allow the keys to be numerical on the creation of a new item.
     __numeric_keys__ = False
+    # Serializes the values; see PickleCodec
+    __codec__ = CompactCodec()
 
     def __init__(self, data_dir, dbname):
         self.data_dir = data_dir
         self.database = dbname
         self.dbfile = None
         self.db = None
+        # Nesting level of the batch() blocks being run
+        self.batch_depth = 0
         if hasattr(self._deleteall, 'unimplemented') and self._deleteall.unimplemented:
             self._deleteall = None
         if hasattr(self._getrange, 'unimplemented') and self._getrange.unimplemented:
@@ -145,11 +310,27 @@ class BaseBackend(object):
         action = self._resolve_key(type(key), 'get')
         return action(key)
 
+    def get_many(self, keys):
+        """Return the values of a list of keys (None for missing keys)"""
+        return [self.get(key) for key in keys]
+
+    def prefix(self, prefix=''):
+        """Return the keys that start with prefix, sorted"""
+        try:
+            prefix = str(prefix)
+        except UnicodeEncodeError:
+            return []
+        return self._prefix(prefix)
+
+    def _prefix(self, prefix):
+        return sorted([key for key in self.keys() if key.startswith(prefix)])
+
     def delete(self, key=None):
         if key is None:
             if self._deleteall is None:
-                for k in self.keys():
-                    self.delete(k)
+                with self.batch():
+                    for k in list(self.keys()):
+                        self.delete(k)
                 return
             else:
                 return self._deleteall()
@@ -174,6 +355,41 @@ class BaseBackend(object):
         action = self._resolve_key(type(key), 'put')
         return action(key, val)
 
+    def put_many(self, items):
+        """Put a number of (key, value) pairs (or a dict) in a single write"""
+        if hasattr(items, 'iteritems'):
+            items = items.iteritems()
+        with self.batch():
+            for key, val in items:
+                self.put(key, val)
+
+    @contextmanager
+    def batch(self):
+        """
+        Group the puts and deletes made in the block, and write them in one go
+        (atomically, where the backend allows) when the block ends; if it
+        raises, they are dropped. Nested blocks join the outer one.
+        """
+        if self.batch_depth == 0:
+            self._begin_batch()
+        self.batch_depth += 1
+        try:
+            yield self
+        except:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self._abort_batch()
+            raise
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self._commit_batch()
+
+    def _begin_batch(self): pass
+
+    def _commit_batch(self): pass
+
+    def _abort_batch(self): pass
+
     def _geti(self, index):
         try:
             key = self._i2a(index)
@@ -191,6 +407,18 @@ class BaseBackend(object):
                 self._puta(index, val)
             else: raise ex
 
+    def _sorted_range(self, start, stop):
+        """
+        The keys from start (included) to stop (excluded), in key order, for
+        the backends that keep a SortedKeys index (self.sorted_keys)
+        """
+        for key in [start, stop]:
+            if key is not None and not self.has(key):
+                raise KeyError('Key %s does not exist in our database.' % key)
+        if start is not None and stop is not None and start > stop:
+            raise Exception('Indexes specified are out of range of possible values.')
+        return self.sorted_keys.range(start, stop)
+
     @unimplemented
     def _i2a(self, index): pass
 
@@ -215,6 +443,21 @@ class BaseBackend(object):
     @unimplemented
     def index(self): pass
 
+    def stamp(self):
+        """
+        Return a value that changes whenever the data on disk is modified, by
+        this or another session (used to validate caches)
+        """
+        try:
+            st = os.stat(self.dbfile)
+        except (OSError, TypeError):
+            return None
+        return st.st_mtime, st.st_size
+
+    def refresh(self):
+        """Pick up the changes made by other sessions, if needed"""
+        pass
+
     def _open(self): pass
 
     def _flush(self): pass
@@ -228,12 +471,14 @@ class PickleBackend(BaseBackend):
     __fileext__ = '.pickle'
     __defaults__ = {
     'keys': [],
-    'data': {}
+    'data': {},
+    'encoded': True
     }
     __autoflush__ = True
 
     def _flush(self):
-        self._writef(pickle.dumps(self.db))
+        self._dumpf(self.db)
+        self.loaded_stamp = self.stamp()
 
     def _open(self):
         if self.dbfile is None:
@@ -245,6 +490,18 @@ class PickleBackend(BaseBackend):
                 self._flush
             else:
                 self.db = pickle.loads(self._readdf())
+                if not self.db.get('encoded'):
+                    # Written before the values were encoded
+                    for k, v in self.db['data'].items():
+                        self.db['data'][k] = self.__codec__.encode(v)
+                    self.db['encoded'] = True
+            self.loaded_stamp = self.stamp()
+            self.sorted_keys = SortedKeys(self.db['keys'])
+
+    def refresh(self):
+        if self.stamp() != self.loaded_stamp:
+            self.db = None
+            self._open()
 
     def _readdf(self):
         fdb = open(self.dbfile, 'rb')
@@ -252,41 +509,26 @@ class PickleBackend(BaseBackend):
         fdb.close()
         return data
 
-    def _writef(self, data):
+    def _dumpf(self, db):
+        """Pickle db straight into the file"""
         fdb = open(self.dbfile, 'wb')
-        fdb.write(data)
-        fdb.close()
+        try:
+            pickle.dump(db, fdb, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fdb.close()
 
     def setup_defaults(self):
         for k in self.__defaults__.keys():
-            self.db[k] = self.__defaults__[k]
-
-    def _a2i(self, key):
-        tkey = type(key)
-        if tkey in [str, unicode]:
-            if key not in self.db['keys']:
-                raise KeyError('Key %s does not exist in our database.' % key)
-            for i, k in enumerate(self.db['keys']):
-                if k == key: return i
-            return -1
-        elif tkey in [long, int]:
-            return int(key)
-        else:
-            raise KeyError('Don\'t know what to do with type of key: %s' % str(tkey))
+            self.db[k] = copy.deepcopy(self.__defaults__[k])
 
     def _getrange(self, start=None, stop=None):
-        if start is not None:
-            start = self._a2i(start)
-        else:
-            start = 0
-        if stop is not None:
-            stop = self._a2i(stop)
+        # All the values come in insertion order; a range between keys is
+        # taken in key order, from the sorted index
+        if start is None and stop is None:
+            keys = self.db['keys']
         else:
-            stop = len(self.db['keys'])
-        if start < 0 or stop > len(self.db['keys']) or start > stop:
-            raise Exception('Indexes specified are out of range of possible values.')
-        for k in self.db['keys'][start:stop]:
-            yield k, self.db['data'][k]
+            keys = self._sorted_range(start, stop)
+        return [(k, self.__codec__.decode(self.db['data'][k])) for k in keys]
 
     def keys(self):
         for k in self.db['keys']:
@@ -299,22 +541,29 @@ class PickleBackend(BaseBackend):
         key = str(key)
         if not nocheck and not _validate_key(key, True):
             return None
-        return None if not self.has(key) else self.db['data'][key]
+        return None if not self.has(key) else self.__codec__.decode(self.db['data'][key])
 
     def _deleteall(self):
         self.setup_defaults()
+        self.sorted_keys.clear()
+        if self.__autoflush__ and self.batch_depth == 0:
+            self.flush()
 
     def has(self, key):
-        return key in self.db['keys']
+        return key in self.db['data']
+
+    def _prefix(self, prefix):
+        return self.sorted_keys.prefix(prefix)
 
     def _puta(self, key, val, nocheck=False):
         key = str(key)
         if not nocheck: _validate_key(key)
         exists = self.has(key)
-        self.db['data'][key] = val
+        self.db['data'][key] = self.__codec__.encode(val)
         if not exists:
             self.db['keys'].append(key)
-        if self.__autoflush__:
+            self.sorted_keys.add(key)
+        if self.__autoflush__ and self.batch_depth == 0:
             self.flush()
 
     def index(self, increment=False):
@@ -323,8 +572,335 @@ class PickleBackend(BaseBackend):
     def _deletea(self, key, nocheck=False):
         if key in self.db['keys']:
             self.db['keys'].remove(key)
+            self.sorted_keys.remove(key)
         if self.db['data'].has_key(key):
             del self.db['data'][key]
+        if self.__autoflush__ and self.batch_depth == 0:
+            self.flush()
+
+    def _commit_batch(self):
+        if self.__autoflush__:
+            self.flush()
+
+    def _abort_batch(self):
+        # Back to what was last saved
+        self.db = None
+        self._open()
+
+
+class CompressingWriter(object):
+    """
+    A file-like object that compresses what is written to it into a file,
+    a chunk at a time
+    """
+    def __init__(self, fdb, compressobj, chunk):
+        self.fdb = fdb
+        self.compressobj = compressobj
+        self.chunk = chunk
+        self.pending = []
+        self.size = 0
+
+    def write(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk:
+            self._compress()
+
+    def close(self):
+        """Write the rest of the compressed data (the file stays open)"""
+        self._compress()
+        self.fdb.write(self.compressobj.flush())
+
+    def _compress(self):
+        self.fdb.write(self.compressobj.compress(''.join(self.pending)))
+        self.pending = []
+        self.size = 0
+
+
+class CompressedBackend(PickleBackend):
+    """
+    Same as PickleBackend, with the file compressed by the fastest
+    compression library installed (see compressors). The file starts with
+    the name of the library, so that it can be read back whatever the
+    default is. The pickle is compressed as it is written, in chunks,
+    without building it whole; the file is decompressed (in chunks) into a
+    string before unpickling, as unpickling through a Python file-like
+    object is an order of magnitude slower. Files written by earlier
+    versions, compressed with clib.snappy (Windows only), are still read.
+    """
+    __fileext__ = '.snappy'
+    __magic__ = 'PyCmdCZ1'
+    __chunk__ = 64 * 1024
+
+    def __init__(self, data_dir, dbname):
+        # Used to write the file
+        self.compressor = compressors[0]
+        PickleBackend.__init__(self, data_dir, dbname)
+
+    def _readdf(self):
+        fdb = open(self.dbfile, 'rb')
+        try:
+            magic = fdb.read(len(self.__magic__))
+            if magic != self.__magic__:
+                return self._read_legacy(magic + fdb.read())
+            name = fdb.read(ord(fdb.read(1)))
+            found = [c for c in compressors if c.name == name]
+            if not found:
+                raise Exception('%s is compressed with %s, which is not installed.' % (self.dbfile, name))
+            decompressor = found[0].decompressobj()
+            chunks = []
+            while True:
+                chunk = fdb.read(self.__chunk__)
+                if not chunk:
+                    break
+                chunks.append(decompressor.decompress(chunk))
+            chunks.append(decompressor.flush())
+            return ''.join(chunks)
+        finally:
+            fdb.close()
+
+    def _read_legacy(self, data):
+        try:
+            from clib import snappy
+        except (ImportError, OSError):
+            raise Exception('%s is compressed with clib.snappy, which is not available.' % self.dbfile)
+        return snappy.uncompress(data)
+
+    def _dumpf(self, db):
+        fdb = open(self.dbfile, 'wb')
+        try:
+            fdb.write(self.__magic__ + chr(len(self.compressor.name)) + self.compressor.name)
+            writer = CompressingWriter(fdb, self.compressor.compressobj(), self.__chunk__)
+            pickle.dump(db, writer, pickle.HIGHEST_PROTOCOL)
+            writer.close()
+        finally:
+            fdb.close()
+
+
+class LogKVBackend(BaseBackend):
+    """
+    Log-structured store: every put and delete is appended to the database
+    file as a record, and the current values are kept in memory in insertion
+    order. When the file holds too many stale records it is compacted, i.e.
+    rewritten with just the current values.
+
+    The file starts with a header that changes whenever the file is
+    rewritten, so that other sessions can tell whether to read it again or
+    just the records appended since they last looked.
+
+    A record holds 'P', the length of the key, the key and the encoded value
+    for a put, or 'D' and the key for a delete. (Files written by earlier
+    versions have pickled (key, value) and (key,) tuples instead, which are
+    still read.) The values are kept encoded in memory too, and only decoded
+    when read.
+    """
+    __fileext__ = '.logkv'
+    __magic__ = 'PyCmdKV1'
+    __header__ = struct.Struct('<8s8s')  # Magic, generation
+    __record__ = struct.Struct('<Ii')    # Payload length, CRC32 of payload
+    __key__ = struct.Struct('<H')        # Key length, in a put record
+    # Compact when the file holds more than __compact_ratio__ records per
+    # value (and at least __compact_min__ records)
+    __compact_ratio__ = 2
+    __compact_min__ = 64
+
+    def _open(self):
+        if self.dbfile is None:
+            self.dbfile = self._fpath() + self.__fileext__
+        if self.db is None:
+            self.db = OrderedDict()
+            self.sorted_keys = SortedKeys()
+            self.generation = None
+            self.offset = 0
+            self.records = 0
+            # The records of the batch being run
+            self.pending = []
+            self._refresh()
+
+    def _refresh(self):
+        """Read the records added to the file since we last read it"""
+        if not fs.isfile(self.dbfile):
+            return
+        fdb = open(self.dbfile, 'rb')
+        try:
+            header = fdb.read(self.__header__.size)
+            if len(header) < self.__header__.size:
+                return
+            (magic, generation) = self.__header__.unpack(header)
+            if magic != self.__magic__:
+                raise Exception('%s is not a PyCmd database.' % self.dbfile)
+            if generation != self.generation:
+                # The file was rewritten, start over
+                self.db.clear()
+                self.sorted_keys.clear()
+                self.generation = generation
+                self.offset = self.__header__.size
+                self.records = 0
+            fdb.seek(self.offset)
+            data = fdb.read()
+        finally:
+            fdb.close()
+        pos = 0
+        while pos + self.__record__.size <= len(data):
+            (length, crc) = self.__record__.unpack_from(data, pos)
+            payload = data[pos + self.__record__.size : pos + self.__record__.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # Incomplete (or damaged) record, stop here
+                break
+            self._apply(self._unpack(payload))
+            self.records += 1
+            pos += self.__record__.size + length
+        self.offset += pos
+
+    def refresh(self):
+        self._refresh()
+
+    def _unpack(self, payload):
+        """Parse the payload of a record"""
+        if payload[:1] == 'P':
+            end = 3 + self.__key__.unpack_from(payload, 1)[0]
+            return (payload[3:end], payload[end:])
+        elif payload[:1] == 'D':
+            return (payload[1:],)
+        record = pickle.loads(payload)
+        if len(record) == 2:
+            return (record[0], self.__codec__.encode(record[1]))
+        return record
+
+    def _apply(self, record):
+        """Apply a put (key, encoded value) or delete (key,) record"""
+        if len(record) == 2:
+            if record[0] not in self.db:
+                self.sorted_keys.add(record[0])
+            self.db[record[0]] = record[1]
+        elif self.db.pop(record[0], None) is not None:
+            self.sorted_keys.remove(record[0])
+
+    def _locked(self):
+        """Open and lock the lock file of the database; returns it"""
+        lock = open(self.dbfile + '.lock', 'a+b')
+        lock_file(lock)
+        return lock
+
+    def _unlock(self, lock):
+        """Release the lock taken by _locked()"""
+        unlock_file(lock)
+        lock.close()
+
+    def _pack(self, record):
+        """Serialize a record, with its length and checksum"""
+        if len(record) == 2:
+            payload = 'P' + self.__key__.pack(len(record[0])) + record[0] + record[1]
+        else:
+            payload = 'D' + record[0]
+        return self.__record__.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _write(self, records):
+        """Apply records, and write them (unless a batch is running)"""
+        if self.batch_depth > 0:
+            for record in records:
+                self._apply(record)
+            self.pending += records
+        else:
+            self._append(records)
+
+    def _commit_batch(self):
+        (records, self.pending) = (self.pending, [])
+        if records:
+            self._append(records)
+
+    def _abort_batch(self):
+        # Read the file from scratch
+        self.pending = []
+        self.db.clear()
+        self.sorted_keys.clear()
+        self.generation = None
+        self._refresh()
+
+    def _append(self, records):
+        """Append records to the database file and apply them"""
+        lock = self._locked()
+        try:
+            self._refresh()
+            if self.generation is None:
+                self._rewrite()
+            elif fs.getsize(self.dbfile) > self.offset:
+                # Drop an incomplete record left behind by a crash
+                fdb = open(self.dbfile, 'r+b')
+                fdb.truncate(self.offset)
+                fdb.close()
+            data = ''.join([self._pack(record) for record in records])
+            fdb = open(self.dbfile, 'ab')
+            fdb.write(data)
+            fdb.close()
+            self.offset += len(data)
+            self.records += len(records)
+            for record in records:
+                self._apply(record)
+            if self.records >= self.__compact_min__ \
+                    and self.records > self.__compact_ratio__ * len(self.db):
+                self._rewrite()
+        finally:
+            self._unlock(lock)
+
+    def _rewrite(self):
+        """Rewrite the database file with just the current values"""
+        generation = os.urandom(8)
+        data = ''.join([self.__header__.pack(self.__magic__, generation)]
+                       + [self._pack(item) for item in self.db.iteritems()])
+        replace_file(self.dbfile, data)
+        self.generation = generation
+        self.offset = len(data)
+        self.records = len(self.db)
+
+    def compact(self):
+        """Rewrite the database file with just the current values"""
+        lock = self._locked()
+        try:
+            self._refresh()
+            self._rewrite()
+        finally:
+            self._unlock(lock)
+
+    def _getrange(self, start=None, stop=None):
+        # As in PickleBackend, ranges between keys are in key order
+        if start is None and stop is None:
+            return [(key, self.__codec__.decode(data)) for (key, data) in self.db.iteritems()]
+        return [(key, self.__codec__.decode(self.db[key])) for key in self._sorted_range(start, stop)]
+
+    def keys(self):
+        return list(self.db)
+
+    def _i2a(self, index):
+        if index < 0 or index >= len(self.db):
+            raise KeyError('Index %d does not exist in our database.' % index)
+        return next(islice(self.db, index, None))
+
+    def _geta(self, key, nocheck=False):
+        data = self.db.get(str(key))
+        return None if data is None else self.__codec__.decode(data)
+
+    def has(self, key):
+        return str(key) in self.db
+
+    def _prefix(self, prefix):
+        return self.sorted_keys.prefix(prefix)
+
+    def _puta(self, key, val, nocheck=False):
+        key = str(key)
+        if not nocheck: _validate_key(key)
+        self._write([(key, self.__codec__.encode(val))])
+
+    def _deletea(self, key, nocheck=False):
+        key = str(key)
+        if key in self.db:
+            self._write([(key,)])
+
+    def _deleteall(self):
+        self._write([(key,) for key in self.db])
+
+    def index(self, increment=False):
+        return len(self.db) + 1
 
 
 @dbbackend()
@@ -333,21 +909,136 @@ def _backend_pickle():
 
 
 @dbbackend()
-def _backend_snappy(snappy='clib.snappy'):
-    class SnappyBackend(PickleBackend):
-        __fileext__ = '.snappy'
+def _backend_logkv():
+    return LogKVBackend
 
-        def _readdf(self):
-            return snappy.loadf(self.dbfile)
 
-        def _writef(self, data):
-            snappy.savef(self.dbfile, data)
-
-    return SnappyBackend
+@dbbackend()
+def _backend_snappy():
+    return CompressedBackend
 
 
 @dbbackend()
-def _backend_sqlite3(sqlite3): pass
+def _backend_sqlite3(sqlite3):
+    class SQLiteBackend(BaseBackend):
+        """
+        Keeps the data in an SQLite table, with the values encoded; the
+        rows are numbered in insertion order. The connection is kept open
+        (and with it, the compiled statements, which sqlite3 caches per
+        connection) and uses write-ahead logging, so that reads don't wait
+        for other sessions' writes.
+        """
+        __fileext__ = '.sqlite3'
+        __schema__ = ('CREATE TABLE IF NOT EXISTS data ('
+                      'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                      'key TEXT UNIQUE NOT NULL, '
+                      'value BLOB NOT NULL)')
+        __max_params__ = 500
+
+        def _open(self):
+            if self.dbfile is None:
+                self.dbfile = self._fpath() + self.__fileext__
+            if self.db is None:
+                # Transactions are managed explicitly, see _begin_batch()
+                self.db = sqlite3.connect(self.dbfile, isolation_level=None, cached_statements=32)
+                self.db.text_factory = str
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute('PRAGMA synchronous=NORMAL')
+                self.db.execute(self.__schema__)
+
+        def _close(self):
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+        # A batch is a transaction
+        def _begin_batch(self):
+            self.db.execute('BEGIN IMMEDIATE')
+
+        def _commit_batch(self):
+            self.db.execute('COMMIT')
+
+        def _abort_batch(self):
+            self.db.execute('ROLLBACK')
+
+        def stamp(self):
+            # data_version changes with the commits of other connections
+            return self._query('PRAGMA data_version'), self.db.total_changes
+
+        def _query(self, sql, *args):
+            """Run a query, return the first column of the first row (or None)"""
+            row = self.db.execute(sql, args).fetchone()
+            return None if row is None else row[0]
+
+        def _getrange(self, start=None, stop=None):
+            # As in PickleBackend, ranges between keys are in key order (a
+            # range scan on the index of the keys)
+            for key in [start, stop]:
+                if key is not None and not self.has(key):
+                    raise KeyError('Key %s does not exist in our database.' % key)
+            if start is None and stop is None:
+                rows = self.db.execute('SELECT key, value FROM data ORDER BY id')
+            elif stop is None:
+                rows = self.db.execute('SELECT key, value FROM data WHERE key >= ? ORDER BY key', (str(start),))
+            elif start is None:
+                rows = self.db.execute('SELECT key, value FROM data WHERE key < ? ORDER BY key', (str(stop),))
+            else:
+                rows = self.db.execute('SELECT key, value FROM data WHERE key >= ? AND key < ? ORDER BY key',
+                                       (str(start), str(stop)))
+            return [(key, self.__codec__.decode(str(value))) for (key, value) in rows]
+
+        def keys(self):
+            return [key for (key,) in self.db.execute('SELECT key FROM data ORDER BY id')]
+
+        def _i2a(self, index):
+            key = self._query('SELECT key FROM data ORDER BY id LIMIT 1 OFFSET ?', index)
+            if index < 0 or key is None:
+                raise KeyError('Index %d does not exist in our database.' % index)
+            return key
+
+        def _geta(self, key, nocheck=False):
+            value = self._query('SELECT value FROM data WHERE key = ?', str(key))
+            return None if value is None else self.__codec__.decode(str(value))
+
+        def get_many(self, keys):
+            keys = [str(key) for key in keys]
+            values = {}
+            # Stay under the limit on the number of parameters of a statement
+            for i in range(0, len(keys), self.__max_params__):
+                chunk = keys[i : i + self.__max_params__]
+                values.update(self.db.execute('SELECT key, value FROM data WHERE key IN (%s)'
+                                              % ', '.join(['?'] * len(chunk)), chunk))
+            return [self.__codec__.decode(str(values[key])) if key in values else None for key in keys]
+
+        def has(self, key):
+            return self._query('SELECT 1 FROM data WHERE key = ?', str(key)) is not None
+
+        def _prefix(self, prefix):
+            # A range scan on the index of the (unique) keys
+            return [key for (key,) in self.db.execute('SELECT key FROM data WHERE key >= ? AND key < ? '
+                                                      'ORDER BY key', (prefix, prefix + '\xff'))]
+
+        def _puta(self, key, val, nocheck=False):
+            key = str(key)
+            if not nocheck: _validate_key(key)
+            value = sqlite3.Binary(self.__codec__.encode(val))
+            with self.batch():
+                # An existing key keeps its place in the insertion order
+                if self.db.execute('UPDATE data SET value = ? WHERE key = ?', (value, key)).rowcount == 0:
+                    self.db.execute('INSERT INTO data (key, value) VALUES (?, ?)', (key, value))
+
+        def _deletea(self, key, nocheck=False):
+            with self.batch():
+                self.db.execute('DELETE FROM data WHERE key = ?', (str(key),))
+
+        def _deleteall(self):
+            with self.batch():
+                self.db.execute('DELETE FROM data')
+
+        def index(self, increment=False):
+            return self._query('SELECT COUNT(*) FROM data') + 1
+
+    return SQLiteBackend
 
 
 @dbbackend()
@@ -362,48 +1053,119 @@ def _backend_leveldb(leveldb):
                 self.dbfile = self._fpath()
             if self.db is None:
                 self.db = leveldb.LevelDB(self.dbfile)
+                # The writes of the batch being run, and their values (None
+                # for a deletion) so that it reads its own writes
+                self.pending = None
+                self.overlay = {}
             if not self.has('#index'):
                 self.setup_defaults()
 
+        def _begin_batch(self):
+            self.pending = leveldb.WriteBatch()
+
+        def _commit_batch(self):
+            (pending, self.pending) = (self.pending, None)
+            self.overlay.clear()
+            self._touch(pending)
+            self.db.Write(pending, sync=True)
+
+        def _abort_batch(self):
+            self.pending = None
+            self.overlay.clear()
+
+        def _dbget(self, key):
+            if key in self.overlay:
+                if self.overlay[key] is None:
+                    raise KeyError(key)
+                return self.overlay[key]
+            return self.db.Get(key)
+
+        def _dbput(self, key, val):
+            if self.pending is None:
+                batch = leveldb.WriteBatch()
+                batch.Put(key, val)
+                self._touch(batch)
+                self.db.Write(batch)
+            else:
+                self.pending.Put(key, val)
+                self.overlay[key] = val
+
+        def _dbdelete(self, key):
+            if self.pending is None:
+                batch = leveldb.WriteBatch()
+                batch.Delete(key)
+                self._touch(batch)
+                self.db.Write(batch)
+            else:
+                self.pending.Delete(key)
+                self.overlay[key] = None
+
+        def _touch(self, batch):
+            """Add the change of the stamp to a batch of writes"""
+            # A random value rather than a counter, so that sessions writing
+            # at the same time can't end up with the same stamp
+            batch.Put('#stamp', os.urandom(8))
+
+        def stamp(self):
+            # The mtime of the database directory doesn't change when LevelDB
+            # appends to its log or table files, so every write sets #stamp
+            try: return self.db.Get('#stamp')
+            except KeyError:
+                return None
+
         def setup_defaults(self):
             for k in self.__defaults__.keys():
-                self.db.Put(k, pickle.dumps(self.__defaults__[k]))
+                self._dbput(k, self.__codec__.encode(self.__defaults__[k]))
 
         def _getrange(self, start=None, stop=None):
             for key, val in self.db.RangeIter(key_from=start, key_to=stop):
                 if not key.startswith('#') and not key.startswith('@'):
-                    yield key, pickle.loads(val)
+                    yield key, self.__codec__.decode(val)
 
         def keys(self):
             for key in self.db.RangeIter(include_value=False):
                 if not key.startswith('#') and not key.startswith('@'):
                     yield key
 
+        def _prefix(self, prefix):
+            # The keys are sorted already
+            keys = []
+            for key in self.db.RangeIter(key_from=prefix, include_value=False):
+                if not key.startswith(prefix):
+                    break
+                if not key.startswith('#') and not key.startswith('@'):
+                    keys.append(key)
+            return keys
+
         def _i2a(self, index):
             key = '@%d' % long(index)
-            return self.db.Get(key)
+            return self._dbget(key)
 
         def _geta(self, key, nocheck=False):
             key = str(key)
-            try: result = self.db.Get(key)
+            try: result = self._dbget(key)
             except KeyError:
                 return None
-            return pickle.loads(result)
+            return self.__codec__.decode(result)
 
         def _deleteall(self):
-            del self.db
-            self.db = None
-            leveldb.DestroyDB(self.dbfile)
-            self._open()
+            # Every key is deleted in a batch (joining the running one, if
+            # any), so that it's atomic, and undone if the batch is aborted;
+            # that includes the keys the running batch wrote
+            with self.batch():
+                written = [key for (key, val) in self.overlay.items() if val is not None]
+                for key in list(self.db.RangeIter(include_value=False)) + written:
+                    self._dbdelete(key)
+                self.setup_defaults()
 
         def _puta(self, key, val, nocheck=False):
             key = str(key)
             if not nocheck: _validate_key(key)
             exists = self.has(key)
-            self.db.Put(key, pickle.dumps(val))
+            self._dbput(key, self.__codec__.encode(val))
             if not exists:
                 i = '@%d' % self.index(True)
-                self.db.Put(i, key)
+                self._dbput(i, key)
 
         def index(self, increment=False):
             result = self._geta('#index', True)
@@ -413,7 +1175,7 @@ def _backend_leveldb(leveldb):
 
         def _deletea(self, key, nocheck=False):
             key = str(key)
-            self.db.Delete(key)
+            self._dbdelete(key)
 
     return LevelDBBackend
 
@@ -1,15 +1,89 @@
+import threading
 from userconfig import pycmddb
+from PyCmdDB import SortedKeys
+
+__all__ = ['get_alias', 'complete_alias', 'load_aliases', 'alias_main']
+
+
+class AliasCache:
+    """
+    Serve alias lookups from memory: all the aliases are loaded from the
+    database at once, and loaded again when the database changes; their names
+    are kept sorted too, for completion
+    """
+    def __init__(self, db):
+        self.db = db
+        self.aliases = None
+        self.names = None
+        self.stamp = None
+
+        # Some databases (sqlite3) may only be used from the thread that
+        # opened them; completions running on other threads use the aliases
+        # loaded last
+        self.owner = threading.current_thread()
+
+    def load(self):
+        """Load the aliases, unless the loaded ones are up to date"""
+        stamp = self.db.stamp()
+        if self.aliases is None or stamp != self.stamp:
+            self.db.refresh()
+            self.aliases = dict(self.db.get())
+            self.names = SortedKeys(self.aliases)
+            self.stamp = stamp
+
+    def get(self, name):
+        self.load()
+        return self.aliases.get(name)
+
+    def complete(self, prefix):
+        """The names of the aliases that start with prefix, sorted"""
+        if threading.current_thread() is self.owner:
+            self.load()
+        names = self.names
+        if names is None:
+            return []
+        try:
+            return names.prefix(str(prefix.lower()))
+        except UnicodeEncodeError:
+            return []
+
+    def invalidate(self):
+        """Drop the cached aliases (after changing them)"""
+        self.aliases = None
+
+
+_alias_cache = None
+
+def _aliases():
+    global _alias_cache
+    if _alias_cache is None:
+        _alias_cache = AliasCache(pycmddb())
+    return _alias_cache
 
-__all__ = ['get_alias', 'alias_main']
 
 def get_alias(cmd):
-    return pycmddb().get(cmd)
+    return _aliases().get(cmd)
+
+
+def load_aliases():
+    """Bring the cached aliases up to date, before completing on another thread"""
+    if pycmddb() is not None:
+        _aliases().load()
+
+
+def complete_alias(prefix):
+    """Complete the name of an alias"""
+    if pycmddb() is None:
+        # No database set up
+        return []
+    return _aliases().complete(prefix)
 
 
 def print_usage():
     print 'alias [-h] [-p] [-u] alias_name [cmd]\n'
     print '\t-h\tPrint this help.'
-    print '\t-p\tPrint value of alias. If no alias specified, list all.'
+    print '\t-p\tPrint value of alias. If no alias specified, list all; if it ends'
+    print '\t\twith *, list the aliases that start with it.'
     print '\t-u\tUndefine alias_name.\n'
     print 'If no flag is specified, we assume you\'re attempting to set an alias.\n'
     print 'EXAMPLE:\n'
@@ -18,6 +92,14 @@ def print_usage():
     print '\talias gitcl "git clone"'
 
 
+def print_aliases(prefix=''):
+    db = pycmddb()
+    names = db.prefix(prefix)
+    for name, alias in zip(names, db.get_many(names)):
+        print u'alias %s=\'%s\'' % (name, alias)
+    return len(names)
+
+
 def alias_main(args):
     if len(args) == 0:
         print_usage()
@@ -27,13 +109,11 @@ def alias_main(args):
             print_usage()
         elif args[0] == '-p':
             if len(args) == 1:
-                i = 0
-                for k, v in pycmddb().get():
-                    alias = v
-                    print u'alias %s=\'%s\'' % (k, alias)
-                    i += 1
-                if i == 0:
+                if print_aliases() == 0:
                     print 'No aliases currently defined.'
+            elif len(args) == 2 and args[1].endswith('*'):
+                if print_aliases(args[1][:-1]) == 0:
+                    print 'No aliases start with %s.' % args[1][:-1]
             elif len(args) == 2:
                 alias = args[1]
                 aliasobj = pycmddb().get(alias)
@@ -51,6 +131,7 @@ def alias_main(args):
                     print 'Alias %s not found.' % alias
                 else:
                     pycmddb().delete(alias)
+                    _aliases().invalidate()
                     print 'Alias %s deleted.' % alias
             else:
                 print_usage()
@@ -58,4 +139,5 @@ def alias_main(args):
             if len(args) == 1:
                 print 'Need a cmd to use.'
             else:
-                pycmddb().put(args[0], args[1:])
\ No newline at end of file
+                pycmddb().put(args[0], args[1:])
+                _aliases().invalidate()
\ No newline at end of file
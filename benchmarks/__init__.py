@@ -0,0 +1,26 @@
+#
+# Micro-benchmarks for performance-sensitive parts of PyCmd
+#
+# Run them from the top-level directory, e.g.:
+#    python -m benchmarks.bench_tokenizer
+#
+import timeit
+
+def per_call(func, number=None, repeat=3):
+    """
+    Time a callable and return the best per-call cost in seconds. If number
+    is not given, it is picked so that one measurement takes about 0.2s.
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < 0.2:
+            number *= 10
+    return min(timer.repeat(repeat, number)) / number
+
+def report(label, seconds):
+    """Print a timing result in a human-friendly unit"""
+    if seconds < 1e-3:
+        print '  %-50s %10.2f us' % (label, seconds * 1e6)
+    else:
+        print '  %-50s %10.2f ms' % (label, seconds * 1e3)
@@ -0,0 +1,40 @@
+#
+# Per-command cost of looking up aliases (PyCmd checks whether every simple
+# command is an alias): straight from the database, the way get_alias() used
+# to, versus through the in-memory AliasCache; and the cost of listing the
+# aliases that start with a prefix among 10k, by scanning all the keys versus
+# through the sorted key index, and completing alias names from the cache;
+# plus the cost of reading a range of 10 values between two keys
+#
+import shutil, tempfile
+from benchmarks import per_call, report
+from PyCmdDB import get_db_backend
+from aliases import AliasCache
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for backend in ['pickle', 'logkv', 'sqlite3']:
+            db = get_db_backend(tmp_dir, 'pycmd', backend)
+            for i in range(200):
+                db.put('alias%d' % i, ['git', 'log', '--oneline', '-%d' % i])
+            cache = AliasCache(db)
+
+            print 'Backend %s, 200 aliases:' % backend
+            report('database lookup (alias)', per_call(lambda: db.get(u'alias150')))
+            report('database lookup (not an alias)', per_call(lambda: db.get(u'dir')))
+            report('cached lookup (alias)', per_call(lambda: cache.get(u'alias150')))
+            report('cached lookup (not an alias)', per_call(lambda: cache.get(u'dir')))
+
+            db.put_many([('alias%d' % i, ['dir', str(i)]) for i in range(200, 10000)])
+            print 'Backend %s, 10k aliases:' % backend
+            report('prefix lookup, scanning the keys',
+                   per_call(lambda: sorted([k for k in db.keys() if k.startswith('alias123')])))
+            report('prefix lookup, sorted index', per_call(lambda: db.prefix('alias123')))
+            report('alias name completion (cached)', per_call(lambda: cache.complete(u'alias123')))
+            report('range of 10 values', per_call(lambda: db._getrange('alias1230', 'alias1240')))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
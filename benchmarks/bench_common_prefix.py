@@ -0,0 +1,26 @@
+#
+# Cost of completion.find_common_prefix on 20000 completions sharing a long
+# start, compared to the original character-by-character implementation
+# (kept in tests/legacy.py), and when called again for the same set (as the
+# Tab display loop does)
+#
+from benchmarks import per_call, report
+import completion
+from completion import find_common_prefix
+from tests import legacy
+
+def main():
+    completions = ['Documents and Settings\\report_%05d.txt' % i for i in range(20000)]
+    completions[1] = completions[1].lower()
+    for original in ['doc', 'Documents and Settings\\report_1']:
+        assert find_common_prefix(original, completions) == legacy.find_common_prefix(original, completions)
+        print 'Common prefix of 20000 completions, typed "%s":' % original
+        report('original', per_call(lambda: legacy.find_common_prefix(original, completions), 1))
+        def uncached():
+            completion._common_prefix_cache.clear()
+            return find_common_prefix(original, completions)
+        report('single pass', per_call(uncached))
+        report('same set again (cached)', per_call(lambda: find_common_prefix(original, completions)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#
+# Cost of sorting the entries of a directory of 50000 files (and 500
+# subdirectories) into directories and files when completing: a stat per
+# entry to ask whether it's a directory, then another to ask whether it's a
+# file, the original way (kept in tests/legacy.py), versus a single pass
+# building the shared candidates, and the candidates as cached between Tab
+# presses
+#
+import os, shutil, tempfile, time
+from benchmarks import per_call, report
+from completion import wildcard_to_regex, list_completions
+from DirCache import list_dir
+from tests import legacy
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for i in range(500):
+            os.mkdir(os.path.join(tmp_dir, 'dir%d' % i))
+        for i in range(50000):
+            open(os.path.join(tmp_dir, 'file%d.txt' % i), 'w').close()
+        mtime = time.time() - 60
+        os.utime(tmp_dir, (mtime, mtime))
+
+        matcher = wildcard_to_regex('*')
+        def single_pass():
+            candidates = list_dir(tmp_dir)
+            return ([c.name + '\\' for c in candidates if c.is_dir]
+                    + [c.name for c in candidates if c.is_file])
+        assert sorted(single_pass()) == sorted(legacy.list_dir_completions(tmp_dir, matcher))
+        assert list_completions(tmp_dir, matcher) == legacy.list_dir_completions(tmp_dir, matcher)
+
+        print 'Classifying 50500 entries:'
+        report('stat twice per entry', per_call(lambda: legacy.list_dir_completions(tmp_dir, matcher), 1))
+        report('single pass', per_call(single_pass, 1))
+        report('cached candidates', per_call(lambda: list_completions(tmp_dir, matcher), 1))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
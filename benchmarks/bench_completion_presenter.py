@@ -0,0 +1,28 @@
+#
+# Cost of displaying the 100000 suggestions of a completion: the original
+# way (kept in tests/legacy.py), which sizes the columns over all of them and
+# prints them all, recomputing the common prefix for every cell (so only the
+# first 200 are timed: it grows with the square of their number), versus the
+# presenter, up to its first screen and for all the screens
+#
+from benchmarks import per_call, report
+from CompletionPresenter import CompletionPresenter, prefix_highlighter
+from completion import find_common_prefix
+from tests import legacy
+
+def main():
+    suggestions = ['report_%06d.txt' % i for i in range(100000)]
+    (width, height) = (120, 50)
+    write = lambda s: None
+
+    print 'Displaying 100000 suggestions in a %dx%d window:' % (width, height)
+    report('original, first 200 suggestions',
+           per_call(lambda: legacy.render_completions(write, suggestions[:200], 'rep', width, height), 1))
+    def presenter():
+        return CompletionPresenter(suggestions, prefix_highlighter(len(find_common_prefix('rep', suggestions))),
+                                   width, height)
+    report('presenter, first screen', per_call(lambda: presenter().show(write, lambda screens_left: False), 1))
+    report('presenter, all screens', per_call(lambda: presenter().show(write, lambda screens_left: True), 1))
+
+if __name__ == '__main__':
+    main()
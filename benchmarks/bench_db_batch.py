@@ -0,0 +1,28 @@
+#
+# Cost of importing a few hundred aliases into the database: one put() per
+# alias (one disk write or transaction each) versus a single put_many()
+#
+import shutil, tempfile
+from benchmarks import per_call, report
+from PyCmdDB import get_db_backend
+
+def main():
+    aliases = [('alias%d' % i, ['git', 'log', '--oneline', '-%d' % i]) for i in range(300)]
+    for backend in ['pickle', 'logkv', 'sqlite3']:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db = get_db_backend(tmp_dir, 'pycmd', backend)
+
+            def put_each():
+                for key, val in aliases:
+                    db.put(key, val)
+
+            print 'Backend %s, 300 aliases:' % backend
+            report('one put() per alias', per_call(put_each, 1))
+            report('put_many()', per_call(lambda: db.put_many(aliases), 1))
+            report('get_many()', per_call(lambda: db.get_many([key for key, val in aliases]), 1))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
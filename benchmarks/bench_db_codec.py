@@ -0,0 +1,31 @@
+#
+# Cost of loading a store of 10k aliases with the values pickled versus
+# encoded with the compact codec: opening the store, then decoding all the
+# values (what the alias cache does), plus the size of the file
+#
+import os, shutil, tempfile
+from benchmarks import per_call, report
+from PyCmdDB import BaseBackend, PickleCodec, CompactCodec, get_db_backend
+
+def main():
+    aliases = [('alias%d' % i, [u'git', u'log', u'--oneline', u'-%d' % i]) for i in range(10000)]
+    for backend in ['pickle', 'logkv', 'sqlite3']:
+        for codec in [PickleCodec(), CompactCodec()]:
+            BaseBackend.__codec__ = codec
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                db = get_db_backend(tmp_dir, 'pycmd', backend)
+                db.put_many(aliases)
+                open_db = lambda: get_db_backend(tmp_dir, 'pycmd', backend)
+
+                size = sum([os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir)])
+
+                print 'Backend %s, %s, 10k aliases (%d KB):' % (backend, codec.__class__.__name__, size / 1024)
+                report('open', per_call(open_db, 3))
+                report('open and read all the values', per_call(lambda: list(open_db().get()), 3))
+                report('read all the values', per_call(lambda: list(db.get()), 3))
+            finally:
+                shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
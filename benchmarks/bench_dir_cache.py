@@ -0,0 +1,34 @@
+#
+# Cost of listing the matching entries of a directory of 5000 files and 500
+# subdirectories when completing: listing it and checking the type of every
+# entry on each Tab press, the original way (kept in tests/legacy.py), versus
+# the cached listing, validated with a single stat of the directory
+#
+import os, shutil, tempfile, time
+from benchmarks import per_call, report
+from completion import wildcard_to_regex, list_completions
+from tests import legacy
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for i in range(500):
+            os.mkdir(os.path.join(tmp_dir, 'dir%d' % i))
+        for i in range(5000):
+            open(os.path.join(tmp_dir, 'file%d.txt' % i), 'w').close()
+        mtime = time.time() - 60
+        os.utime(tmp_dir, (mtime, mtime))
+
+        for prefix in ['', 'file1']:
+            matcher = wildcard_to_regex(prefix + '*')
+            cached = lambda: list_completions(tmp_dir, matcher)
+            assert cached() == legacy.list_dir_completions(tmp_dir, matcher)
+
+            print 'Completing "%s" among 5500 entries:' % prefix
+            report('original listing', per_call(lambda: legacy.list_dir_completions(tmp_dir, matcher), 1))
+            report('cached listing', per_call(cached))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+#
+# Cost of the 'fuzzy' completion over a directory of 50000 entries: scoring
+# every name in Python, versus the FuzzyIndex (one regex pass over the joined
+# names, with only the closest matches scored), for a selective query, broad
+# ones and one that matches nothing; and of building the index of a listing
+# (done once per listing)
+#
+from benchmarks import per_call, report
+from DirCache import Candidate
+from FuzzyIndex import FuzzyIndex, fuzzy_score
+
+def main():
+    names = ['ConfigTest%d.py' % i for i in range(100)] \
+        + ['README_%d.txt' % i for i in range(8000)] \
+        + ['data_file_%05d.csv' % i for i in range(31900)] \
+        + ['img%05d.png' % i for i in range(10000)]
+    candidates = [Candidate(unicode(name), False, True) for name in names]
+    print 'Indexing 50000 names:'
+    report('build', per_call(lambda: FuzzyIndex(candidates), 1))
+    index = FuzzyIndex(candidates)
+    for query in [u'cfgtst', u'rdme', u'e', u'xyz']:
+        def scan():
+            scored = [(fuzzy_score(query, c.name), c) for c in candidates]
+            return [c for (score, c) in sorted([s for s in scored if s[0] is not None], reverse = True)]
+        assert set(scan()) == set(index.search(query))
+        print 'Fuzzy search for "%s" (%d matches):' % (query, len(index.search(query)))
+        report('score every name', per_call(scan, 1))
+        report('index', per_call(lambda: index.search(query)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#
+# Cost of a history search on a 1000-line history with long lines: finding
+# all the matches, compared to the original implementation (kept in
+# tests/legacy.py), and getting to the first match in lazy mode
+#
+from random import Random
+from benchmarks import per_call, report
+from CommandHistory import CommandHistory
+from tests import legacy
+
+words = ['git', 'checkout', 'master', 'commit', '-m', '"Fix the build"', 'cd',
+         'c:\\Program Files\\PyCmd', 'python', 'setup.py', 'build', 'dir',
+         '/s', '*.txt', '|', 'findstr', 'error', '&&', 'make', 'dist_w32',
+         'svn', 'update', 'D:\\work\\project\\src\\main.c', 'type', 'more']
+
+def sample_history(size, random):
+    """Build a history of unique, long-ish lines"""
+    lines = []
+    for i in range(size):
+        line = u' '.join([random.choice(words) for j in range(random.randint(5, 25))])
+        lines.append(line + u' #%d' % i)
+    return lines
+
+def first_match(history, filter):
+    history.start(filter)
+    history.up()
+    return history.current()
+
+def main():
+    history = CommandHistory()
+    for line in sample_history(1000, Random(0)):
+        history.add(line)
+
+    for filter in ['g', 'git c m', 'py set bu', 'findstr err', 'nomatch']:
+        print 'Filter "%s":' % filter
+        report('original search', per_call(lambda: legacy.filter_history(history.list, filter), 1))
+        history.lazy = False
+        report('indexed search', per_call(lambda: history.start(filter)))
+        history.lazy = True
+        report('indexed search, first match (lazy)', per_call(lambda: first_match(history, filter)))
+
+if __name__ == '__main__':
+    main()
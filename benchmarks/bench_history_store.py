@@ -0,0 +1,42 @@
+#
+# Cost of loading and searching large on-disk histories: reading the whole
+# file the original way (kept in tests/legacy.py) versus loading only the most
+# recent lines through the memory-mapped store, and searching the lines that
+# are not loaded; and the cost of saving the history after each command, the
+# original way (merging the in-memory list into the file and rewriting it)
+# versus appending to the journal, plus the occasional compaction
+#
+import os, shutil, tempfile
+from random import Random
+from benchmarks import per_call, report
+from benchmarks.bench_history import sample_history
+from CommandHistory import CommandHistory
+from HistoryStore import HistoryStore
+from tests import legacy
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'history')
+        for size in [1000, 10000, 100000]:
+            lines = sample_history(size, Random(0))
+            if os.path.isfile(filename):
+                os.remove(filename)
+            store = HistoryStore(filename)
+            store.append(lines, size)
+
+            print 'History of %d lines:' % size
+            report('original read', per_call(lambda: legacy.read_history(filename), 1))
+            history = CommandHistory()
+            report('load most recent lines', per_call(lambda: history.load(store), 1))
+            report('search the whole file', per_call(lambda: store.search(['findstr', 'err']), 1))
+
+            legacy.save_history(lines, filename, size)
+            report('original save', per_call(lambda: legacy.save_history(history.list, filename, size), 1, 1))
+            report('journal append', per_call(lambda: store.append([lines[0]], size)))
+            report('compaction', per_call(lambda: store.compact(size), 1))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#
+# Cost of completing the first token of a command from a PATH of 30
+# directories holding 200 files each: listing the directories on every Tab
+# press, the original way (kept in tests/legacy.py), versus looking up the
+# PATH index, which only checks the directories' modification times; and the
+# first Tab press of a new session, with the index saved to a file
+#
+import os, shutil, tempfile
+from benchmarks import per_call, report
+from completion import wildcard_to_regex
+from PathIndex import PathIndex
+from tests import legacy
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    try:
+        os.environ.setdefault('PATHEXT', '.COM;.EXE;.BAT;.CMD')
+        dirs = []
+        for i in range(30):
+            dirs.append(os.path.join(tmp_dir, 'dir%d' % i))
+            os.mkdir(dirs[-1])
+            for j in range(200):
+                ext = ['.exe', '.bat', '.dll', '.txt'][j % 4]
+                open(os.path.join(dirs[-1], 'tool%d_%d%s' % (j, i, ext)), 'w').close()
+        os.environ['PATH'] = os.pathsep.join(dirs)
+
+        index = PathIndex()
+        print 'PATH of 30 directories, 200 files each:'
+        report('original listing', per_call(lambda: legacy.complete_from_path(wildcard_to_regex('tool1*'), []), 1))
+        report('building the index', per_call(lambda: PathIndex().update(), 1))
+        index.update()
+        report('index lookup (up to date)', per_call(lambda: (index.update(), index.complete(u'tool1'))))
+
+        filename = os.path.join(tmp_dir, 'path_index')
+        PathIndex(filename).update()
+        def first_tab():
+            index = PathIndex(filename)
+            index.update()
+            return index.complete(u'tool1')
+        report('first lookup of a new session (index file)', per_call(first_tab))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#
+# Per-call cost of common.parse_line, compared to the original FSM-based
+# tokenizer (kept in tests/legacy.py), and of resuming the tokenization of a
+# line after typing one more character
+#
+from benchmarks import per_call, report
+from common import parse_line, parse_line_incremental
+from tests import legacy
+
+def sample_line(length):
+    """Build a realistic command line of (roughly) the given length"""
+    chunk = 'dir "c:\\Program Files\\Some App" /s 2>&1 | findstr /i "foo^&bar" >> out.txt & '
+    return (chunk * (length / len(chunk) + 1))[:length]
+
+def main():
+    for label, length in [('80 chars', 80), ('4 KB', 4096)]:
+        line = sample_line(length)
+        assert parse_line(line) == legacy.parse_line(line)
+        print '%s:' % label
+        report('fsm.FSM tokenizer (legacy)', per_call(lambda: legacy.parse_line(line)))
+        report('compiled tokenizer', per_call(lambda: parse_line_incremental(None, line)))
+        report('compiled tokenizer, line in cache', per_call(lambda: parse_line(line)))
+        (_, state) = parse_line_incremental(None, line[:-1])
+        report('resume after one typed char',
+               per_call(lambda: parse_line_incremental(state, line[-1])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#
+# Cost of matching the 10000 entries of a directory against a completion
+# pattern: translating and compiling the pattern on every call, the original
+# way (kept in tests/legacy.py), versus the cached matchers, for a wildcard
+# pattern and for a plain "prefix*" one (which skips the regex), and of
+# selecting the matching entries of a cached listing by their lowercase key
+#
+import os, shutil, tempfile, time
+from benchmarks import per_call, report
+from completion import wildcard_to_regex, list_completions
+from tests import legacy
+
+def main():
+    names = ['File%d.txt' % i for i in range(9000)] + ['setup%d.py' % i for i in range(1000)]
+    for pattern in ['file1*', 'f*1?.txt*']:
+        assert [name for name in names if legacy.wildcard_to_regex(pattern).match(name)] \
+            == [name for name in names if wildcard_to_regex(pattern).match(name)]
+        print 'Matching "%s" against 10000 names:' % pattern
+        report('translate and compile per call (legacy)',
+               per_call(lambda: [name for name in names if legacy.wildcard_to_regex(pattern).match(name)]))
+        report('cached matcher',
+               per_call(lambda: [name for name in names if wildcard_to_regex(pattern).match(name)]))
+        report('translation only (legacy)', per_call(lambda: legacy.wildcard_to_regex(pattern)))
+        report('cached translation', per_call(lambda: wildcard_to_regex(pattern)))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name in names:
+            open(os.path.join(tmp_dir, name), 'w').close()
+        mtime = time.time() - 60
+        os.utime(tmp_dir, (mtime, mtime))
+        matcher = wildcard_to_regex('file1*')
+        regex = legacy.wildcard_to_regex('file1*')
+        assert list_completions(tmp_dir, matcher) == list_completions(tmp_dir, regex)
+        print 'Completing "file1" in a directory of 10000 files (cached listing):'
+        report('regex', per_call(lambda: list_completions(tmp_dir, regex)))
+        report('lowercase key prefix', per_call(lambda: list_completions(tmp_dir, matcher)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 #
 # Common utility functions
 #
-import string, mmap, sys, time, os, fsm, pefile, re
+import string, mmap, sys, time, os, pefile, re, tempfile, threading
+from collections import OrderedDict
 
 try:
     import _winreg
@@ -65,90 +66,233 @@ class memoize(object):
         func.func_name = f.func_name
         return func
 
-def parse_line(line):
-    """Tokenize a command line based on whitespace while observing quotes"""
-
-    def accumulate(fsm):
-        """Action: add current symbol to last token in list."""
-        fsm.memory[-1] = fsm.memory[-1] + fsm.input_symbol
+# Tokenizer actions, combined as bit flags; they map onto the actions of the
+# original FSM-based tokenizer as follows:
+#   accumulate          -> _ACCUMULATE
+#   start_empty_token   -> _END_BEFORE
+#   start_token         -> _END_BEFORE | _ACCUMULATE
+#   accumulate_last     -> _ACCUMULATE | _END_AFTER
+_END_BEFORE = 1     # End the current token before the symbol
+_ACCUMULATE = 2     # Add the symbol to the current token
+_END_AFTER = 4      # End the current token after the symbol
+
+def _compile_tokenizer():
+    """
+    Build the transition table used by parse_line()
 
-    def start_empty_token(fsm):
-        """Action: start a new token."""
-        if fsm.memory[-1] != '':
-            fsm.memory.append('')
+    The grammar is described by the same kind of transitions as an fsm.FSM:
 
-    def start_token(fsm):
-        """Action: start a new token and accumulate."""
-        start_empty_token(fsm)
-        accumulate(fsm)
+        (input_symbol, state) --> (action, next_state)
+        (state) --> (action, next_state)                for any symbol
+        (state) --> (action, next_state)                not consuming the symbol
 
-    def accumulate_last(fsm):
-        """Action: accumulate and start new token."""
-        accumulate(fsm)
-        start_empty_token(fsm)
+    The last kind (empty transitions) is folded into the table at this point,
+    so that the scanner needs exactly one lookup per input symbol. The result
+    is a list indexed by state number, holding for each state a pair:
 
-    def error(fsm):
-        """Action: handle uncovered transition (should never happen)."""
-        print 'Unhandled transition:', (fsm.input_symbol, fsm.current_state)
-        accumulate(fsm)
+        ({input_symbol: (action, next_state)}, (action, next_state) for others)
+    """
+    accumulate = _ACCUMULATE
+    start_empty_token = _END_BEFORE
+    start_token = _END_BEFORE | _ACCUMULATE
+    accumulate_last = _ACCUMULATE | _END_AFTER
 
-    f = fsm.FSM('init', [''])
+    transitions = {}
+    transitions_any = {}
+    empty_transitions = {}
 
-    f.set_default_transition(error, 'init')
+    def add_transition_list(symbols, state, action, next_state):
+        for symbol in symbols:
+            transitions.setdefault(state, {})[symbol] = (action, next_state)
 
     # default
-    f.add_transition_list(string.whitespace, 'init', start_empty_token, 'whitespace')
-    f.add_transition('"', 'init', accumulate, 'in_string')
-    f.add_transition('|', 'init', start_token, 'pipe')
-    f.add_transition('&', 'init', start_token, 'amp')
-    f.add_transition('>', 'init', start_token, 'gt')
-    f.add_transition('<', 'init', accumulate, 'awaiting_&')
-    f.add_transition('^', 'init', accumulate, 'escape')
-    f.add_transition_list(string.digits, 'init', accumulate, 'redir')
-    f.add_transition_any('init', accumulate, 'init')
+    add_transition_list(string.whitespace, 'init', start_empty_token, 'whitespace')
+    add_transition_list('"', 'init', accumulate, 'in_string')
+    add_transition_list('|', 'init', start_token, 'pipe')
+    add_transition_list('&', 'init', start_token, 'amp')
+    add_transition_list('>', 'init', start_token, 'gt')
+    add_transition_list('<', 'init', accumulate, 'awaiting_&')
+    add_transition_list('^', 'init', accumulate, 'escape')
+    add_transition_list(string.digits, 'init', accumulate, 'redir')
+    transitions_any['init'] = (accumulate, 'init')
 
     # whitespace
-    f.add_transition_list(string.whitespace, 'whitespace', None, 'whitespace')
-    f.add_empty_transition('whitespace', 'init')
+    add_transition_list(string.whitespace, 'whitespace', 0, 'whitespace')
+    empty_transitions['whitespace'] = (0, 'init')
 
     # strings
-    f.add_transition('"', 'in_string', accumulate, 'init')
-    f.add_transition_any('in_string', accumulate, 'in_string')
+    add_transition_list('"', 'in_string', accumulate, 'init')
+    transitions_any['in_string'] = (accumulate, 'in_string')
 
     # seen '|'
-    f.add_transition('|', 'pipe', accumulate_last, 'init')
-    f.add_empty_transition('pipe', 'init', start_empty_token)
+    add_transition_list('|', 'pipe', accumulate_last, 'init')
+    empty_transitions['pipe'] = (start_empty_token, 'init')
 
     # seen '&'
-    f.add_transition('&', 'amp', accumulate_last, 'init')
-    f.add_empty_transition('amp', 'init', start_empty_token)
+    add_transition_list('&', 'amp', accumulate_last, 'init')
+    empty_transitions['amp'] = (start_empty_token, 'init')
 
     # seen '>' or '1>' etc.
-    f.add_transition('>', 'gt', accumulate, 'awaiting_&')
-    f.add_transition('&', 'gt', accumulate, 'awaiting_nr')
-    f.add_empty_transition('gt', 'init', start_empty_token)
+    add_transition_list('>', 'gt', accumulate, 'awaiting_&')
+    add_transition_list('&', 'gt', accumulate, 'awaiting_nr')
+    empty_transitions['gt'] = (start_empty_token, 'init')
 
     # seen digit
-    f.add_transition('<', 'redir', accumulate, 'awaiting_&')
-    f.add_transition('>', 'redir', accumulate, 'gt')
-    f.add_empty_transition('redir', 'init')
+    add_transition_list('<', 'redir', accumulate, 'awaiting_&')
+    add_transition_list('>', 'redir', accumulate, 'gt')
+    empty_transitions['redir'] = (0, 'init')
 
     # seen '<' or '>>', '0<', '2>>' etc.
-    f.add_transition('&', 'awaiting_&', accumulate, 'awaiting_nr')
-    f.add_empty_transition('awaiting_&', 'init', start_empty_token)
+    add_transition_list('&', 'awaiting_&', accumulate, 'awaiting_nr')
+    empty_transitions['awaiting_&'] = (start_empty_token, 'init')
 
     # seen '<&' or '>&', '>>&', '0<&', '1>&', '2>>&' etc.
-    f.add_transition_list(string.digits, 'awaiting_nr', accumulate_last, 'init')
-    f.add_empty_transition('awaiting_nr', 'init', start_empty_token)
+    add_transition_list(string.digits, 'awaiting_nr', accumulate_last, 'init')
+    empty_transitions['awaiting_nr'] = (start_empty_token, 'init')
 
     # seen '^'
-    f.add_transition_any('escape', accumulate, 'init')
+    transitions_any['escape'] = (accumulate, 'init')
+
+    states = ['init', 'whitespace', 'in_string', 'pipe', 'amp', 'gt',
+              'redir', 'awaiting_&', 'awaiting_nr', 'escape']
+
+    def resolve(state):
+        """Resolve the transitions of a state, following empty transitions"""
+        specific = dict(transitions.get(state, {}))
+        if state in transitions_any:
+            return specific, transitions_any[state]
+        elif state in empty_transitions:
+            # An empty transition only ever ends the current token (or does
+            # nothing), so it can be merged into the actions that follow it
+            (empty_action, next_state) = empty_transitions[state]
+            (next_specific, next_default) = resolve(next_state)
+            for symbol, (action, target) in next_specific.items():
+                specific.setdefault(symbol, (empty_action | action, target))
+            return specific, (empty_action | next_default[0], next_default[1])
+        else:
+            # Uncovered transition (should never happen)
+            return specific, (accumulate, 'init')
 
-    f.process_list(line)
-    if len(f.memory) > 0 and f.memory[-1] == '':
-        del f.memory[-1]
+    table = []
+    for state in states:
+        (specific, default) = resolve(state)
+        specific = dict([(symbol, (action, states.index(target)))
+                         for symbol, (action, target) in specific.items()])
+        table.append((specific, (default[0], states.index(default[1]))))
+    return table
 
-    return f.memory
+_tokenizer_table = _compile_tokenizer()
+
+# Number of recently tokenized lines whose final tokenizer state is kept, so
+# that tokenizing the same line (or a continuation of it) again is cheap
+_tokenizer_cache_size = 64
+_tokenizer_cache = OrderedDict()
+
+# How many characters back from the end of a line parse_line() looks for a
+# cached prefix to resume from (e.g. the line before a character was typed,
+# or before a space was appended)
+_tokenizer_max_resume = 16
+
+# Guards the cache, as lines are also tokenized on the completion threads
+_tokenizer_lock = threading.Lock()
+
+class TokenizerState(object):
+    """
+    Snapshot of the tokenizer at the end of a line, from which the
+    tokenization of any continuation of that line can be resumed
+    """
+    __slots__ = ['line', 'state', 'tokens', 'pending']
+
+    def __init__(self, line, state, tokens, pending):
+        self.line = line            # The text tokenized so far
+        self.state = state          # Tokenizer state (index in the table)
+        self.tokens = tokens        # Completed tokens (a tuple)
+        self.pending = pending      # The current, unfinished token (or '')
+
+    def get_tokens(self):
+        """Return a fresh list of the tokens of the line"""
+        tokens = list(self.tokens)
+        if self.pending:
+            tokens.append(self.pending)
+        return tokens
+
+_initial_tokenizer_state = TokenizerState('', 0, (), '')
+
+def _scan(line, state, pending):
+    """
+    Run the tokenizer over a string, starting from the given state and with
+    the given unfinished token; return the new state, the list of completed
+    tokens and the new unfinished token.
+    """
+    tokens = []
+    token_start = 0 if pending else -1  # Start of the current token, -1 if none
+    table = _tokenizer_table
+    for pos, symbol in enumerate(line):
+        (specific, default) = table[state]
+        (action, state) = specific.get(symbol, default)
+        if action & _END_BEFORE and token_start >= 0:
+            tokens.append(pending + line[token_start : pos])
+            token_start = -1
+            pending = ''
+        if action & _ACCUMULATE and token_start < 0:
+            token_start = pos
+        if action & _END_AFTER and token_start >= 0:
+            tokens.append(pending + line[token_start : pos + 1])
+            token_start = -1
+            pending = ''
+    if token_start >= 0:
+        pending += line[token_start : ]
+    return state, tokens, pending
+
+def parse_line_incremental(prev_state, suffix):
+    """
+    Tokenize a line by resuming from the state reached at the end of one of
+    its prefixes, e.g. as the user types one character at a time.
+
+    prev_state is a TokenizerState returned by a previous call (None to start
+    from the beginning of the line) and suffix is the text that follows it.
+    Returns the tokens of the whole line and the new TokenizerState.
+    """
+    if prev_state is None:
+        prev_state = _initial_tokenizer_state
+    (state, tokens, pending) = _scan(suffix, prev_state.state, prev_state.pending)
+    if tokens:
+        tokens = prev_state.tokens + tuple(tokens)
+    else:
+        tokens = prev_state.tokens
+    new_state = TokenizerState(prev_state.line + suffix, state, tokens, pending)
+    return new_state.get_tokens(), new_state
+
+def parse_line(line):
+    """Tokenize a command line based on whitespace while observing quotes"""
+    with _tokenizer_lock:
+        cached = _tokenizer_cache.get(line)
+        if cached is not None and type(cached.line) is type(line):
+            # Same line, just refresh its place in the cache
+            del _tokenizer_cache[line]
+            _tokenizer_cache[line] = cached
+            return cached.get_tokens()
+
+        # Resume from the longest recently tokenized prefix of the line, if
+        # one is only a few characters shorter
+        prev_state = None
+        for end in xrange(len(line) - 1, max(len(line) - _tokenizer_max_resume, 0) - 1, -1):
+            cached = _tokenizer_cache.get(line[:end])
+            if cached is not None and type(cached.line) is type(line):
+                prev_state = cached
+                break
+
+    suffix = line[len(prev_state.line) : ] if prev_state is not None else line
+    (tokens, new_state) = parse_line_incremental(prev_state, suffix)
+
+    # Remember the state, dropping the least recently used one if needed
+    with _tokenizer_lock:
+        _tokenizer_cache.pop(line, None)
+        _tokenizer_cache[line] = new_state
+        if len(_tokenizer_cache) > _tokenizer_cache_size:
+            _tokenizer_cache.popitem(last = False)
+
+    return tokens
 
 def unescape(string):
     """Unescape string from ^ escaping. ^ inside double quotes is ignored"""
@@ -255,10 +399,19 @@ def fuzzy_match(substr, str, prefix_only = False):
 
 def abbrev_string(string):
     """Abbreviate a string by keeping uppercase and non-alphabetical characters"""
-    string_abbrev = ''
+    return ''.join([string[i] for i in word_starts(string)])
+
+def word_starts(string):
+    """
+    The positions of the characters that start the "words" of a string (by
+    CamelCase, whitespace or non-alphabetical separators), as kept by
+    abbrev_string()
+    """
+    starts = []
     add_next_char = True
+    all_upper = string.isupper()
 
-    for char in string:
+    for i, char in enumerate(string):
         add_this_char = add_next_char
         if char == ' ':
             add_this_char = False
@@ -266,22 +419,22 @@ def abbrev_string(string):
         elif not char.isalpha():
             add_this_char = True
             add_next_char = True
-        elif char.isupper() and not string.isupper():
+        elif char.isupper() and not all_upper:
             add_this_char = True
             add_next_char = False
         else:
             add_next_char = False
         if add_this_char:
-            string_abbrev += char
+            starts.append(i)
 
-    return string_abbrev
+    return starts
 
 _exec_exts = None
 
 def exec_exts():
     global _exec_exts
     if _exec_exts is None:
-        _exec_exts = os.environ['PATHEXT'].lower().split(';')
+        _exec_exts = os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').lower().split(';')
         if '.dll' in _exec_exts: _exec_exts.remove('.dll')
     return _exec_exts
 @memoize()
@@ -403,3 +556,59 @@ def is_gui_application(executable):
     # Return False when not sure
     return result
 
+
+if os.name == 'nt':
+    import msvcrt, pywintypes
+    from win32api import MoveFileEx
+    from win32con import MOVEFILE_REPLACE_EXISTING
+
+    def lock_file(f):
+        """Lock an open file, waiting for other processes to release it"""
+        f.seek(0)
+        while True:
+            try:
+                # This gives up after trying for about 10 seconds
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except IOError:
+                pass
+
+    def unlock_file(f):
+        """Release the lock on a file"""
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def lock_file(f):
+        """Lock an open file, waiting for other processes to release it"""
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def unlock_file(f):
+        """Release the lock on a file"""
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def replace_file(filename, content):
+    """
+    Replace the contents of a file, without disturbing the readers that have
+    the old file open: the new contents are written to a temporary file which
+    is then renamed over the old one. On Windows the rename fails (with an
+    OSError) while another process has the file open or mapped, so readers
+    should only hold it briefly.
+    """
+    (fd, temp_filename) = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(filename)))
+    try:
+        temp_file = os.fdopen(fd, 'wb')
+        temp_file.write(content)
+        temp_file.close()
+        if os.name == 'nt':
+            try:
+                MoveFileEx(temp_filename, filename, MOVEFILE_REPLACE_EXISTING)
+            except pywintypes.error, e:
+                raise OSError(e.winerror, e.strerror)
+        else:
+            os.rename(temp_filename, filename)
+    finally:
+        if os.path.isfile(temp_filename):
+            os.remove(temp_filename)
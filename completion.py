@@ -4,12 +4,45 @@
 #    2) names of environment variables
 #
 
-import sys, os, re
+import sys, os, re, threading
+from collections import OrderedDict
 from common import parse_line, expand_env_vars, has_exec_extension, strip_extension
 from common import contains_special_char, starts_with_special_char
 from common import sep_chars, seq_tokens
+from aliases import complete_alias
+from PathIndex import PathIndex
+from DirCache import DirCache
+from FuzzyIndex import FuzzyIndex
 
-def complete_file(line):
+# The executables in the PATH, indexed on first use
+path_index = PathIndex()
+
+# The listings of the directories being completed
+dir_cache = DirCache()
+
+# Fuzzy indexes of the listings completed lately, as id(listing) -> (listing,
+# index) (the listing is kept so that its id isn't reused)
+_fuzzy_indexes_size = 4
+_fuzzy_indexes = OrderedDict()
+_fuzzy_indexes_lock = threading.Lock()
+
+def complete_line(line, mode = 'bash'):
+    """
+    Complete the last token of a line: an environment variable, a wildcard
+    or the name of a file or directory, as it looks like; mode is the
+    completion mode, 'bash' or 'fuzzy'
+    """
+    tokens = parse_line(line)
+    if tokens == [] or line[-1] in sep_chars:
+        tokens.append('')   # This saves some checks later on
+    if tokens[-1].strip('"').count('%') % 2 == 1:
+        return complete_env_var(line)
+    elif has_wildcards(tokens[-1]):
+        return complete_wildcard(line)
+    else:
+        return complete_file(line, mode)
+
+def complete_file(line, mode = 'bash'):
     """
     Complete names of files and/or directories
 
@@ -30,9 +63,75 @@ def complete_file(line):
     if completed == line and completions == []:
         # Try the alternate completion
         (completed, completions) = complete_file_alternate(line)
+    if completed == line and completions == [] and mode == 'fuzzy':
+        # Try the names that hold the typed characters in order
+        (completed, completions) = complete_file_fuzzy(line)
 
     return completed, completions
 
+class FuzzyCompletions(list):
+    """The names matched by complete_file_fuzzy(), with the query they match"""
+    def __init__(self, names, query):
+        list.__init__(self, names)
+        self.query = query
+
+def complete_file_fuzzy(line):
+    """
+    Complete names of files or directories that hold the characters of the
+    last token in order, e.g. "rdme" for "README.txt"
+
+    It returns a pair:
+      - the line with the last token replaced by the name, if only one
+        matches (the line unchanged otherwise)
+      - the list of all matching names, the best matches first (as
+        FuzzyCompletions)
+    """
+    tokens = parse_line(line)
+    if tokens == [] or (line[-1] in sep_chars and parse_line(line) == parse_line(line + ' ')):
+        tokens += ['']   # This saves us some checks later
+    token = tokens[-1].replace('"', '')
+
+    (path_to_complete, _, prefix) = token.rpartition('\\')
+    if path_to_complete == '' and token != '' and token[0] == '\\':
+        path_to_complete = '\\'
+    if prefix == '':
+        return line, []
+
+    if path_to_complete == '':
+        dir_to_complete = os.getcwd()
+    elif path_to_complete == '\\':
+        dir_to_complete = os.getcwd()[0:3]
+    else:
+        dir_to_complete = expand_env_vars(path_to_complete) + '\\'
+
+    candidates = fuzzy_index(dir_cache.listing(dir_to_complete)).search(prefix)
+    completions = FuzzyCompletions([candidate.name + '\\' if candidate.is_dir else candidate.name
+                                    for candidate in candidates if candidate.is_dir or candidate.is_file],
+                                   prefix)
+    if len(completions) == 1:
+        # Complete the name as if it had been typed whole (quoted, in case it
+        # holds spaces), to get the quoting right
+        if path_to_complete == '':
+            completed_file = completions[0].rstrip('\\')
+        elif path_to_complete == '\\':
+            completed_file = '\\' + completions[0].rstrip('\\')
+        else:
+            completed_file = path_to_complete + '\\' + completions[0].rstrip('\\')
+        return complete_file_simple(line[0 : len(line) - len(tokens[-1])] + '"' + completed_file)
+    return line, completions
+
+def fuzzy_index(listing):
+    """The fuzzy index of a directory listing, built on first use"""
+    with _fuzzy_indexes_lock:
+        cached = _fuzzy_indexes.pop(id(listing), None)
+    if cached is None or cached[0] is not listing:
+        cached = (listing, FuzzyIndex(listing))
+    with _fuzzy_indexes_lock:
+        _fuzzy_indexes[id(listing)] = cached
+        if len(_fuzzy_indexes) > _fuzzy_indexes_size:
+            _fuzzy_indexes.popitem(last = False)
+    return cached[1]
+
 def complete_file_simple(line):
     """
     Complete names of files or directories
@@ -65,36 +164,18 @@ def complete_file_simple(line):
     # This is the wildcard matcher used throughout the function
     matcher = wildcard_to_regex(prefix + '*')
 
-    completions = []
-    if os.path.isdir(dir_to_complete):
-        try:
-            completions = [elem for elem in os.listdir(dir_to_complete) 
-                           if matcher.match(elem)]
-        except OSError:
-            # Cannot complete, probably access denied
-            pass
-        
-
-    # Sort directories first, also append '\'; then, files
-    completions_dirs = [elem + '\\' for elem in completions if os.path.isdir(dir_to_complete + '\\' + elem)]
-    completions_files = [elem for elem in completions if os.path.isfile(dir_to_complete + '\\' + elem)]
-    completions = completions_dirs + completions_files
+    completions = list_completions(dir_to_complete, matcher)
 
     if (len(tokens) == 1 or tokens[-2] in seq_tokens) and path_to_complete == '':
         # We are at the beginning of a command ==> also complete from the path
-        completions_path = []
-        for elem_in_path in os.environ['PATH'].split(';'):
-            dir_to_complete = expand_env_vars(elem_in_path) + '\\'
-            try:                
-                completions_path += [elem for elem in os.listdir(dir_to_complete) 
-                                     if matcher.match(elem)
-                                     and os.path.isfile(dir_to_complete + '\\' + elem)
-                                     and has_exec_extension(elem)
-                                     and not elem in completions
-                                     and not elem in completions_path]
-            except OSError:
-                # Cannot complete, probably access denied
-                pass
+        path_index.update()
+        if has_wildcards(prefix):
+            executables = [elem for elem in path_index.complete('') if matcher.match(elem)]
+        else:
+            executables = path_index.complete(prefix)
+        seen = set(completions)
+        completions_path = [elem for elem in executables if not elem in seen]
+        seen.update(completions_path)
 
         # Add internal commands
         internal_commands = ['assoc',
@@ -115,20 +196,29 @@ def complete_file_simple(line):
             internal_commands.append('mklink')
         completions_path += [elem for elem in internal_commands
                              if matcher.match(elem)
-                             and not elem in completions
-                             and not elem in completions_path]
+                             and not elem in seen]
+        seen.update(completions_path)
+
+        # Add aliases
+        if has_wildcards(prefix):
+            aliases = [elem for elem in complete_alias('') if matcher.match(elem)]
+        else:
+            aliases = complete_alias(prefix)
+        completions_path += [elem for elem in aliases
+                             if not elem in seen]
 
 
         # Sort in lexical order (case ignored)
-        completions_path.sort(key=str.lower)
+        completions_path.sort(key=lambda elem: elem.lower())
 
         # Remove .com, .exe or .bat extension where possible
         completions_path_no_ext = [strip_extension(elem) for elem in completions_path]
+        similar = {}
+        for elem in completions_path_no_ext + [strip_extension(elem) for elem in completions]:
+            similar[elem] = similar.get(elem, 0) + 1
         completions_path_nice = []
         for i in range(0, len(completions_path_no_ext)):
-            similar = [elem for elem in completions_path_no_ext if elem == completions_path_no_ext[i]]
-            similar += [elem for elem in completions if strip_extension(elem) == completions_path_no_ext[i]]
-            if len(similar) == 1 and has_exec_extension(completions_path[i]) and len(prefix) < len(completions_path[i]) - 3:
+            if similar[completions_path_no_ext[i]] == 1 and has_exec_extension(completions_path[i]) and len(prefix) < len(completions_path[i]) - 3:
                 # No similar executables, don't use extension
                 completions_path_nice.append(completions_path_no_ext[i])
             else:
@@ -221,20 +311,7 @@ def complete_file_alternate(line):
     # This is the wildcard matcher used throughout the function
     matcher = wildcard_to_regex(prefix + '*')
 
-    completions = []
-    if os.path.isdir(dir_to_complete):
-        try:
-            completions = [elem for elem in os.listdir(dir_to_complete) 
-                           if matcher.match(elem)]
-        except OSError:
-            # Cannot complete, probably access denied
-            pass
-        
-
-    # Sort directories first, also append '\'; then, files
-    completions_dirs = [elem + '\\' for elem in completions if os.path.isdir(dir_to_complete + '\\' + elem)]
-    completions_files = [elem for elem in completions if os.path.isfile(dir_to_complete + '\\' + elem)]
-    completions = completions_dirs + completions_files
+    completions = list_completions(dir_to_complete, matcher)
 
     if len(completions) > 0:
         # Find the longest common sequence
@@ -301,19 +378,7 @@ def complete_wildcard(line):
     # This is the wildcard matcher used throughout the function
     matcher = wildcard_to_regex(prefix + '*')
 
-    completions = []
-    if os.path.isdir(dir_to_complete):
-        try:
-            completions = [elem for elem in os.listdir(dir_to_complete) if matcher.match(elem)]
-        except OSError:
-            # Cannot complete, probably access denied
-            pass
-        
-
-    # Sort directories first, also append '\'; then, files
-    completions_dirs = [elem + '\\' for elem in completions if os.path.isdir(dir_to_complete + '\\' + elem)]
-    completions_files = [elem for elem in completions if os.path.isfile(dir_to_complete + '\\' + elem)]
-    completions = completions_dirs + completions_files
+    completions = list_completions(dir_to_complete, matcher)
 
     if len(completions) > 0:
         completed_suffixes = []
@@ -427,70 +492,147 @@ def complete_env_var(line):
 
 
 
+# Number of recent (original, completions) pairs whose common prefix is kept
+_common_prefix_cache_size = 16
+_common_prefix_cache = OrderedDict()
+_common_prefix_lock = threading.Lock()
+
 def find_common_prefix(original, completions):
     """
     Search for the longest common prefix in a list of strings
     Returns the longest common prefix
     """
-    common_len = 0
-    common_string = ''
-    mismatch = False
-    perfect = True
+    key = (original, tuple(completions))
+    with _common_prefix_lock:
+        common_string = _common_prefix_cache.pop(key, None)
+    if common_string is None:
+        common_string = _find_common_prefix(original, completions)
+    with _common_prefix_lock:
+        _common_prefix_cache[key] = common_string
+        if len(_common_prefix_cache) > _common_prefix_cache_size:
+            _common_prefix_cache.popitem(last = False)
+    return common_string
+
+def _find_common_prefix(original, completions):
+    first = completions[0]
 
-    # Cache lowercase version to avoid repeated calls to str.lower()
+    # The common prefix, case ignored, is the one of the (lowercase) first
+    # and last strings in sorted order
     completions_lower = [s.lower() for s in completions]
-    common_string_lower = ''
-
-    while common_len < len(completions[0]) and not mismatch:
-        common_len += 1
-        common_string = completions[0][0:common_len]
-        common_string_lower = completions_lower[0][0:common_len]
-        for i in range(1, len(completions)):
-            completion = completions[i]
-            completion_lower = completions_lower[i]
-            if completion_lower[0:common_len] != common_string_lower:
-                mismatch = True
-            elif completion[0:common_len] != common_string:
-                perfect = False
-    if mismatch:
-        common_string = common_string[:-1]
-        common_len -= 1
-
-    # Try to take a good guess wrt letter casing
+    common_len = len(os.path.commonprefix([min(completions_lower), max(completions_lower)]))
+    common_string = first[:common_len]
+
+    # Whether the strings agree on the letter casing; this also looks at the
+    # character following the common prefix, in the strings that have it
+    # (case ignored)
+    perfect = True
+    next_char = first[common_len : common_len + 1]
+    next_lower = completions_lower[0][common_len : common_len + 1]
+    for (completion, completion_lower) in zip(completions, completions_lower):
+        if not completion.startswith(common_string) \
+                or (next_char != '' and completion_lower[common_len : common_len + 1] == next_lower
+                    and completion[common_len] != next_char):
+            perfect = False
+            break
+
+    # Try to take a good guess wrt letter casing: follow the first string that
+    # matches the longest possible start of the original one
     if not perfect:
-        for i in range(len(original)):
-            case_match = [c for c in completions if c.startswith(original[:i + 1])]
-            if len(case_match) > 0:
-                common_string = case_match[0][:common_len]
+        (lo, hi) = (0, len(original))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if [c for c in completions if c.startswith(original[:mid])]:
+                lo = mid
             else:
-                break
+                hi = mid - 1
+        if lo > 0:
+            case_match = [c for c in completions if c.startswith(original[:lo])]
+            common_string = case_match[0][:common_len]
 
     return common_string
 
 
+def list_completions(dir_to_complete, matcher):
+    """
+    The entries of a directory matched by matcher: first the directories,
+    with a trailing '\\', then the files
+    """
+    if isinstance(matcher, PrefixMatcher):
+        candidates = [candidate for candidate in dir_cache.listing(dir_to_complete)
+                      if candidate.key.startswith(matcher.prefix)]
+    else:
+        candidates = [candidate for candidate in dir_cache.listing(dir_to_complete)
+                      if matcher.match(candidate.name)]
+    return ([candidate.name + '\\' for candidate in candidates if candidate.is_dir]
+            + [candidate.name for candidate in candidates if candidate.is_file])
+
+
+# Number of recently used wildcard patterns whose matcher is kept
+_matcher_cache_size = 64
+_matcher_cache = OrderedDict()
+_matcher_lock = threading.Lock()
+
+# The wildcards, and what they stand for in a regex
+_wildcard_split = re.compile(r'([*?])')
+_wildcard_groups = {'*': '(.*)', '?': '(.)'}
+
+class PrefixMatch(object):
+    """The match of a PrefixMatcher, with the suffix as group 1"""
+    __slots__ = ['string', 'pos']
+    lastindex = 1
+
+    def __init__(self, string, pos):
+        self.string = string
+        self.pos = pos
+
+    def start(self, group = 0):
+        return self.pos if group else 0
+
+    def end(self, group = 0):
+        return len(self.string)
+
+    def group(self, group = 0):
+        return self.string[self.start(group):]
+
+    def groups(self):
+        return (self.string[self.pos:],)
+
+
+class PrefixMatcher(object):
+    """
+    Matcher for a "prefix*" pattern, testing the (lowercase) start of names
+    instead of running a regex
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix.lower()
+
+    def match(self, name):
+        if name.lower().startswith(self.prefix):
+            return PrefixMatch(name, len(self.prefix))
+        return None
+
+
 def wildcard_to_regex(pattern):
     """
-    Transform a wildcard pattern into a compiled regex object.
+    Transform a wildcard pattern into a compiled regex object (or an object
+    with the same match() for "prefix*" patterns), case ignored.
     This also handles escaping as needed.
     """
-    # Transform pattern into regexp
-    translations = [('\\', '\\\\'),
-                    ('(', '\\('), 
-                    (')', '\\)'),
-                    ('[', '\\['), 
-                    (']', '\\]'),
-                    ('.', '\\.'),
-                    ('+', '\\+'),
-                    ('^', '\\^'),
-                    ('$', '\\$'),
-                    ('?', '(.)'), 
-                    ('*', '(.*)')]
-                    
-    re_pattern = pattern
-    for src, dest in translations:
-        re_pattern = re_pattern.replace(src, dest)
-    re_pattern += '$'
-    return re.compile(re_pattern, re.IGNORECASE)
+    with _matcher_lock:
+        matcher = _matcher_cache.pop(pattern, None)
+    if matcher is None:
+        if pattern.endswith('*') and not has_wildcards(pattern[:-1]):
+            matcher = PrefixMatcher(pattern[:-1])
+        else:
+            # Transform pattern into regexp
+            re_pattern = ''.join([_wildcard_groups.get(part) or re.escape(part)
+                                  for part in _wildcard_split.split(pattern)])
+            matcher = re.compile(re_pattern + '$', re.IGNORECASE)
+    with _matcher_lock:
+        _matcher_cache[pattern] = matcher
+        if len(_matcher_cache) > _matcher_cache_size:
+            _matcher_cache.popitem(last = False)
+    return matcher
 
 
 def has_wildcards(pattern):
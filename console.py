@@ -99,6 +99,7 @@ def read_input():
 def write_input(key_code, control_state):
     """Emulate a key press with the given key code and control key mask"""
     record = INPUT_RECORD()
+    record.EventType = KEY_EVENT
     keyevent = record.EU.KeyEvent if PYPY else record.KeyEvent
     keyevent.KeyDown = True
     keyevent.VirtualKeyCode = key_code
@@ -106,6 +107,13 @@ def write_input(key_code, control_state):
     if not WriteOneConsoleInput(stdin_handle, record):
         raise WindowsError('Could not write event to stdin.')
 
+def discard_input(key_code):
+    """Drop the pending key presses with the given key code from the input buffer"""
+    for record in ReadPendingConsoleInput(stdin_handle):
+        keyevent = record.EU.KeyEvent if PYPY else record.KeyEvent
+        if record.EventType != KEY_EVENT or keyevent.VirtualKeyCode != key_code:
+            WriteOneConsoleInput(stdin_handle, record)
+
 def write_str(s):
     """
     Output s to stdout (after encoding it with stdout encoding to
@@ -180,12 +180,46 @@ behavior.quiet_mode = False
 
 # Change the way PyCmd handles Tab-completion
 # 
-# Currently, the only accepted (and, of course, default) value is 'bash', giving
-# the typical bash-like completion.
+# The accepted values are:
+#   'bash'  - the typical bash-like completion (the default)
+#   'fuzzy' - like 'bash', but when no name starts with what was typed, offer
+#             the names that hold the typed characters in order, best matches
+#             first (e.g. "rdme" completes to "README.txt")
 #
 behavior.completion_mode = 'bash'
 
 
+# Change where PyCmd keeps its data (e.g. the aliases)
+#
+# The accepted values are:
+#   'pickle'  - a pickled file
+#   'snappy'  - same as 'pickle', compressed (with snappy, lz4 or zlib,
+#               whichever is installed)
+#   'sqlite3' - an SQLite database
+#   'leveldb' - a LevelDB database (needs py-leveldb, see the README)
+#   'logkv'   - a log of the changes, compacted now and then
+#   None      - the LevelDB database of earlier versions if there is one,
+#               otherwise 'pickle' (the default)
+#
+# Earlier versions always used LevelDB where it was installed; the data is not
+# converted when switching to another backend.
+#
+# The default is None:
+#       behavior.data_backend = None
+behavior.data_backend = None
+
+
+# Change the maximum number of commands kept in the history file
+#
+# Only the most recent 1000 commands are loaded in memory; older ones are
+# searched directly in the history file, so large values don't slow down the
+# startup of PyCmd.
+#
+# The default is 1000:
+#       behavior.history_size = 1000
+behavior.history_size = 1000
+
+
 # Remember, you can do whatever you want in this Python script!
 #
 # Also note that you can directly output colored text via the color
@@ -183,22 +183,31 @@ class Behavior(_Settings):
         # This can be also overriden with the '-Q' command line argument'
         self.quiet_mode = False
 
-        # Select the completion mode; currently supported: 'bash'
+        # Select the completion mode; currently supported: 'bash', 'fuzzy'
         self.completion_mode = 'bash'
 
         # Select the database backend for various custom stuff; currently supported:
         # pickle - Use pickle to serialize/deserialize data. (Will aim to use cPickle if possible)
-        # snappy - Same as pickle, but use the snappy compression library to compress the file. (See ReadMe)
+        # snappy - Same as pickle, but compress the file (with snappy, lz4 or zlib, whichever is installed)
         # sqlite3 - Use an sqlite database as the backend.
         # leveldb - Use LevelDB. (See readme)
-        self.data_backend = 'pickle'
+        # logkv - Append changes to a log file, keep the data in memory. (Compacted now and then)
+        # None - The LevelDB database of earlier versions if there is one, otherwise pickle
+        self.data_backend = None
+
+        # Maximum number of commands kept in the history file; only the most
+        # recent 1000 are loaded in memory, the rest are searched on disk
+        self.history_size = 1000
     def sanitize(self):
-        if not self.completion_mode in ['bash']:
+        if not self.completion_mode in ['bash', 'fuzzy']:
             print 'Invalid setting "' + self.completion_mode + '" for "completion_mode" -- using default "bash"'
             self.completion_mode = 'bash'
-        if not self.data_backend in ['pickle', 'snappy', 'sqlite3', 'leveldb']:
-            print 'Invalid setting "' + self.data_backend + '" for "data_backend" -- using default "pickle"'
-            self.data_backend = 'pickle'
+        if not self.data_backend in [None, 'pickle', 'snappy', 'sqlite3', 'leveldb', 'logkv']:
+            print 'Invalid setting "' + str(self.data_backend) + '" for "data_backend" -- using the default'
+            self.data_backend = None
+        if not isinstance(self.history_size, (int, long)) or self.history_size <= 0:
+            print 'Invalid setting "' + str(self.history_size) + '" for "history_size" -- using default 1000'
+            self.history_size = 1000
 
 
 # Initialize global configuration instances with default values
@@ -1,11 +1,21 @@
 import unittest
-from tests import common_tests, completion_tests, console_tests
+from tests import aliases_tests, common_tests, completion_presenter_tests, completion_tests, completion_worker_tests, console_tests, dir_cache_tests, fuzzy_index_tests, history_tests, history_store_tests, history_writer_tests, path_index_tests, pycmddb_tests
 
 def suite():
     suite = unittest.TestSuite()
+    suite.addTest(aliases_tests.suite())
     suite.addTest(common_tests.suite())
+    suite.addTest(completion_presenter_tests.suite())
     suite.addTest(completion_tests.suite())
+    suite.addTest(completion_worker_tests.suite())
     suite.addTest(console_tests.suite())
+    suite.addTest(dir_cache_tests.suite())
+    suite.addTest(fuzzy_index_tests.suite())
+    suite.addTest(history_tests.suite())
+    suite.addTest(history_store_tests.suite())
+    suite.addTest(history_writer_tests.suite())
+    suite.addTest(path_index_tests.suite())
+    suite.addTest(pycmddb_tests.suite())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+#
+# Unit tests for aliases.py
+#
+
+import shutil, sys, tempfile, threading
+from StringIO import StringIO
+from unittest import TestCase, TestSuite, defaultTestLoader
+from PyCmdDB import get_db_backend
+from aliases import AliasCache
+import aliases
+
+class TestAliasCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_backend(self, backend):
+        db = get_db_backend(self.dir, 'pycmd', backend)
+        db.put('gitcl', ['git', 'clone'])
+        cache = AliasCache(db)
+        self.assertEqual(cache.get(u'gitcl'), ['git', 'clone'])
+        self.assertEqual(cache.get(u'll'), None)
+        self.assertEqual(cache.get(u'\xe9t\xe9'), None)
+
+        # Served from memory
+        cache.aliases['ll'] = ['dir']
+        self.assertEqual(cache.get(u'll'), ['dir'])
+
+        # Changed in this session
+        db.put('ll', ['dir', '/w'])
+        cache.invalidate()
+        self.assertEqual(cache.get(u'll'), ['dir', '/w'])
+
+        # Changed by another session
+        other = get_db_backend(self.dir, 'pycmd', backend)
+        other.put('gs', ['git', 'status', '--short'])
+        self.assertEqual(cache.get(u'gs'), ['git', 'status', '--short'])
+        other.delete('gitcl')
+        self.assertEqual(cache.get(u'gitcl'), None)
+
+    def test_complete(self):
+        """Test completing alias names"""
+        db = get_db_backend(self.dir, 'pycmd', 'logkv')
+        db.put_many([('gitcl', ['git', 'clone']), ('gs', ['git', 'status']), ('ll', ['dir'])])
+        cache = AliasCache(db)
+        self.assertEqual(cache.complete(u'g'), ['gitcl', 'gs'])
+        self.assertEqual(cache.complete(u'GI'), ['gitcl'])
+        self.assertEqual(cache.complete(u''), ['gitcl', 'gs', 'll'])
+        self.assertEqual(cache.complete(u'\xe9'), [])
+        get_db_backend(self.dir, 'pycmd', 'logkv').put('gitk', ['gitk'])
+        self.assertEqual(cache.complete(u'git'), ['gitcl', 'gitk'])
+
+    def test_complete_other_thread(self):
+        """Test that completing on another thread doesn't use the database"""
+        db = get_db_backend(self.dir, 'pycmd', 'sqlite3')
+        db.put('gitcl', ['git', 'clone'])
+        cache = AliasCache(db)
+        results = []
+        complete = lambda: results.append(cache.complete(u'g'))
+        thread = threading.Thread(target = complete)
+        thread.start()
+        thread.join()
+        cache.load()
+        thread = threading.Thread(target = complete)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [[], ['gitcl']])
+
+    def test_pickle(self):
+        """Test caching the aliases of a pickle database"""
+        self.check_backend('pickle')
+
+    def test_logkv(self):
+        """Test caching the aliases of a logkv database"""
+        self.check_backend('logkv')
+
+    def test_sqlite3(self):
+        """Test caching the aliases of an sqlite3 database"""
+        self.check_backend('sqlite3')
+
+
+class TestAliasCommand(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = get_db_backend(self.dir, 'pycmd', 'logkv')
+        self.pycmddb = aliases.pycmddb
+        aliases.pycmddb = lambda: self.db
+
+    def tearDown(self):
+        aliases.pycmddb = self.pycmddb
+        shutil.rmtree(self.dir)
+
+    def run_alias(self, args):
+        """Run the alias command, return what it prints"""
+        (stdout, sys.stdout) = (sys.stdout, StringIO())
+        try:
+            aliases.alias_main(args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_list(self):
+        """Test listing the aliases, sorted"""
+        self.assertEqual(self.run_alias(['-p']), 'No aliases currently defined.\n')
+        self.db.put_many([('ll', [u'dir', u'/w']), ('gs', [u'git', u'status']), ('gitcl', [u'git', u'clone'])])
+        self.assertEqual(self.run_alias(['-p']),
+                         "alias gitcl='[u'git', u'clone']'\n"
+                         "alias gs='[u'git', u'status']'\n"
+                         "alias ll='[u'dir', u'/w']'\n")
+        self.assertEqual(self.run_alias(['-p', 'g*']),
+                         "alias gitcl='[u'git', u'clone']'\n"
+                         "alias gs='[u'git', u'status']'\n")
+        self.assertEqual(self.run_alias(['-p', 'x*']), 'No aliases start with x.\n')
+        self.assertEqual(self.run_alias(['-p', 'gs']), 'Alias: gs = git status\n')
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestAliasCache))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestAliasCommand))
+    return suite
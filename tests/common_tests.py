@@ -2,10 +2,13 @@
 # Unit tests for common.py
 #
 
+import threading
+import common
+from random import Random
 from unittest2 import TestCase, TestSuite, defaultTestLoader, skipUnless
-from common import parse_line, unescape, fuzzy_match
+from common import parse_line, parse_line_incremental, unescape, fuzzy_match
 from common import associated_application, full_executable_path, is_gui_application
-from . import is_win
+from . import is_win, legacy
 
 class TestParseLine(TestCase):
 
@@ -194,11 +197,94 @@ class TestParseLine(TestCase):
             second_parse = parse_line(' '.join(first_parse))
             self.assertEqual(first_parse, second_parse)
 
+    def testMatchesReference(self):
+        """Test that parse_line matches the original FSM-based tokenizer."""
+        for input, expected in self.lines_to_parse:
+            self.assertEqual(parse_line(input), legacy.parse_line(input))
+
+        # Random lines built mostly from the characters the grammar cares about
+        symbols = ' \t"|&<>^0129ab\\'
+        random = Random(0)
+        for i in range(2000):
+            line = ''.join([random.choice(symbols) for j in range(random.randint(0, 16))])
+            for input in [line, unicode(line)]:
+                expected = legacy.parse_line(input)
+                result = parse_line(input)
+                self.assertEqual(result, expected)
+                self.assertEqual([type(t) for t in result], [type(t) for t in expected])
+
     def testUnescape(self):
         """Test that result of unescape equals expected result."""
         for input, expected in self.strings_to_unescape:
             self.assertEqual(unescape(input), expected)
 
+class TestParseLineIncremental(TestCase):
+
+    def testTyping(self):
+        """Test tokenizing a line one character at a time."""
+        for input, expected in TestParseLine.lines_to_parse:
+            state = None
+            for i in range(len(input)):
+                (tokens, state) = parse_line_incremental(state, input[i])
+                self.assertEqual(tokens, legacy.parse_line(input[:i + 1]))
+            self.assertEqual(tokens, expected)
+            self.assertEqual(state.line, input)
+
+    def testResume(self):
+        """Test that tokenizing a continuation of a line gives the same tokens."""
+        for input, expected in TestParseLine.lines_to_parse:
+            for cut in range(len(input) + 1):
+                (_, state) = parse_line_incremental(None, input[:cut])
+                (tokens, _) = parse_line_incremental(state, input[cut:])
+                self.assertEqual(tokens, expected)
+                self.assertEqual(parse_line(input[:cut] + ' '),
+                                 legacy.parse_line(input[:cut] + ' '))
+
+    def testReturnedTokensAreFresh(self):
+        """Test that callers can modify the returned tokens."""
+        tokens = parse_line('dir c:\\')
+        tokens.append('')
+        self.assertEqual(parse_line('dir c:\\'), ['dir', 'c:\\'])
+
+    def testCache(self):
+        """Test resuming from the cached state of a prefix of the line."""
+        line = u'git commit -m "cached prefix'
+        parse_line_incremental(None, line)
+        self.assertFalse(line in common._tokenizer_cache)
+        parse_line(line)
+        self.assertTrue(line in common._tokenizer_cache)
+        resumed = []
+        incremental = common.parse_line_incremental
+        common.parse_line_incremental = lambda state, suffix: (resumed.append((state, suffix)),
+                                                               incremental(state, suffix))[1]
+        try:
+            self.assertEqual(parse_line(line + u' too"'), [u'git', u'commit', u'-m', u'"cached prefix too"'])
+            self.assertEqual(resumed[-1][1], u' too"')
+            self.assertEqual(parse_line(line + u'x' * 20), [u'git', u'commit', u'-m', u'"cached prefix' + u'x' * 20])
+            self.assertEqual(resumed[-1][0], None)
+        finally:
+            common.parse_line_incremental = incremental
+
+    def testThreads(self):
+        """Test tokenizing lines on several threads at once (as completions do)."""
+        lines = [input for input, expected in TestParseLine.lines_to_parse]
+        errors = []
+        def parse():
+            try:
+                for i in range(50):
+                    for input in lines:
+                        if parse_line(input) != legacy.parse_line(input):
+                            errors.append(input)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = parse) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
 class TestFuzzyMatch(TestCase):
     match_tests = [
         ('first', 'this first line will match first', [(5, 10)]),
@@ -270,6 +356,7 @@ class TestAppIdentification(TestCase):
 def suite():
     suite = TestSuite()
     suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestParseLine))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestParseLineIncremental))
     suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestFuzzyMatch))
     if is_win:
         suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestAppIdentification))
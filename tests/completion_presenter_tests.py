@@ -0,0 +1,81 @@
+#
+# Unit tests for CompletionPresenter.py
+#
+
+from unittest import TestCase, TestSuite, defaultTestLoader
+from CompletionPresenter import CompletionPresenter, prefix_highlighter, wildcard_highlighter, fuzzy_highlighter
+from completion import wildcard_to_regex
+
+class TestCompletionPresenter(TestCase):
+    def test_layout(self):
+        """Test the columns, filled top to bottom then left to right"""
+        suggestions = ['a%d' % i for i in range(10)]
+        presenter = CompletionPresenter(suggestions, prefix_highlighter(1), 40, 20)
+        self.assertEqual((presenter.column_width, presenter.num_columns, presenter.num_lines), (12, 3, 4))
+        lines = list(presenter.lines())
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0].split(), ['a0', 'a4', 'a8'])
+        self.assertEqual(lines[3].split(), ['a3', 'a7'])
+        self.assertEqual(len(lines[0]), 36)
+
+        # Few suggestions get a single column
+        presenter = CompletionPresenter(suggestions[:3], prefix_highlighter(1), 40, 20)
+        self.assertEqual([line.split() for line in presenter.lines()], [['a0'], ['a1'], ['a2']])
+
+        # Columns wider than the buffer
+        presenter = CompletionPresenter(['x' * 50] * 10, prefix_highlighter(1), 40, 20)
+        self.assertEqual((presenter.column_width, presenter.num_columns, presenter.num_lines), (39, 1, 10))
+
+    def test_sample(self):
+        """Test that the columns are sized over a bounded sample"""
+        suggestions = ['file%d' % i for i in range(100000)]
+        presenter = CompletionPresenter(suggestions, prefix_highlighter(4), 80, 25)
+        self.assertTrue(len(presenter.sample()) <= 2 * CompletionPresenter.sample_size)
+        self.assertEqual(presenter.column_width, len('file99999') + CompletionPresenter.column_spacing)
+
+    def test_colors(self):
+        """Test the highlighting of the suggestions"""
+        presenter = CompletionPresenter(['abc', 'abd'], prefix_highlighter(2), 40, 20, ('<d>', '<m>'))
+        self.assertEqual(list(presenter.lines())[0], '<d><m>ab<d>c<d>' + ' ' * 10)
+        highlight = wildcard_highlighter(wildcard_to_regex('a?c*'))
+        self.assertEqual(highlight('abcde'), [('a', 'b'), ('c', 'de')])
+        self.assertEqual(highlight('xyz'), [('', 'xyz')])
+        highlight = wildcard_highlighter(wildcard_to_regex('ab*'))
+        self.assertEqual(highlight('ABCD'), [('AB', 'CD')])
+        highlight = fuzzy_highlighter(u'RdMe')
+        self.assertEqual(highlight(u'README.txt'), [(u'', u''), (u'R', u'EA'), (u'DME', u'.txt')])
+        self.assertEqual(highlight(u'ReportDaemon.exe'), [(u'', u''), (u'R', u'eport'), (u'D', u'ae'), (u'm', u'on.'), (u'e', u'xe')])
+        self.assertEqual(highlight(u'setup.py'), [(u'', u'setup.py')])
+
+    def test_pages(self):
+        """Test rendering screen by screen, and stopping midway"""
+        highlighted = []
+        def highlight(s):
+            highlighted.append(s)
+            return [('', s)]
+        suggestions = ['s%d' % i for i in range(100)]
+        presenter = CompletionPresenter(suggestions, highlight, 10, 11)
+        self.assertEqual((presenter.num_columns, presenter.num_lines), (1, 100))
+
+        output = []
+        asked = []
+        def more(screens_left):
+            asked.append(screens_left)
+            return len(asked) < 3
+        self.assertEqual(presenter.show(output.append, more), 30)
+        self.assertEqual(asked, [9, 8, 7])
+        self.assertEqual([line.strip() for line in output], suggestions[:30])
+
+        # Only the lines shown were rendered
+        self.assertEqual(highlighted, suggestions[:30])
+
+        # A screenful is shown without asking
+        output = []
+        presenter = CompletionPresenter(suggestions[:10], highlight, 10, 11)
+        self.assertEqual(presenter.show(output.append, lambda screens_left: self.fail('asked')), 10)
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCompletionPresenter))
+    return suite
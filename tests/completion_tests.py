@@ -3,7 +3,10 @@
 #
 
 from unittest import TestCase, TestSuite, defaultTestLoader
-from completion import wildcard_to_regex, find_common_prefix
+import os, random, shutil, tempfile, time
+import completion
+from tests import legacy
+from completion import wildcard_to_regex, find_common_prefix, list_completions
 
 class TestWildcardMatching(TestCase):
     matches = [
@@ -24,6 +27,15 @@ class TestWildcardMatching(TestCase):
         ('a++b', 'a+*', ('+b',)),
         ('c^ab', '*^*b', ('c', 'a')),
         ('c$ab', '*$*b', ('c', 'a')),
+        ('ABC.txt', 'ab*', ('C.txt',)),
+        ('abc', '*', ('abc',)),
+        ('ab', 'abc*', None),
+        ('a|b', 'a|*', ('b',)),
+        ('ab', 'a|*', None),
+        ('a{2}', 'a{2}*', ('',)),
+        ('aa', 'a{2}*', None),
+        ('a|bc', 'a|?c', ('b',)),
+        ('b', 'a|?', None),
         ]
 
     def test_wildcard_matching(self):
@@ -35,6 +47,22 @@ class TestWildcardMatching(TestCase):
             else:
                 self.assertEqual(None, groups)
 
+    def test_prefix_match(self):
+        """Test the match of a "prefix*" pattern, as used to color it"""
+        match = wildcard_to_regex('Re*').match('README.txt')
+        self.assertEqual(match.lastindex, 1)
+        self.assertEqual((match.start(1), match.end(1)), (2, 10))
+        self.assertEqual(match.group(match.lastindex), 'ADME.txt')
+        self.assertEqual(match.group(0), 'README.txt')
+
+    def test_matcher_cache(self):
+        """Test that the matchers of the recent patterns are kept, up to a limit"""
+        self.assertTrue(wildcard_to_regex('a?c*') is wildcard_to_regex('a?c*'))
+        for i in range(completion._matcher_cache_size + 10):
+            wildcard_to_regex('file%d*' % i)
+        self.assertEqual(len(completion._matcher_cache), completion._matcher_cache_size)
+        self.assertFalse('a?c*' in completion._matcher_cache)
+
 
 class TestFindCommonPrefix(TestCase):
     results = [
@@ -50,9 +78,58 @@ class TestFindCommonPrefix(TestCase):
         for original, completions, result in self.results:
             self.assertEqual(find_common_prefix(original, completions), result)
 
+    def test_same_as_original(self):
+        """Test against the original implementation, on random strings"""
+        rand = random.Random(20)
+        for i in range(3000):
+            alphabet = rand.choice(['aA', 'abAB', 'aAb.', u'a\xe9\xc9B'])
+            word = lambda: ''.join([rand.choice(alphabet) for j in range(rand.randint(0, 6))])
+            completions = [word() for j in range(rand.randint(1, 6))]
+            if rand.random() < 0.5:
+                # Make them share a (case-insensitive) start
+                start = word()
+                completions = [rand.choice([start, start.upper(), start.lower()]) + c for c in completions]
+            original = rand.choice([word(), completions[0][:rand.randint(0, 4)]])
+            self.assertEqual(find_common_prefix(original, completions),
+                             legacy.find_common_prefix(original, completions),
+                             (original, completions))
+
+    def test_cache(self):
+        """Test that the common prefix of recent completion sets is kept"""
+        completions = ['Program', 'program2']
+        self.assertEqual(find_common_prefix('prog', completions), 'program')
+        self.assertEqual(completion._common_prefix_cache[('prog', tuple(completions))], 'program')
+        completions.append('PROGRAMS')
+        self.assertEqual(find_common_prefix('prog', completions), 'program')
+        self.assertEqual(find_common_prefix('Prog', completions), 'Program')
+        for i in range(completion._common_prefix_cache_size):
+            find_common_prefix('x', ['x%d' % i])
+        self.assertEqual(len(completion._common_prefix_cache), completion._common_prefix_cache_size)
+
+
+class TestListCompletions(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'Src'))
+        for name in ['setup.py', 'SETUP.cfg', 'README']:
+            open(os.path.join(self.dir, name), 'w').close()
+        mtime = time.time() - 60
+        os.utime(self.dir, (mtime, mtime))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_list_completions(self):
+        """Test listing the matching directories, then files"""
+        self.assertEqual(sorted(list_completions(self.dir, wildcard_to_regex('s*'))[1:]), ['SETUP.cfg', 'setup.py'])
+        self.assertEqual(list_completions(self.dir, wildcard_to_regex('s*'))[0], 'Src\\')
+        self.assertEqual(list_completions(self.dir, wildcard_to_regex('*.?y*')), ['setup.py'])
+        self.assertEqual(list_completions(self.dir, wildcard_to_regex('x*')), [])
+
 
 def suite():
     suite = TestSuite()
     suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestWildcardMatching))
     suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestFindCommonPrefix))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestListCompletions))
     return suite
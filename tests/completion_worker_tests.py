@@ -0,0 +1,137 @@
+#
+# Unit tests for CompletionWorker.py
+#
+
+import threading
+from unittest import TestCase, TestSuite, defaultTestLoader
+import completion
+from completion import complete_line
+from CompletionWorker import CompletionWorker
+from DirCache import Candidate
+
+class SlowDirCache:
+    """Stand-in for the listings of an unresponsive network share"""
+    def __init__(self, names):
+        self.names = names
+        self.listed = []
+        self.release = threading.Event()
+
+    def listing(self, dir):
+        self.listed.append(dir)
+        self.release.wait(5)
+        return [Candidate(name, False, True) for name in self.names]
+
+
+class TestCompletionWorker(TestCase):
+    def setUp(self):
+        self.dir_cache = completion.dir_cache
+        completion.dir_cache = SlowDirCache(['report.txt', 'readme.txt'])
+        self.notified = []
+        self.ready = threading.Event()
+        self.worker = CompletionWorker(notify = self.notify)
+
+    def tearDown(self):
+        completion.dir_cache.release.set()
+        completion.dir_cache = self.dir_cache
+
+    def notify(self, request):
+        # The worker holds its lock, so that cancel() can't slip in between
+        # its check of the request and the notification
+        self.assertTrue(self.worker.lock.locked())
+        self.notified.append(request.line)
+        self.ready.set()
+
+    def test_fast_completion(self):
+        """Test a completion done within the budget"""
+        completion.dir_cache.release.set()
+        line = 'type \\\\server\\share\\rep'
+        request = self.worker.submit(line, complete_line)
+        self.assertTrue(request.wait(5))
+        self.assertEqual(self.worker.result(line), ('type \\\\server\\share\\report.txt ', ['report.txt']))
+
+        # Nobody needs waking up, and the result is only used once
+        self.assertFalse(self.ready.wait(0.1))
+        self.assertEqual(self.worker.result(line), None)
+
+    def test_slow_completion(self):
+        """Test a completion finishing after the budget"""
+        line = 'type \\\\server\\share\\re'
+        request = self.worker.submit(line, complete_line)
+        self.assertFalse(request.wait(0.05))
+        self.assertEqual(self.worker.result(line), None)
+
+        completion.dir_cache.release.set()
+        self.assertTrue(self.ready.wait(5))
+        self.assertEqual(self.notified, [line])
+        self.assertEqual(self.worker.result(line), ('type \\\\server\\share\\re', ['report.txt', 'readme.txt']))
+
+    def test_stale_completion(self):
+        """Test that the results for an edited line are dropped"""
+        line = 'type \\\\server\\share\\re'
+        self.assertFalse(self.worker.submit(line, complete_line).wait(0.05))
+        completion.dir_cache.release.set()
+        self.assertTrue(self.ready.wait(5))
+        self.assertEqual(self.worker.result(line + 'p'), None)
+        self.assertEqual(self.worker.result(line), None)
+
+    def test_cancel(self):
+        """Test that a key press or a newer completion cancels the pending one"""
+        line = 'type \\\\server\\share\\re'
+        old = self.worker.submit(line, complete_line)
+        self.assertFalse(old.wait(0.05))
+
+        # The first thread is stuck, another one takes the new request
+        new = self.worker.submit(line + 'p', complete_line)
+        self.assertFalse(new.wait(0.05))
+        self.assertEqual(len(self.worker.threads), 2)
+        self.assertTrue(old.cancelled)
+
+        self.worker.cancel()
+        completion.dir_cache.release.set()
+        self.assertTrue(old.done.wait(5) and new.done.wait(5))
+        self.assertEqual(self.worker.result(line + 'p'), None)
+        self.assertFalse(self.ready.wait(0.1))
+
+        # A cancelled request that hasn't started yet isn't run
+        self.worker.cancel()
+        completion.dir_cache = SlowDirCache([])
+        for i in range(CompletionWorker.max_threads):
+            self.worker.submit('type %d' % i, complete_line)
+        skipped = self.worker.submit('type x', complete_line)
+        skipped.cancel()
+        completion.dir_cache.release.set()
+        self.assertTrue(skipped.wait(5))
+        self.assertTrue(len(completion.dir_cache.listed) <= CompletionWorker.max_threads)
+        self.assertEqual(skipped.result, None)
+
+    def test_error(self):
+        """Test that an error while completing reaches the input thread"""
+        def fail(line):
+            raise OSError('unreachable')
+        request = self.worker.submit('type x', fail)
+        self.assertTrue(request.wait(5))
+        self.assertRaises(OSError, self.worker.result, 'type x')
+
+
+class TestCompleteLine(TestCase):
+    def test_dispatch(self):
+        """Test that the last token picks the kind of completion"""
+        calls = []
+        saved = (completion.complete_env_var, completion.complete_wildcard, completion.complete_file)
+        completion.complete_env_var = lambda line: calls.append('env_var')
+        completion.complete_wildcard = lambda line: calls.append('wildcard')
+        completion.complete_file = lambda line, mode = 'bash': calls.append(mode)
+        try:
+            for line in ['echo %PA', 'dir *.py', 'type read', 'type ', '', 'echo %PATH% x']:
+                complete_line(line)
+            complete_line('type rdme', 'fuzzy')
+        finally:
+            (completion.complete_env_var, completion.complete_wildcard, completion.complete_file) = saved
+        self.assertEqual(calls, ['env_var', 'wildcard', 'bash', 'bash', 'bash', 'bash', 'fuzzy'])
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCompletionWorker))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCompleteLine))
+    return suite
@@ -0,0 +1,149 @@
+#
+# Unit tests for DirCache.py
+#
+
+import os, shutil, tempfile, time
+from unittest import TestCase, TestSuite, defaultTestLoader
+from DirCache import DirCache, Candidate, list_dir
+
+class TestDirCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'src'))
+        open(os.path.join(self.dir, 'setup.py'), 'w').close()
+        self.age(self.dir)
+        self.cache = DirCache()
+        self.listed = []
+        list_dir = self.cache._list
+        self.cache._list = lambda dir: self.listed.append(dir) or list_dir(dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def age(self, dir, seconds=60):
+        """Move the modification time of a directory back"""
+        mtime = time.time() - seconds
+        os.utime(dir, (mtime, mtime))
+
+    def test_listing(self):
+        """Test listing a directory, with the type of the entries"""
+        self.assertEqual(sorted([(c.name, c.is_dir, c.is_file) for c in self.cache.listing(self.dir)]),
+                         [('setup.py', False, True), ('src', True, False)])
+        self.assertEqual(self.cache.listing(os.path.join(self.dir, 'missing')), [])
+        self.assertEqual(self.cache.listing(os.path.join(self.dir, 'setup.py')), [])
+
+    def test_invalidation(self):
+        """Test that a directory is listed again only when it changed"""
+        self.cache.listing(self.dir)
+        self.cache.listing(self.dir + os.sep)
+        self.assertEqual(self.listed, [self.dir])
+
+        open(os.path.join(self.dir, 'README'), 'w').close()
+        self.age(self.dir, 30)
+        self.assertEqual(len(self.cache.listing(self.dir)), 3)
+        self.assertEqual(len(self.listed), 2)
+
+        # A directory that just changed is listed on every call, until its
+        # modification time is old enough to be trusted
+        os.remove(os.path.join(self.dir, 'README'))
+        self.cache.listing(self.dir)
+        self.cache.listing(self.dir)
+        self.assertEqual(len(self.listed), 4)
+        self.age(self.dir)
+        self.cache.listing(self.dir)
+        self.cache.listing(self.dir)
+        self.assertEqual(len(self.listed), 5)
+
+        shutil.rmtree(os.path.join(self.dir, 'src'))
+        os.mkdir(os.path.join(self.dir, 'src'))
+        self.assertEqual(self.cache.listing(os.path.join(self.dir, 'src')), [])
+
+    def test_prefetch(self):
+        """Test listing directories in the background"""
+        src = os.path.join(self.dir, 'src')
+        self.age(src)
+        self.cache.listing(src)
+        self.cache.prefetch(self.dir)
+        deadline = time.time() + 5
+        while len(self.cache.listings) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.cache.listings), sorted([self.cache._key(self.dir), self.cache._key(src)]))
+        self.assertEqual(len(self.listed), 2)
+        self.cache.listing(self.dir)
+        self.assertEqual(len(self.listed), 2)
+
+    def test_recent(self):
+        """Test that only the directories completed lately are refreshed"""
+        for i in range(DirCache.max_recent + 5):
+            self.cache.listing(os.path.join(self.dir, 'dir%d' % i))
+        self.cache.listing(os.path.join(self.dir, 'dir2'))
+        self.assertEqual(len(self.cache.recent), DirCache.max_recent)
+        self.assertEqual(self.cache.recent.keys()[-1], self.cache._key(os.path.join(self.dir, 'dir2')))
+        self.assertFalse(self.cache._key(os.path.join(self.dir, 'dir0')) in self.cache.recent)
+
+    def test_max_listings(self):
+        """Test that only the listings used lately are kept"""
+        dirs = [os.path.join(self.dir, 'dir%d' % i) for i in range(DirCache.max_listings + 5)]
+        for dir in dirs:
+            os.mkdir(dir)
+            self.age(dir)
+            self.cache.listing(dir)
+        self.cache.listing(dirs[5])
+        self.assertEqual(len(self.cache.listings), DirCache.max_listings)
+        self.assertEqual(self.cache.listings.keys()[-1], self.cache._key(dirs[5]))
+        self.assertFalse(self.cache._key(dirs[0]) in self.cache.listings)
+        self.assertEqual(len(self.listed), len(dirs))
+
+    def test_prefetch_error(self):
+        """Test that the background thread outlives a failed listing"""
+        list_dir = self.cache._list
+        def failing_list(dir):
+            if dir == self.cache._key(self.dir):
+                raise UnicodeDecodeError('ascii', '\xff', 0, 1, 'ordinal not in range(128)')
+            return list_dir(dir)
+        self.cache._list = failing_list
+        self.cache.prefetch(self.dir)
+        src = os.path.join(self.dir, 'src')
+        self.age(src)
+        self.cache.prefetch(src)
+        deadline = time.time() + 5
+        while not self.cache.listings and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.cache.listings.keys(), [self.cache._key(src)])
+
+
+class TestCandidate(TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ.setdefault('PATHEXT', '.COM;.EXE;.BAT;.CMD')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir)
+
+    def test_candidate(self):
+        """Test the attributes computed once per entry"""
+        candidate = Candidate('Make.EXE', False, True)
+        self.assertEqual((candidate.key, candidate.is_dir, candidate.is_exec), ('make.exe', False, True))
+        self.assertFalse(Candidate('make.exe', True, False).is_exec)
+        self.assertFalse(Candidate('README', False, True).is_exec)
+        self.assertFalse(Candidate('setup.py', False, True).is_exec)
+        self.assertFalse(Candidate('.exe.txt', False, True).is_exec)
+
+    def test_list_dir(self):
+        """Test listing a directory as candidates"""
+        os.mkdir(os.path.join(self.dir, 'Tools'))
+        open(os.path.join(self.dir, 'run.bat'), 'w').close()
+        candidates = sorted(list_dir(self.dir), key = lambda c: c.key)
+        self.assertEqual([(c.name, c.key, c.is_dir, c.is_file, c.is_exec) for c in candidates],
+                         [('run.bat', 'run.bat', False, True, True), ('Tools', 'tools', True, False, False)])
+        self.assertEqual(list_dir(os.path.join(self.dir, 'missing')), [])
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestDirCache))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCandidate))
+    return suite
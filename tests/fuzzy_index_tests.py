@@ -0,0 +1,133 @@
+#
+# Unit tests for FuzzyIndex.py
+#
+
+from unittest import TestCase, TestSuite, defaultTestLoader
+import completion
+from completion import complete_file
+from common import abbrev_string, word_starts
+from DirCache import Candidate
+from FuzzyIndex import FuzzyIndex, fuzzy_score, fuzzy_positions, name_word_starts
+
+class FakeDirCache:
+    """Stand-in for the listings of the directories"""
+    def __init__(self, names):
+        self.candidates = [Candidate(name.rstrip('\\'), name.endswith('\\'), not name.endswith('\\'))
+                           for name in names]
+
+    def listing(self, dir):
+        return self.candidates
+
+
+class TestFuzzyScore(TestCase):
+    def test_word_starts(self):
+        """Test finding the starts of the words of a name"""
+        self.assertEqual(word_starts('PyCmd'), [0, 2])
+        self.assertEqual(word_starts('my_long file.txt'), [0, 2, 3, 8, 12, 13])
+        self.assertEqual(word_starts('README'), [0])
+        self.assertEqual(abbrev_string('my_long file.txt'), 'm_lf.t')
+
+        # For ranking file names, runs of capitals are single words and the
+        # extension has none
+        self.assertEqual(name_word_starts('README.txt'), [0])
+        self.assertEqual(name_word_starts('XMLParser.py'), [0, 3])
+        self.assertEqual(name_word_starts('PyCmdDB.py'), [0, 2, 5])
+        self.assertEqual(name_word_starts('my_long file.txt'), [0, 2, 3, 8])
+        self.assertEqual(name_word_starts('.gitignore'), [0, 1])
+
+    def test_score(self):
+        """Test that matches on word starts and runs of characters rank first"""
+        self.assertEqual(fuzzy_score(u'rdme', u'setup.py'), None)
+        self.assertEqual(fuzzy_score(u'ab', u'ba'), None)
+        self.assertTrue(fuzzy_score(u'pc', u'PyCmd.py') > fuzzy_score(u'pc', u'pycmd.py'))
+        self.assertTrue(fuzzy_score(u'cmd', u'PyCmd.py') > fuzzy_score(u'cmd', u'cramped.py'))
+        self.assertTrue(fuzzy_score(u'rep', u'report.txt') > fuzzy_score(u'rep', u'prepare.txt'))
+        self.assertTrue(fuzzy_score(u'ft', u'file_test.py') > fuzzy_score(u'ft', u'fruit.py'))
+
+        # Capitals (CamelCase) rank above the extension and the letters of an
+        # all-capitals name
+        self.assertTrue(fuzzy_score(u'cp', u'CompletionPresenter.py') > fuzzy_score(u'cp', u'CommandHistory.py'))
+        self.assertTrue(fuzzy_score(u'rm', u'ReadMe.txt') > fuzzy_score(u'rm', u'random.md'))
+        self.assertTrue(fuzzy_score(u'xp', u'XMLParser.py') > fuzzy_score(u'xp', u'XML.py'))
+        self.assertTrue(fuzzy_score(u'rm', u'ReadMe.txt') > fuzzy_score(u'rm', u'README.txt'))
+
+        # A later word start is preferred, as long as the rest still matches
+        self.assertEqual(fuzzy_score(u'st', u'sat_test'), fuzzy_score(u'st', u'x_sat_test') + 4)
+        self.assertTrue(fuzzy_score(u'ts', u'a_test_s') > 0)
+
+    def test_positions(self):
+        """Test finding the characters that a query matches"""
+        self.assertEqual(fuzzy_positions(u'rdme', u'README.txt'), [0, 3, 4, 5])
+        self.assertEqual(fuzzy_positions(u'cp', u'CompletionPresenter.py'), [0, 10])
+        self.assertEqual(fuzzy_positions(u'xyz', u'README.txt'), None)
+
+
+class TestFuzzyIndex(TestCase):
+    names = [u'README.txt', u'readme_old.md', u'ReportDaemon.exe', u'setup.py', u'PyCmd.py',
+             u'pycmd_public.py', u'Program Files', u'r\xe9dm\xe9.txt']
+
+    def search(self, index, query):
+        return [candidate.name for candidate in index.search(query)]
+
+    def test_search(self):
+        """Test finding and ranking the names that hold the query"""
+        index = FuzzyIndex([Candidate(name, False, True) for name in self.names])
+        self.assertEqual(self.search(index, u'rdme'), [u'README.txt', u'readme_old.md', u'ReportDaemon.exe'])
+        self.assertEqual(self.search(index, u'PC')[:2], [u'PyCmd.py', u'pycmd_public.py'])
+        self.assertEqual(self.search(index, u'pf'), [u'Program Files'])
+        self.assertEqual(self.search(index, u'xyz'), [])
+        self.assertEqual(self.search(index, u''), [])
+        self.assertEqual(self.search(index, u'r\xe9d'), [u'r\xe9dm\xe9.txt'])
+        self.assertEqual(self.search(index, 'rm.t'), [u'r\xe9dm\xe9.txt', u'README.txt'])
+
+        # Special characters are matched literally
+        self.assertEqual(self.search(index, u'.*'), [])
+        self.assertEqual(self.search(index, u'p]'), [])
+
+    def test_ranking(self):
+        """Test that CamelCase abbreviations outrank matches in the extension"""
+        index = FuzzyIndex([Candidate(name, False, True) for name in
+                            [u'CommandHistory.py', u'CompletionPresenter.py', u'random.md', u'ReadMe.txt']])
+        self.assertEqual(self.search(index, u'cp'), [u'CompletionPresenter.py', u'CommandHistory.py'])
+        self.assertEqual(self.search(index, u'rm'), [u'ReadMe.txt', u'random.md'])
+
+    def test_max_scored(self):
+        """Test that only the closest matches are scored, the rest follow"""
+        index = FuzzyIndex([Candidate(name, False, True) for name in [u'xxxxa_b', u'ab', u'xab']])
+        self.assertEqual(self.search(index, u'ab'), [u'ab', u'xxxxa_b', u'xab'])
+        index.max_scored = 2
+        self.assertEqual(self.search(index, u'ab'), [u'ab', u'xab', u'xxxxa_b'])
+
+
+class TestFuzzyCompletion(TestCase):
+    def setUp(self):
+        self.dir_cache = completion.dir_cache
+        completion.dir_cache = FakeDirCache([u'README.txt', u'ReportDaemon.exe', u'Program Files\\',
+                                             u'src\\', u'setup.py'])
+
+    def tearDown(self):
+        completion.dir_cache = self.dir_cache
+
+    def test_complete(self):
+        """Test the 'fuzzy' completion mode"""
+        # Names starting with the token are still preferred
+        self.assertEqual(complete_file(u'type se', 'fuzzy'), (u'type setup.py ', [u'setup.py']))
+
+        self.assertEqual(complete_file(u'type rdme', 'fuzzy'), (u'type rdme', [u'README.txt', u'ReportDaemon.exe']))
+        self.assertEqual(complete_file(u'type rdmet', 'fuzzy'), (u'type README.txt ', [u'README.txt']))
+        self.assertEqual(complete_file(u'dir c:\\prg', 'fuzzy'), (u'dir "c:\\Program Files"\\', [u'Program Files\\']))
+        self.assertEqual(complete_file(u'type xyz', 'fuzzy'), (u'type xyz', []))
+
+        # The query is kept, for highlighting the matches
+        self.assertEqual(complete_file(u'type c:\\rdme', 'fuzzy')[1].query, u'rdme')
+
+        # Only in the 'fuzzy' mode
+        self.assertEqual(complete_file(u'type rdme'), (u'type rdme', []))
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestFuzzyScore))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestFuzzyIndex))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestFuzzyCompletion))
+    return suite
@@ -0,0 +1,292 @@
+#
+# Unit tests for HistoryStore.py
+#
+
+import os, shutil, tempfile, threading
+from multiprocessing import Process
+from random import Random
+from unittest import TestCase, TestSuite, defaultTestLoader
+from HistoryStore import HistoryStore
+from CommandHistory import CommandHistory
+from . import legacy
+
+def append_lines(filename, writer, count, length):
+    """Save commands to the history, as a PyCmd session would"""
+    store = HistoryStore(filename)
+    for i in range(count):
+        store.append([u'echo %d %d' % (writer, i), u'dir', u'cd ..'], length)
+
+
+class TestHistoryStore(TestCase):
+    words = [u'git', u'checkout', u'master', u'commit', u'-m', u'cd', u'..',
+             u'c:\\Program Files', u'dir', u'/s', u'*.py', u'python', u'make',
+             u'GIT', u'\xe9t\xe9', u'|', u'more', u'run_tests.py', u'"a b"']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'history')
+        self.rand = Random(5)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def random_line(self):
+        return u' '.join([self.rand.choice(self.words)
+                          for i in range(self.rand.randint(1, 4))])
+
+    def random_lines(self, count):
+        lines = []
+        for i in range(count):
+            line = self.random_line()
+            if not line in lines:
+                lines.append(line)
+        return lines
+
+    def read(self, filename):
+        f = open(filename, 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+    def distinct(self, records, count):
+        """The most recent distinct records, oldest first"""
+        lines = []
+        for line in reversed(records):
+            if len(lines) < count and not line in lines:
+                lines.append(line)
+        return lines[::-1]
+
+    def test_journal(self):
+        """Test that sessions appending to the history are merged"""
+        sessions = [HistoryStore(self.filename), HistoryStore(self.filename)]
+        records = []
+        for i in range(50):
+            lines = self.random_lines(self.rand.randint(0, 3))
+            self.rand.choice(sessions).append(lines, 1000)
+            records += lines
+            self.assertEqual(len(sessions[0]), len(records))
+            for session in sessions:
+                self.assertEqual(session.recent(20), self.distinct(records, 20))
+            self.assertEqual(sessions[1].search(['git']),
+                             [line for line in self.distinct(records, 1000)[::-1]
+                              if 'git' in line.lower()])
+
+        # Compacting drops the duplicates and the lines over the limit
+        sessions[0].compact(15)
+        self.assertEqual(len(sessions[1]), 15)
+        self.assertEqual(sessions[1].recent(1000), self.distinct(records, 15))
+        self.assertEqual(self.read(self.filename),
+                         ''.join([line.encode('utf8') + '\n' for line in self.distinct(records, 15)]))
+
+    def test_automatic_compaction(self):
+        """Test that the journal is compacted when it grows too large"""
+        store = HistoryStore(self.filename)
+        records = []
+        for i in range(100):
+            line = self.random_line()
+            store.append([line], 10)
+            records.append(line)
+            self.assertTrue(len(store) <= 21)
+            self.assertEqual(store.recent(10), self.distinct(records, 10))
+
+    def test_unfinished_line_kept(self):
+        """Test that compacting keeps a line that is still being written"""
+        store = HistoryStore(self.filename)
+        store.append([u'dir', u'cd ..', u'dir', u'make'], 100)
+        f = open(self.filename, 'ab')
+        f.write('git st')
+        f.close()
+        store.compact(100)
+        self.assertEqual(self.read(self.filename), 'cd ..\ndir\nmake\ngit st')
+        f = open(self.filename, 'ab')
+        f.write('atus\n')
+        f.close()
+        self.assertEqual(store.recent(10), [u'cd ..', u'dir', u'make', u'git status'])
+
+    def test_tail(self):
+        """Test reading the lines appended by other sessions"""
+        (store, other) = (HistoryStore(self.filename), HistoryStore(self.filename))
+        store.append([u'dir'], 100)
+        self.assertEqual(other.tail(), None)
+        other.recent(10)
+        self.assertEqual(other.tail(), [])
+        store.append([u'cd ..', u'dir'], 100)
+        self.assertEqual(other.tail(), [u'cd ..', u'dir'])
+        self.assertEqual(other.tail(), [])
+
+        f = open(self.filename, 'ab')
+        f.write('git st')
+        f.close()
+        self.assertEqual(other.tail(), [])
+        f = open(self.filename, 'ab')
+        f.write('atus\n\xc3\xa9t\xc3\xa9\n')
+        f.close()
+        self.assertEqual(other.tail(), [u'git status', u'\xe9t\xe9'])
+
+        # The file has been compacted in the meantime
+        store.compact(100)
+        self.assertEqual(other.tail(), None)
+        self.assertEqual(other.recent(10), [u'cd ..', u'dir', u'git status', u'\xe9t\xe9'])
+        self.assertEqual(other.tail(), [])
+
+    def test_concurrent_writers(self):
+        """Test that no commands are lost when several sessions save them"""
+        (writers, count) = (4, 150)
+        length = writers * count + 2    # Compacted along the way, but nothing dropped
+        processes = [Process(target = append_lines, args = (self.filename, i, count, length))
+                     for i in range(writers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        lines = HistoryStore(self.filename).recent(10000)
+        self.assertEqual(len(lines), writers * count + 2)
+        for i in range(writers):
+            self.assertEqual([line for line in lines if line.startswith(u'echo %d ' % i)],
+                             [u'echo %d %d' % (i, j) for j in range(count)])
+
+    def test_missing_file(self):
+        """Test reading a history file that doesn't exist (yet)"""
+        store = HistoryStore(self.filename)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.recent(10), [])
+        self.assertEqual(store.search(['git']), [])
+
+    def test_recent(self):
+        """Test reading the most recent lines"""
+        f = open(self.filename, 'wb')
+        f.write('dir\r\ngit status\ncd ..\ngit status\n\xc3\xa9t\xc3\xa9\n')
+        f.close()
+        store = HistoryStore(self.filename)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.recent(2), [u'git status', u'\xe9t\xe9'])
+        self.assertEqual(store.recent(10), [u'dir', u'cd ..', u'git status', u'\xe9t\xe9'])
+
+    def test_search(self):
+        """Test looking up lines in the history file"""
+        lines = [u'git checkout master', u'dir /s', u'GIT commit', u'\xe9t\xe9 git']
+        store = HistoryStore(self.filename)
+        store.append(lines, 100)
+        self.assertEqual(store.search(['git']), [lines[3], lines[2], lines[0]])
+        self.assertEqual(store.search(['Gi', 'M']), [lines[2], lines[0]])
+        self.assertEqual(store.search(['git'], exclude = set([lines[2]])), [lines[3], lines[0]])
+        self.assertEqual(store.search([]), lines[::-1])
+        self.assertEqual(store.search(['zzz']), [])
+
+    def test_index_update(self):
+        """Test that the index follows changes made by other sessions"""
+        store = HistoryStore(self.filename)
+        store.append([u'dir', u'cd ..'], 100)
+
+        # Lines appended at the end are indexed incrementally
+        store.append([u'git status'], 100)
+        f = open(self.filename, 'ab')
+        f.write('make\n')
+        f.close()
+        self.assertEqual(store.recent(10), [u'dir', u'cd ..', u'git status', u'make'])
+        self.assertEqual(os.path.getsize(self.filename + '.idx'), 8 + 4 + 4 + 4 * 4)
+
+        # A rewritten file is indexed from scratch, even if the size matches
+        f = open(self.filename, 'wb')
+        f.write('dor\ncd ..\ngit status\nmaki\nls\n')
+        f.close()
+        self.assertEqual(store.recent(10), [u'dor', u'cd ..', u'git status', u'maki', u'ls'])
+        f = open(self.filename, 'wb')
+        f.write('ls\n')
+        f.close()
+        self.assertEqual(store.recent(10), [u'ls'])
+
+        # An incomplete last line is ignored until it's finished
+        f = open(self.filename, 'ab')
+        f.write('git push')
+        f.close()
+        self.assertEqual(store.recent(10), [u'ls'])
+        f = open(self.filename, 'ab')
+        f.write(' origin\n')
+        f.close()
+        self.assertEqual(store.recent(10), [u'ls', u'git push origin'])
+
+        # A damaged index is rebuilt
+        f = open(self.filename + '.idx', 'wb')
+        f.write('garbage')
+        f.close()
+        self.assertEqual(store.recent(10), [u'ls', u'git push origin'])
+
+    def test_history_search(self):
+        """Test searching a history that is only partly loaded in memory"""
+        lines = self.random_lines(300)
+        store = HistoryStore(self.filename)
+        store.append(lines, 1000)
+        history = CommandHistory()
+        history.max_loaded = 50
+        history.load(store)
+        self.assertEqual(history.list, lines[-50:])
+        for filter in ['', 'g', 'git', 'g c m', 'c:\\pro', 'py c', u'\xe9', '| m', 'zzz']:
+            expected = legacy.filter_history(lines, filter)
+            history.lazy = False
+            history.start(filter)
+            self.assertEqual(history.filtered_list, expected)
+            history.lazy = True
+            history.start(filter)
+            for i in range(len(expected) + 1):
+                history.up()
+            self.assertEqual(history.trail[1:], expected[::-1])
+            history.reset()
+
+        # Saving appends the new lines to the file
+        history.add(lines[0])
+        history.add(u'git push')
+        history.save(1000)
+        self.assertEqual(len(store), len(lines) + 2)
+        self.assertEqual(store.recent(1000), lines[1:] + [lines[0], u'git push'])
+        history.save(1000)
+        self.assertEqual(len(store), len(lines) + 2)
+
+    def test_history_sync(self):
+        """Test that sessions pick up each other's commands"""
+        (history, other) = (CommandHistory(), CommandHistory())
+        history.load(HistoryStore(self.filename))
+        other.load(HistoryStore(self.filename))
+        for line in [u'git checkout master', u'dir', u'make dist']:
+            history.add(line)
+        history.save(100)
+        other.add(u'cd ..')
+        other.start(u'g c m')
+        other.up()
+        self.assertEqual(other.current()[0], u'git checkout master')
+        self.assertEqual(other.list, [u'cd ..', u'git checkout master', u'dir', u'make dist'])
+
+        # After the file is compacted, it is read again; lines that haven't
+        # been saved yet are kept
+        history.store.compact(2)
+        other.sync()
+        self.assertEqual(other.list, [u'dir', u'make dist', u'cd ..'])
+        other.save(100)
+        history.sync()
+        self.assertEqual(history.list, [u'git checkout master', u'dir', u'make dist', u'cd ..'])
+
+    def test_save_while_adding(self):
+        """Test that no line is lost when saving on another thread"""
+        history = CommandHistory()
+        history.load(HistoryStore(self.filename))
+        done = threading.Event()
+        def save():
+            while not done.is_set():
+                history.save(10000)
+        thread = threading.Thread(target = save)
+        thread.start()
+        lines = [u'echo %d' % i for i in range(2000)]
+        for line in lines:
+            history.add(line)
+        done.set()
+        thread.join()
+        history.save(10000)
+        self.assertEqual(HistoryStore(self.filename).recent(10000), lines)
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestHistoryStore))
+    return suite
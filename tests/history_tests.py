@@ -0,0 +1,142 @@
+#
+# Unit tests for CommandHistory.py
+#
+
+import re, sys
+from random import Random
+from unittest import TestCase, TestSuite, defaultTestLoader
+from CommandHistory import CommandHistory
+from . import legacy
+
+class TestHistorySearch(TestCase):
+    history = [
+        u'git checkout master',
+        u'git commit -m "Fix completion of UNC paths"',
+        u'cd c:\\Program Files\\PyCmd',
+        u'dir /s *.py',
+        u'git clone https://github.com/asfaltboy/pycmd-fork.git',
+        u'python run_tests.py',
+        u'make dist_w32',
+        u'GIT CHECKOUT -b feature',
+        u'type c:\\Program Files\\PyCmd\\README.txt | more',
+        u'echo \xe9t\xe9 > out.txt',
+        ]
+
+    filters = ['', 'g', 'git', 'g c m', 'git ch', 'g c', 'c:\\pro', 'pro fi',
+               'py', 'py c', 'run test', 'dist', 'x', 'GIT c', '*.py',
+               'c:\\Program Files\\PyCmd', u'\xe9', 'zzz', '| m', '.txt']
+
+    def check_filters(self, history):
+        for filter in self.filters:
+            expected = legacy.filter_history(history.list, filter)
+
+            # All matches at once
+            history.lazy = False
+            history.start(filter)
+            self.assertEqual(history.filtered_list, expected)
+
+            # Matches generated while navigating
+            history.lazy = True
+            history.start(filter)
+            for i in range(len(expected) + 1):
+                history.up()
+            self.assertEqual(history.trail[1:], expected[::-1])
+            history.reset()
+
+    def test_matches_reference(self):
+        """Test that the indexed search matches the original one"""
+        history = CommandHistory()
+        for line in self.history:
+            history.add(line)
+        self.check_filters(history)
+
+    def test_replaced_list(self):
+        """Test searching after the history list is replaced"""
+        history = CommandHistory()
+        history.add(u'dir')
+        history.list = list(self.history)
+        self.check_filters(history)
+        history.add(self.history[0])
+        history.add(u'git push origin master')
+        self.assertEqual(history.list[-2:], [self.history[0], u'git push origin master'])
+        self.check_filters(history)
+
+    def test_random_histories(self):
+        """Test the indexed search on random histories"""
+        words = ['git', 'checkout', 'master', 'cd', '..', 'pycmd', 'Dir',
+                 'c:\\Program Files', '-n', 'x.txt', 'a_b', 'GIT', '&&', '|']
+        random = Random(0)
+        for i in range(20):
+            history = CommandHistory()
+            for j in range(random.randint(0, 50)):
+                history.add(u' '.join([random.choice(words)
+                                       for k in range(random.randint(1, 5))]))
+            self.check_filters(history)
+
+    def test_navigation(self):
+        """Test navigating up and down through the matches"""
+        history = CommandHistory()
+        for line in self.history:
+            history.add(line)
+        history.start('git c')
+        history.up()
+        self.assertEqual(history.current()[0], u'GIT CHECKOUT -b feature')
+        history.up()
+        self.assertEqual(history.current()[0], u'git clone https://github.com/asfaltboy/pycmd-fork.git')
+        history.down()
+        self.assertEqual(history.current()[0], u'GIT CHECKOUT -b feature')
+        history.down()
+        self.assertEqual(history.current(), ('git c', [(0, 5)]))
+        history.up()
+        history.up()
+        history.up()
+        self.assertEqual(history.current()[0], u'git commit -m "Fix completion of UNC paths"')
+
+    def test_lazy_search(self):
+        """Test that matches are only searched for when navigating"""
+        history = CommandHistory()
+        for line in self.history:
+            history.add(line)
+        history.start('git')
+        self.assertEqual(history.filtered_list, [])
+        history.up()
+        self.assertEqual(history.current()[0], u'GIT CHECKOUT -b feature')
+        history.add(u'git status')
+        self.assertEqual(history.current(), ('', []))
+        history.start('git')
+        history.up()
+        self.assertEqual(history.current()[0], u'git status')
+
+    def test_single_word_narrowed(self):
+        """Test that a single-word filter only tries the lines holding its words"""
+        searched = []
+        class CountingRegex(object):
+            def __init__(self, regex):
+                self.regex = regex
+            def search(self, line):
+                searched.append(line)
+                return self.regex.search(line)
+        class CountingRe(object):
+            def __getattr__(self, name):
+                return getattr(re, name)
+            def compile(self, pattern, flags = 0):
+                return CountingRegex(re.compile(pattern, flags))
+
+        history = CommandHistory()
+        for line in self.history:
+            history.add(line)
+        module = sys.modules[CommandHistory.__module__]
+        module.re = CountingRe()
+        try:
+            history.lazy = False
+            history.start('dist_w')
+        finally:
+            module.re = re
+        self.assertEqual(history.filtered_list, [(u'make dist_w32', [(5, 11)])])
+        self.assertEqual(set(searched), set([u'make dist_w32']))
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestHistorySearch))
+    return suite
@@ -0,0 +1,69 @@
+#
+# Unit tests for HistoryWriter.py
+#
+
+import threading, time
+from unittest import TestCase, TestSuite, defaultTestLoader
+from HistoryWriter import HistoryWriter
+
+class TestHistoryWriter(TestCase):
+    def setUp(self):
+        self.writes = []
+        self.written = threading.Event()
+
+    def write(self, key, value):
+        self.writes.append((key, value))
+        self.written.set()
+
+    def failing_write(self, message):
+        raise IOError(message)
+
+    def test_background_write(self):
+        """Test that the writes are run on the background thread"""
+        writer = HistoryWriter(0.01)
+        writer.schedule('history', self.write, 'history', 1)
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.writes, [('history', 1)])
+        self.assertTrue(writer.thread.is_alive())
+
+    def test_coalescing(self):
+        """Test that queued writes are coalesced"""
+        writer = HistoryWriter(0.2)
+        for i in range(100):
+            writer.schedule('history', self.write, 'history', i)
+            writer.schedule('dir_history', self.write, 'dir_history', i)
+        writer.flush()
+        self.assertTrue(len(self.writes) <= 4)
+        self.assertEqual(self.writes[-2:], [('history', 99), ('dir_history', 99)])
+
+        # Nothing is written twice
+        writes = list(self.writes)
+        time.sleep(0.3)
+        writer.flush()
+        self.assertEqual(self.writes, writes)
+
+    def test_flush(self):
+        """Test that flushing runs the pending writes right away"""
+        writer = HistoryWriter(60)
+        writer.schedule('history', self.write, 'history', 1)
+        self.assertTrue(self.written.wait(5))
+        writer.schedule('history', self.write, 'history', 2)
+        writer.schedule('dir_history', self.write, 'dir_history', 3)
+        writer.flush()
+        self.assertEqual(self.writes, [('history', 1), ('history', 2), ('dir_history', 3)])
+
+    def test_errors(self):
+        """Test that failed writes are reported to the main thread"""
+        writer = HistoryWriter(60)
+        with writer.write_lock:
+            writer.schedule('history', self.failing_write, 'disk full')
+            writer.schedule('dir_history', self.write, 'dir_history', 1)
+        self.assertRaises(IOError, writer.flush)
+        self.assertEqual(self.writes, [('dir_history', 1)])
+        writer.flush()
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestHistoryWriter))
+    return suite
@@ -0,0 +1,341 @@
+#
+# Reference implementations of routines that have since been rewritten for
+# speed. The unit tests check the optimized versions against these, and the
+# scripts in benchmarks/ use them as a baseline.
+#
+import os, codecs, string, re, fsm
+
+def parse_line(line):
+    """Tokenize a command line based on whitespace while observing quotes"""
+
+    def accumulate(fsm):
+        """Action: add current symbol to last token in list."""
+        fsm.memory[-1] = fsm.memory[-1] + fsm.input_symbol
+
+    def start_empty_token(fsm):
+        """Action: start a new token."""
+        if fsm.memory[-1] != '':
+            fsm.memory.append('')
+
+    def start_token(fsm):
+        """Action: start a new token and accumulate."""
+        start_empty_token(fsm)
+        accumulate(fsm)
+
+    def accumulate_last(fsm):
+        """Action: accumulate and start new token."""
+        accumulate(fsm)
+        start_empty_token(fsm)
+
+    def error(fsm):
+        """Action: handle uncovered transition (should never happen)."""
+        print 'Unhandled transition:', (fsm.input_symbol, fsm.current_state)
+        accumulate(fsm)
+
+    f = fsm.FSM('init', [''])
+
+    f.set_default_transition(error, 'init')
+
+    # default
+    f.add_transition_list(string.whitespace, 'init', start_empty_token, 'whitespace')
+    f.add_transition('"', 'init', accumulate, 'in_string')
+    f.add_transition('|', 'init', start_token, 'pipe')
+    f.add_transition('&', 'init', start_token, 'amp')
+    f.add_transition('>', 'init', start_token, 'gt')
+    f.add_transition('<', 'init', accumulate, 'awaiting_&')
+    f.add_transition('^', 'init', accumulate, 'escape')
+    f.add_transition_list(string.digits, 'init', accumulate, 'redir')
+    f.add_transition_any('init', accumulate, 'init')
+
+    # whitespace
+    f.add_transition_list(string.whitespace, 'whitespace', None, 'whitespace')
+    f.add_empty_transition('whitespace', 'init')
+
+    # strings
+    f.add_transition('"', 'in_string', accumulate, 'init')
+    f.add_transition_any('in_string', accumulate, 'in_string')
+
+    # seen '|'
+    f.add_transition('|', 'pipe', accumulate_last, 'init')
+    f.add_empty_transition('pipe', 'init', start_empty_token)
+
+    # seen '&'
+    f.add_transition('&', 'amp', accumulate_last, 'init')
+    f.add_empty_transition('amp', 'init', start_empty_token)
+
+    # seen '>' or '1>' etc.
+    f.add_transition('>', 'gt', accumulate, 'awaiting_&')
+    f.add_transition('&', 'gt', accumulate, 'awaiting_nr')
+    f.add_empty_transition('gt', 'init', start_empty_token)
+
+    # seen digit
+    f.add_transition('<', 'redir', accumulate, 'awaiting_&')
+    f.add_transition('>', 'redir', accumulate, 'gt')
+    f.add_empty_transition('redir', 'init')
+
+    # seen '<' or '>>', '0<', '2>>' etc.
+    f.add_transition('&', 'awaiting_&', accumulate, 'awaiting_nr')
+    f.add_empty_transition('awaiting_&', 'init', start_empty_token)
+
+    # seen '<&' or '>&', '>>&', '0<&', '1>&', '2>>&' etc.
+    f.add_transition_list(string.digits, 'awaiting_nr', accumulate_last, 'init')
+    f.add_empty_transition('awaiting_nr', 'init', start_empty_token)
+
+    # seen '^'
+    f.add_transition_any('escape', accumulate, 'init')
+
+    f.process_list(line)
+    if len(f.memory) > 0 and f.memory[-1] == '':
+        del f.memory[-1]
+
+    return f.memory
+
+
+def filter_history(history, line):
+    """
+    Build the filtered history list for a search filter, the way the original
+    CommandHistory.start() did (returns the filtered_list)
+    """
+    # Create a list of regex patterns to use when navigating the history
+    # using a filter
+    # A. First use just the space as word separator; these are the most
+    # useful matches (think acronyms 'g c m' for 'git checkout master' etc)
+    words = [re.escape(w) for w in re.findall('[^\\s]+', line)] # Split the filter into words
+    boundary = '[\\s]+'
+    patterns = [
+        # Prefixes match for each word in the command (strongest, these will be the
+        # first in the list
+        '^' + boundary.join(['(' + word + ')[^\\s]*' for word in words]) + '$',
+
+        # Prefixes match for some words in the command
+        boundary.join(['(' + word + ')[^\\s]*' for word in words]),
+    ]
+
+    # B. Then split based on other separator characters as well
+    words = [re.escape(w) for w in re.findall('[a-zA-Z0-9]+', line)] # Split the filter into words
+    boundary = '[\\s\\.\\-\\\\_]+'   # Word boundary characters
+    patterns += [
+        # Prefixes match for each word in the command (strongest, these will be the
+        # first in the list
+        '^' + boundary.join(['(' + word + ')[a-zA-Z0-9]*' for word in words]) + '$',
+
+        # Prefixes match for some words in the command
+        boundary.join(['(' + word + ')[a-zA-Z0-9]*' for word in words]),
+
+        # Exact string match
+        '(' + re.escape(line) + ')',
+
+        # Substring match in different words
+        boundary.join(['(' + word + ').*' for word in words]),
+
+        # Substring match anywhere (weakest, these will be the last results)
+        ''.join(['(' + word + ').*' for word in words])
+    ]
+
+    if len(words) <= 1:
+        # Optimization: Skip the advanced word-based matching for empty or
+        # simple (one-word) filters -- this saves a lot of computation effort
+        # as these filters will yield a long list of matched lines!
+        patterns = [patterns[4]]
+
+    # Traverse the history and build the filtered list
+    filtered_list = []
+    for pattern in patterns:
+        for line in reversed(history):
+            if line in [l for (l, p) in filtered_list]:
+                # We already added this line, skip
+                continue
+            matches = re.search(pattern, line, re.IGNORECASE)
+            if matches:
+                filtered_list.insert(0, (line, [matches.span(i) for i in range(1, matches.lastindex + 1)]))
+    return filtered_list
+
+
+def save_history(lines, filename, length):
+    """
+    Save a list of unique lines into a history file and truncate the
+    result to the given maximum number of lines
+    """
+    if os.path.isfile(filename):
+        # Read previously saved history and merge with current
+        history_file = codecs.open(filename, 'r', 'utf8', 'replace')
+        history_to_save = [line.rstrip(u'\n') for line in history_file.readlines()]
+        history_file.close()
+        for line in lines:
+            if line in history_to_save:
+                history_to_save.remove(line)
+            history_to_save.append(line)
+    else:
+        # No previous history, save current
+        history_to_save = lines
+
+    if len(history_to_save) > length:
+        history_to_save = history_to_save[-length :]    # Limit history file
+
+    # Write merged history to history file
+    history_file = codecs.open(filename, 'w', 'utf8')
+    history_file.writelines([line + u'\n' for line in history_to_save])
+    history_file.close()
+
+
+def read_history(filename):
+    """
+    Read and return a list of lines from a history file
+    """
+    if os.path.isfile(filename):
+        history_file = codecs.open(filename, 'r', 'utf8', 'replace')
+        history = [line.rstrip(u'\n\r') for line in history_file.readlines()]
+        history_file.close()
+    else:
+        history = []
+    return history
+
+
+def complete_from_path(matcher, completions):
+    """
+    List the executables in the PATH that match, the way complete_file_simple
+    did on every Tab press (with the separators of the current platform)
+    """
+    from common import expand_env_vars, has_exec_extension
+    completions_path = []
+    for elem_in_path in os.environ['PATH'].split(os.pathsep):
+        dir_to_complete = expand_env_vars(elem_in_path)
+        try:
+            completions_path += [elem for elem in os.listdir(dir_to_complete)
+                                 if matcher.match(elem)
+                                 and os.path.isfile(os.path.join(dir_to_complete, elem))
+                                 and has_exec_extension(elem)
+                                 and not elem in completions
+                                 and not elem in completions_path]
+        except OSError:
+            # Cannot complete, probably access denied
+            pass
+    return completions_path
+
+
+def list_dir_completions(dir_to_complete, matcher):
+    """
+    List the directories, then the files, that match in a directory, the way
+    the completion functions did on every Tab press (with the separators of
+    the current platform)
+    """
+    completions = []
+    if os.path.isdir(dir_to_complete):
+        try:
+            completions = [elem for elem in os.listdir(dir_to_complete)
+                           if matcher.match(elem)]
+        except OSError:
+            # Cannot complete, probably access denied
+            pass
+    completions_dirs = [elem + '\\' for elem in completions if os.path.isdir(os.path.join(dir_to_complete, elem))]
+    completions_files = [elem for elem in completions if os.path.isfile(os.path.join(dir_to_complete, elem))]
+    return completions_dirs + completions_files
+
+
+def wildcard_to_regex(pattern):
+    """
+    Transform a wildcard pattern into a compiled regex object.
+    This also handles escaping as needed.
+    """
+    # Transform pattern into regexp
+    translations = [('\\', '\\\\'),
+                    ('(', '\\('), 
+                    (')', '\\)'),
+                    ('[', '\\['), 
+                    (']', '\\]'),
+                    ('.', '\\.'),
+                    ('+', '\\+'),
+                    ('^', '\\^'),
+                    ('$', '\\$'),
+                    ('?', '(.)'), 
+                    ('*', '(.*)')]
+                    
+    re_pattern = pattern
+    for src, dest in translations:
+        re_pattern = re_pattern.replace(src, dest)
+    re_pattern += '$'
+    return re.compile(re_pattern, re.IGNORECASE)
+
+
+def find_common_prefix(original, completions):
+    """
+    Search for the longest common prefix in a list of strings
+    Returns the longest common prefix
+    """
+    common_len = 0
+    common_string = ''
+    mismatch = False
+    perfect = True
+
+    # Cache lowercase version to avoid repeated calls to str.lower()
+    completions_lower = [s.lower() for s in completions]
+    common_string_lower = ''
+
+    while common_len < len(completions[0]) and not mismatch:
+        common_len += 1
+        common_string = completions[0][0:common_len]
+        common_string_lower = completions_lower[0][0:common_len]
+        for i in range(1, len(completions)):
+            completion = completions[i]
+            completion_lower = completions_lower[i]
+            if completion_lower[0:common_len] != common_string_lower:
+                mismatch = True
+            elif completion[0:common_len] != common_string:
+                perfect = False
+    if mismatch:
+        common_string = common_string[:-1]
+        common_len -= 1
+
+    # Try to take a good guess wrt letter casing
+    if not perfect:
+        for i in range(len(original)):
+            case_match = [c for c in completions if c.startswith(original[:i + 1])]
+            if len(case_match) > 0:
+                common_string = case_match[0][:common_len]
+            else:
+                break
+
+    return common_string
+
+
+def list_completions(dir_to_complete, matcher):
+    """
+    The entries of a directory matched by matcher: first the directories,
+    with a trailing '\\', then the files
+    """
+    if isinstance(matcher, PrefixMatcher):
+        candidates = [candidate for candidate in dir_cache.listing(dir_to_complete)
+                      if candidate.key.startswith(matcher.prefix)]
+    else:
+        candidates = [candidate for candidate in dir_cache.listing(dir_to_complete)
+                      if matcher.match(candidate.name)]
+    return ([candidate.name + '\\' for candidate in candidates if candidate.is_dir]
+            + [candidate.name for candidate in candidates if candidate.is_file])
+
+
+def render_completions(write, suggestions, original, buffer_width, window_height):
+    """
+    Print the suggestions of a completion in columns, the way PyCmd.main did
+    on Tab (colors left out): all of them at once, recomputing the common
+    prefix for every cell
+    """
+    column_width = max([len(s) for s in suggestions]) + 10
+    if column_width > buffer_width - 1:
+        column_width = buffer_width - 1
+    if len(suggestions) > window_height / 4:
+        num_columns = (buffer_width - 1) / column_width
+    else:
+        num_columns = 1
+    num_lines = len(suggestions) / num_columns
+    if len(suggestions) % num_columns != 0:
+        num_lines += 1
+    write('\n')
+    for line in range(0, num_lines):
+        write('\r')
+        for column in range(0, num_columns):
+            if line + column * num_lines < len(suggestions):
+                s = suggestions[line + column * num_lines]
+                common_prefix_len = len(find_common_prefix(original, suggestions))
+                write(s[:common_prefix_len] + s[common_prefix_len : ])
+                write(' ' * (column_width - len(s)))
+        write('\n')
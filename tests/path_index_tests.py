@@ -0,0 +1,151 @@
+#
+# Unit tests for PathIndex.py
+#
+
+import os, shutil, tempfile
+from unittest import TestCase, TestSuite, defaultTestLoader
+from PathIndex import PathIndex
+
+class TestPathIndex(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ.setdefault('PATHEXT', '.COM;.EXE;.BAT;.CMD')
+        self.dirs = []
+        for name in ['bin', 'tools', 'git']:
+            self.dirs.append(os.path.join(self.dir, name))
+            os.mkdir(self.dirs[-1])
+        self.set_path(self.dirs[:2])
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir)
+
+    def set_path(self, dirs):
+        os.environ['PATH'] = os.pathsep.join(dirs)
+
+    def touch(self, dir, name):
+        """Create a file, and move the directory's modification time"""
+        open(os.path.join(dir, name), 'w').close()
+        self.bump(dir)
+
+    def bump(self, dir):
+        # Don't rely on the timestamp resolution of the file system
+        mtime = os.stat(dir).st_mtime
+        os.utime(dir, (mtime + 10, mtime + 10))
+
+    def test_complete(self):
+        """Test looking up executables by prefix"""
+        for name in ['make.exe', 'MSBuild.exe', 'mkdocs.BAT', 'more.com', 'mk.txt']:
+            self.touch(self.dirs[0], name)
+        os.mkdir(os.path.join(self.dirs[0], 'mkdir.exe'))
+        for name in ['make.exe', 'MAKE.bat', 'mt.exe']:
+            self.touch(self.dirs[1], name)
+        index = PathIndex()
+        index.update()
+        self.assertEqual(index.complete(u'm'), ['MAKE.bat', 'make.exe', 'mkdocs.BAT', 'more.com',
+                                                'MSBuild.exe', 'mt.exe'])
+        self.assertEqual(index.complete(u'MS'), ['MSBuild.exe'])
+        self.assertEqual(index.complete(u'make.'), ['MAKE.bat', 'make.exe'])
+        self.assertEqual(index.complete(u'x'), [])
+        self.assertEqual(len(index.complete(u'')), 6)
+
+    def test_refresh(self):
+        """Test that the index follows changes to the directories and the PATH"""
+        self.touch(self.dirs[0], 'make.exe')
+        index = PathIndex()
+        index.update()
+        self.assertEqual(index.complete(u'm'), ['make.exe'])
+
+        # Unchanged directories aren't listed again
+        listed = []
+        list_dir = index._list
+        index._list = lambda dir: listed.append(dir) or list_dir(dir)
+        index.update()
+        self.assertEqual(listed, [])
+
+        self.touch(self.dirs[1], 'msbuild.exe')
+        index.update()
+        self.assertEqual(listed, [self.dirs[1]])
+        self.assertEqual(index.complete(u'm'), ['make.exe', 'msbuild.exe'])
+
+        os.remove(os.path.join(self.dirs[0], 'make.exe'))
+        self.bump(self.dirs[0])
+        index.update()
+        self.assertEqual(index.complete(u'm'), ['msbuild.exe'])
+
+        # The PATH changed (e.g. after running a command)
+        self.touch(self.dirs[2], 'git.exe')
+        self.set_path([self.dirs[2], self.dirs[1], os.path.join(self.dir, 'missing')])
+        index.update()
+        self.assertEqual(index.complete(u'g'), ['git.exe'])
+        self.assertEqual(sorted(index.dirs), sorted([self.dirs[2], self.dirs[1], os.path.join(self.dir, 'missing')]))
+        self.set_path([self.dirs[2]])
+        index.update()
+        self.assertEqual(index.complete(u'm'), [])
+
+    def test_index_file(self):
+        """Test sharing the index between sessions through a file"""
+        filename = os.path.join(self.dir, 'path_index')
+        for name in ['make.exe', 'MSBuild.exe', 'Zip.bat']:
+            self.touch(self.dirs[0], name)
+        self.touch(self.dirs[1], 'mt.exe')
+        index = PathIndex(filename)
+        index.update()
+        self.assertTrue(os.path.isfile(filename))
+
+        # A new session serves the lookups from the file, without listing
+        # any directory
+        other = PathIndex(filename)
+        other._list = lambda dir: self.fail('%s listed' % dir)
+        other.update()
+        self.assertNotEqual(other.saved, None)
+        self.assertEqual(other.complete(u'm'), ['make.exe', 'MSBuild.exe', 'mt.exe'])
+        self.assertEqual(other.complete(u'z'), ['Zip.bat'])
+        self.assertEqual(other.complete(u'mt.'), ['mt.exe'])
+        self.assertEqual(other.complete(u'x'), [])
+        self.assertEqual(other.complete(u''), ['make.exe', 'MSBuild.exe', 'mt.exe', 'Zip.bat'])
+
+        # Only the directories that changed are listed again
+        listed = []
+        other = PathIndex(filename)
+        other._list = lambda dir: listed.append(dir) or PathIndex._list(other, dir)
+        self.touch(self.dirs[1], 'mc.exe')
+        other.update()
+        self.assertEqual(listed, [self.dirs[1]])
+        self.assertEqual(other.saved, None)
+        self.assertEqual(other.complete(u'm'), ['make.exe', 'mc.exe', 'MSBuild.exe', 'mt.exe'])
+
+        # Including after the PATH changed
+        listed = []
+        other = PathIndex(filename)
+        other._list = lambda dir: listed.append(dir) or PathIndex._list(other, dir)
+        self.set_path(self.dirs[1:])
+        other.update()
+        self.assertEqual(listed, [self.dirs[2]])
+        self.assertEqual(other.complete(u'm'), ['mc.exe', 'mt.exe'])
+        self.assertEqual(PathIndex(filename).complete(u'm'), [])
+
+    def test_damaged_file(self):
+        """Test that a damaged index file is rebuilt"""
+        filename = os.path.join(self.dir, 'path_index')
+        self.touch(self.dirs[0], 'make.exe')
+        index = PathIndex(filename)
+        index.update()
+        data = open(filename, 'rb').read()
+        for damaged in ['', 'garbage', data[:-3], data[:30]]:
+            f = open(filename, 'wb')
+            f.write(damaged)
+            f.close()
+            index = PathIndex(filename)
+            index.update()
+            self.assertEqual(index.saved, None)
+            self.assertEqual(index.complete(u'm'), ['make.exe'])
+            self.assertEqual(open(filename, 'rb').read(), data)
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestPathIndex))
+    return suite
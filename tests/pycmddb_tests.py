@@ -0,0 +1,495 @@
+#
+# Unit tests for PyCmdDB.py
+#
+
+import os, shutil, struct, tempfile, zlib
+from unittest import TestCase, TestSuite, defaultTestLoader
+from PyCmdDB import get_db_backend, LogKVBackend, PickleBackend, CompactCodec
+from PyCmdDB import CompressedBackend, ZlibCompressor, SnappyCompressor, LZ4Compressor
+from PyCmdDB import compressors, SortedKeys, backends
+from userconfig import default_backend
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class TestCompactCodec(TestCase):
+    def test_round_trip(self):
+        """Test encoding and decoding values"""
+        codec = CompactCodec()
+        for val in [['git', 'clone'], [u'git', u'status', u'\xe9t\xe9'], [], [''], ['\xe9'],
+                    ['dir', u'\xe9'], ['x' * 70000], (u'git',), {'a': 1}, 5L, None]:
+            data = codec.encode(val)
+            self.assertEqual(codec.decode(data), val)
+            if type(val) is list:
+                self.assertEqual(map(type, codec.decode(data)), map(type, val))
+        for val in [[u'a\0b'], ['a\0b'], [None]]:
+            self.assertEqual(codec.decode(codec.encode(val)), val)
+        self.assertEqual(codec.encode([u'git', u'clone', u'\xe9']), '\xfeugit\0clone\0\xc3\xa9')
+        self.assertEqual(codec.encode(['git', '\xe9']), '\xfesgit\0\xe9')
+        self.assertTrue(len(codec.encode([u'git', u'log'])) < len(pickle.dumps([u'git', u'log'], 2)))
+
+    def test_pickled_values(self):
+        """Test reading values stored pickled"""
+        for protocol in [0, 2]:
+            self.assertEqual(CompactCodec().decode(pickle.dumps([u'git', u'st'], protocol)), [u'git', u'st'])
+
+
+
+class TestSortedKeys(TestCase):
+    def test_sorted_keys(self):
+        """Test looking up keys by prefix and by range"""
+        keys = SortedKeys(['gs', 'gitcl', 'll', 'git', 'g'])
+        keys.add('gitk')
+        keys.add('gs')
+        keys.remove('g')
+        keys.remove('zz')
+        self.assertEqual(keys.keys, ['git', 'gitcl', 'gitk', 'gs', 'll'])
+        self.assertEqual(keys.prefix('git'), ['git', 'gitcl', 'gitk'])
+        self.assertEqual(keys.prefix('gitc'), ['gitcl'])
+        self.assertEqual(keys.prefix('h'), [])
+        self.assertEqual(keys.prefix(''), keys.keys)
+        self.assertEqual(keys.range('gitk', 'll'), ['gitk', 'gs'])
+        self.assertEqual(keys.range(None, 'gs'), ['git', 'gitcl', 'gitk'])
+        self.assertTrue('gs' in keys)
+        self.assertFalse('g' in keys)
+
+
+class BackendTests(object):
+    """Tests shared by all the backends"""
+    backend = None
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open_db(self):
+        return get_db_backend(self.dir, 'pycmd', self.backend)
+
+    def test_put_get_delete(self):
+        """Test the basic operations"""
+        db = self.open_db()
+        self.assertEqual(db.get('gitcl'), None)
+        self.assertEqual(db.get(), [])
+        db.put('gitcl', ['git', 'clone'])
+        db.put('ll', ['dir', '/w'])
+        db.put('gitcl', ['git', 'clone', '-q'])
+        self.assertEqual(db.get('gitcl'), ['git', 'clone', '-q'])
+        self.assertEqual(db.get(u'll'), ['dir', '/w'])
+        self.assertTrue(db.has('ll'))
+        self.assertEqual(db.get(), [('gitcl', ['git', 'clone', '-q']), ('ll', ['dir', '/w'])])
+        self.assertEqual(db.keys(), ['gitcl', 'll'])
+        self.assertEqual(db.get(1), ['dir', '/w'])
+        self.assertEqual(db.get(2), None)
+        self.assertEqual(db.index(), 3)
+        self.assertRaises(KeyError, db.put, 'a/b', ['dir'])
+
+        db.delete('gitcl')
+        self.assertEqual(db.get('gitcl'), None)
+        self.assertFalse(db.has('gitcl'))
+        self.assertEqual(db.get(), [('ll', ['dir', '/w'])])
+        db.delete()
+        self.assertEqual(db.get(), [])
+
+    def test_persistence(self):
+        """Test that the changes are saved"""
+        db = self.open_db()
+        db.put('gitcl', ['git', 'clone'])
+        db.put('ll', ['dir', '/w'])
+        db.delete('gitcl')
+        db.put('gs', [u'git', u'status', u'\xe9'])
+        self.assertEqual(self.open_db().get(), [('ll', ['dir', '/w']), ('gs', [u'git', u'status', u'\xe9'])])
+        db.delete()
+        self.assertEqual(self.open_db().get(), [])
+
+    def test_range(self):
+        """Test getting a range of values"""
+        db = self.open_db()
+        for key in ['a', 'b', 'c', 'd']:
+            db.put(key, [key])
+        db.delete('b')
+        self.assertEqual(list(db._getrange('c')), [('c', ['c']), ('d', ['d'])])
+        self.assertEqual(list(db._getrange('a', 'd')), [('a', ['a']), ('c', ['c'])])
+        self.assertRaises(KeyError, db._getrange, 'b')
+
+        # Ranges between keys are in key order, whatever the insertion order
+        for key in ['b', 'ab', 'ba']:
+            db.put(key, [key])
+        self.assertEqual(list(db._getrange('ab', 'c')), [('ab', ['ab']), ('b', ['b']), ('ba', ['ba'])])
+        self.assertEqual(list(db._getrange(None, 'b')), [('a', ['a']), ('ab', ['ab'])])
+        self.assertEqual([key for (key, val) in db.get()], ['a', 'c', 'd', 'b', 'ab', 'ba'])
+
+    def test_batch(self):
+        """Test grouping writes in a batch"""
+        db = self.open_db()
+        db.put('gitcl', ['git', 'clone'])
+        with db.batch():
+            db.put('ll', ['dir', '/w'])
+            db.delete('gitcl')
+            with db.batch():
+                db.put('gs', ['git', 'status'])
+            # The batch reads its own writes
+            self.assertEqual(db.get('ll'), ['dir', '/w'])
+            self.assertFalse(db.has('gitcl'))
+        self.assertEqual(self.open_db().get(), [('ll', ['dir', '/w']), ('gs', ['git', 'status'])])
+
+        # Nothing is written if the batch fails
+        try:
+            with db.batch():
+                db.put('gitcl', ['git', 'clone'])
+                db.delete('ll')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(db.get(), [('ll', ['dir', '/w']), ('gs', ['git', 'status'])])
+        self.assertEqual(self.open_db().get(), [('ll', ['dir', '/w']), ('gs', ['git', 'status'])])
+
+    def test_prefix(self):
+        """Test listing the keys that start with a prefix"""
+        db = self.open_db()
+        for key in ['ll', 'gs', 'gitcl', 'git', 'gitk', 'g-', 'G']:
+            db.put(key, [key])
+        db.delete('gitk')
+        self.assertEqual(db.prefix('git'), ['git', 'gitcl'])
+        self.assertEqual(db.prefix(u'g'), ['g-', 'git', 'gitcl', 'gs'])
+        self.assertEqual(db.prefix(), ['G', 'g-', 'git', 'gitcl', 'gs', 'll'])
+        self.assertEqual(db.prefix('x'), [])
+        self.assertEqual(db.prefix(u'\xe9'), [])
+
+        # Changes made by other sessions
+        other = self.open_db()
+        other.put('gitx', ['gitx'])
+        other.delete('gs')
+        db.refresh()
+        self.assertEqual(db.prefix('g'), ['g-', 'git', 'gitcl', 'gitx'])
+        db.delete()
+        self.assertEqual(db.prefix(''), [])
+
+    def test_many(self):
+        """Test putting and getting several values at once"""
+        db = self.open_db()
+        db.put_many([('a%d' % i, ['echo', str(i)]) for i in range(1200)])
+        db.put_many({'ll': ['dir', '/w']})
+        keys = ['a%d' % i for i in range(0, 1200, 3)] + ['zz', u'll']
+        self.assertEqual(self.open_db().get_many(keys),
+                         [['echo', str(i)] for i in range(0, 1200, 3)] + [None, ['dir', '/w']])
+        self.assertEqual(db.get_many([]), [])
+        self.assertRaises(KeyError, db.put_many, [('ok', ['dir']), ('a/b', ['dir'])])
+        self.assertEqual(self.open_db().get('ok'), None)
+
+
+class TestPickleBackend(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open_db(self):
+        return get_db_backend(self.dir, 'pycmd', 'pickle')
+
+    def test_batch(self):
+        """Test that a batch is saved in one write, or not at all"""
+        db = self.open_db()
+        self.assertTrue(isinstance(db, PickleBackend))
+        writes = []
+        dump = db._dumpf
+        db._dumpf = lambda data: (writes.append(data), dump(data))
+        db.put_many([('a%d' % i, ['echo', str(i)]) for i in range(100)])
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.open_db().get_many(['a0', 'a99', 'zz']), [['echo', '0'], ['echo', '99'], None])
+
+        try:
+            with db.batch():
+                db.delete()
+                db.put('ll', ['dir'])
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(len(list(db.keys())), 100)
+        self.assertFalse(db.has('ll'))
+
+    def test_prefix(self):
+        """Test listing the keys that start with a prefix"""
+        db = self.open_db()
+        db.put_many([('gitcl', ['git', 'clone']), ('ll', ['dir']), ('git', ['git'])])
+        db.delete('ll')
+        self.assertEqual(db.prefix('gi'), ['git', 'gitcl'])
+        self.assertEqual(self.open_db().prefix(''), ['git', 'gitcl'])
+        db.delete()
+        self.assertEqual(db.prefix(''), [])
+
+    def test_range(self):
+        """Test getting a range of values, in key order"""
+        db = self.open_db()
+        for key in ['d', 'b', 'c', 'a', 'ab']:
+            db.put(key, [key])
+        db.delete('c')
+        self.assertEqual(db._getrange('ab', 'd'), [('ab', ['ab']), ('b', ['b'])])
+        self.assertEqual(db._getrange('b'), [('b', ['b']), ('d', ['d'])])
+        self.assertEqual([key for (key, val) in db.get()], ['d', 'b', 'a', 'ab'])
+        self.assertRaises(KeyError, db._getrange, 'c')
+        self.assertRaises(Exception, db._getrange, 'd', 'a')
+
+    def test_unencoded_values(self):
+        """Test reading a file written before the values were encoded"""
+        f = open(os.path.join(self.dir, 'pycmd.pickle'), 'wb')
+        f.write(pickle.dumps({'keys': ['gitcl'], 'data': {'gitcl': [u'git', u'clone']}}))
+        f.close()
+        db = self.open_db()
+        self.assertEqual(db.get('gitcl'), [u'git', u'clone'])
+        db.put('ll', ['dir'])
+        self.assertEqual(list(self.open_db().get()), [('gitcl', [u'git', u'clone']), ('ll', ['dir'])])
+
+
+class FakeSnappy(object):
+    """Stand-in for python-snappy's framing API (zlib inside)"""
+    stream_id = '\xff\x06\x00\x00sNaPpY'
+
+    class StreamCompressor(object):
+        def __init__(self):
+            self.compressor = zlib.compressobj()
+            self.started = False
+
+        def add_chunk(self, data):
+            header = '' if self.started else FakeSnappy.stream_id
+            self.started = True
+            return header + self.compressor.compress(data)
+        compress = add_chunk
+
+        def flush(self):
+            return self.compressor.flush()
+
+    class StreamDecompressor(object):
+        def __init__(self):
+            self.decompressor = zlib.decompressobj()
+            self.pending = ''
+
+        def decompress(self, data):
+            if self.pending is not None:
+                self.pending += data
+                if len(self.pending) < len(FakeSnappy.stream_id):
+                    return ''
+                if not self.pending.startswith(FakeSnappy.stream_id):
+                    raise ValueError('stream missing snappy identifier')
+                (data, self.pending) = (self.pending[len(FakeSnappy.stream_id):], None)
+            return self.decompressor.decompress(data)
+
+        def flush(self):
+            return self.decompressor.flush()
+
+
+class FakeLZ4Frame(object):
+    """Stand-in for python-lz4's lz4.frame module (zlib inside)"""
+    magic = '\x04\x22\x4d\x18'
+
+    class LZ4FrameCompressor(object):
+        def __init__(self):
+            self.compressor = None
+
+        def begin(self):
+            self.compressor = zlib.compressobj()
+            return FakeLZ4Frame.magic
+
+        def compress(self, data):
+            if self.compressor is None:
+                raise RuntimeError('begin() not called')
+            return self.compressor.compress(data)
+
+        def flush(self):
+            (compressor, self.compressor) = (self.compressor, None)
+            return compressor.flush()
+
+    class LZ4FrameDecompressor(object):
+        def __init__(self):
+            self.decompressor = zlib.decompressobj()
+            self.pending = ''
+
+        def decompress(self, data):
+            if self.pending is not None:
+                self.pending += data
+                if len(self.pending) < len(FakeLZ4Frame.magic):
+                    return ''
+                if not self.pending.startswith(FakeLZ4Frame.magic):
+                    raise RuntimeError('not an LZ4 frame')
+                (data, self.pending) = (self.pending[len(FakeLZ4Frame.magic):], None)
+            # The frame ends with its last block, there's no flush
+            return self.decompressor.decompress(data) + self.decompressor.flush()
+
+
+class TestCompressedBackend(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open_db(self):
+        return get_db_backend(self.dir, 'pycmd', 'snappy')
+
+    def test_compression(self):
+        """Test that the file is compressed, and read back"""
+        db = self.open_db()
+        self.assertTrue(isinstance(db, CompressedBackend))
+        self.assertEqual(db.compressor, compressors[0])
+        db.__chunk__ = 100
+        aliases = [('alias%d' % i, [u'git', u'log', u'-%d' % i]) for i in range(500)]
+        db.put_many(aliases)
+        self.assertEqual(list(self.open_db().get()), aliases)
+        self.assertTrue(os.path.getsize(db.dbfile) < len(pickle.dumps(db.db, 2)) / 2)
+
+    def test_compressors(self):
+        """Test the adapters of the compression libraries"""
+        aliases = [('alias%d' % i, [u'git', u'log', u'-%d' % i]) for i in range(500)]
+        for compressor in [SnappyCompressor(FakeSnappy()), LZ4Compressor(FakeLZ4Frame()), ZlibCompressor()]:
+            db = self.open_db()
+            db.compressor = compressor
+            db.__chunk__ = 100
+            db.put_many(aliases)
+            f = open(db.dbfile, 'rb')
+            self.assertEqual(f.read(9 + len(compressor.name)),
+                             'PyCmdCZ1' + chr(len(compressor.name)) + compressor.name)
+            f.close()
+            compressors.insert(0, compressor)
+            try:
+                self.assertEqual(list(self.open_db().get()), aliases)
+            finally:
+                compressors.remove(compressor)
+                os.remove(db.dbfile)
+
+    def test_compressor_name(self):
+        """Test that the file is read with the library it was written with"""
+        db = self.open_db()
+        zlib_compressor = ZlibCompressor()
+        zlib_compressor.name = 'zlib2'
+        db.compressor = zlib_compressor
+        db.put('ll', ['dir'])
+        f = open(db.dbfile, 'rb')
+        self.assertEqual(f.read(14), 'PyCmdCZ1\x05zlib2')
+        f.close()
+        self.assertRaises(Exception, self.open_db)
+        compressors.append(zlib_compressor)
+        try:
+            self.assertEqual(self.open_db().get('ll'), ['dir'])
+        finally:
+            compressors.remove(zlib_compressor)
+
+
+class TestLogKVBackend(BackendTests, TestCase):
+    backend = 'logkv'
+
+    def test_backend(self):
+        """Test that the backend is registered"""
+        self.assertTrue(isinstance(self.open_db(), LogKVBackend))
+
+    def test_compaction(self):
+        """Test that the database file doesn't keep growing"""
+        db = self.open_db()
+        for i in range(500):
+            db.put('a%d' % (i % 10), ['echo', str(i)])
+            self.assertTrue(db.records <= max(LogKVBackend.__compact_min__, 2 * len(db.db)) + 1)
+        self.assertEqual(self.open_db().get(), [('a%d' % i, ['echo', str(490 + i)]) for i in range(10)])
+
+    def test_sessions(self):
+        """Test that sessions don't lose each other's changes"""
+        (db, other) = (self.open_db(), self.open_db())
+        db.put('gitcl', ['git', 'clone'])
+        other.put('ll', ['dir'])
+        db.put('gs', ['git', 'status'])
+        db.compact()
+        self.assertEqual(self.open_db().get(), [('gitcl', ['git', 'clone']), ('ll', ['dir']), ('gs', ['git', 'status'])])
+
+        # A session reads the file again after another one compacts it
+        other.put('ll', ['dir', '/w'])
+        self.assertEqual(other.get('gitcl'), ['git', 'clone'])
+        self.assertEqual(self.open_db().get('ll'), ['dir', '/w'])
+
+    def test_pickled_records(self):
+        """Test reading a file written with pickled records"""
+        db = self.open_db()
+        db.put('ll', ['dir'])
+        f = open(db.dbfile, 'ab')
+        for record in [('gitcl', [u'git', u'clone']), ('ll',)]:
+            payload = pickle.dumps(record, 2)
+            f.write(struct.pack('<Ii', len(payload), zlib.crc32(payload)) + payload)
+        f.close()
+        self.assertEqual(self.open_db().get(), [('gitcl', [u'git', u'clone'])])
+        db.put('gs', ['git', 'status'])
+        db.compact()
+        self.assertEqual(self.open_db().get(), [('gitcl', [u'git', u'clone']), ('gs', ['git', 'status'])])
+
+    def test_incomplete_record(self):
+        """Test recovering from a record that was only partly written"""
+        db = self.open_db()
+        db.put('gitcl', ['git', 'clone'])
+        f = open(db.dbfile, 'ab')
+        f.write('\x20\x00\x00\x00garbage')
+        f.close()
+        other = self.open_db()
+        self.assertEqual(other.get(), [('gitcl', ['git', 'clone'])])
+        other.put('ll', ['dir'])
+        self.assertEqual(self.open_db().get(), [('gitcl', ['git', 'clone']), ('ll', ['dir'])])
+
+
+class TestSQLiteBackend(BackendTests, TestCase):
+    backend = 'sqlite3'
+
+    def test_backend(self):
+        """Test that the backend is registered and uses write-ahead logging"""
+        db = self.open_db()
+        self.assertTrue(db.dbfile.endswith('.sqlite3'))
+        self.assertEqual(db._query('PRAGMA journal_mode'), 'wal')
+
+    def test_sessions(self):
+        """Test that sessions see each other's changes"""
+        (db, other) = (self.open_db(), self.open_db())
+        db.put('gitcl', ['git', 'clone'])
+        other.put('ll', ['dir'])
+        self.assertEqual(db.get(), [('gitcl', ['git', 'clone']), ('ll', ['dir'])])
+        other.delete('gitcl')
+        self.assertEqual(db.get('gitcl'), None)
+
+    def test_reopen(self):
+        """Test using the database as a context manager"""
+        db = self.open_db()
+        db.put('gitcl', ['git', 'clone'])
+        db._close()
+        with db:
+            self.assertEqual(db.get('gitcl'), ['git', 'clone'])
+        self.assertEqual(db.db, None)
+
+
+class TestDefaultBackend(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backends = dict(backends)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        backends.clear()
+        backends.update(self.backends)
+
+    def test_default_backend(self):
+        """Test that an existing LevelDB database is kept when no backend is configured"""
+        backends['leveldb'] = backends['pickle']
+        self.assertEqual(default_backend(self.dir), 'pickle')
+        os.mkdir(os.path.join(self.dir, 'pycmd'))
+        self.assertEqual(default_backend(self.dir), 'leveldb')
+        del backends['leveldb']
+        self.assertEqual(default_backend(self.dir), 'pickle')
+
+
+def suite():
+    suite = TestSuite()
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestSortedKeys))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCompactCodec))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestPickleBackend))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestCompressedBackend))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestLogKVBackend))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestSQLiteBackend))
+    suite.addTest(defaultTestLoader.loadTestsFromTestCase(TestDefaultBackend))
+    return suite
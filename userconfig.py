@@ -1,22 +1,51 @@
-from PyCmdDB import get_db_backend
+import os
+from PyCmdDB import get_db_backend, backends
 
 __all__ = ['init_user', 'install_dir', 'data_dir', 'pycmddb', 'get_custom_command', 'get_custom_commands']
 
 _pycmddb = None
+_backend = None
 _install_dir = None
 _data_dir = None
 _initialized = False
 
-def init_user(datadir, installdir):
-    global _initialized, _install_dir, _data_dir, _pycmddb
+def init_user(datadir, installdir, backend=None):
+    """
+    Set up the user directories; the database is opened on first use, with
+    the given backend or else the one selected by behavior.data_backend (see
+    default_backend() when that is None)
+    """
+    global _initialized, _install_dir, _data_dir, _backend
     if not _initialized:
         _initialized = True
         _install_dir = installdir
         _data_dir = datadir
-        _pycmddb = get_db_backend(_data_dir, 'pycmd', 'leveldb')
+        _backend = backend
 
 
-def pycmddb(): return _pycmddb
+def pycmddb():
+    global _pycmddb
+    if _pycmddb is None and _initialized:
+        backend = _backend
+        if backend is None:
+            # pycmd_public depends on the Windows console, import it only when needed
+            from pycmd_public import behavior
+            backend = behavior.data_backend
+        if backend is None:
+            backend = default_backend(_data_dir)
+        _pycmddb = get_db_backend(_data_dir, 'pycmd', backend)
+    return _pycmddb
+
+
+def default_backend(datadir):
+    """
+    The backend used when none is configured: earlier versions always used
+    LevelDB (where py-leveldb is installed), so an existing LevelDB database
+    is kept; otherwise pickle
+    """
+    if 'leveldb' in backends and os.path.isdir(os.path.join(datadir, 'pycmd')):
+        return 'leveldb'
+    return 'pickle'
 
 
 def install_dir(): return _install_dir
@@ -454,6 +454,23 @@ Return value
 	If the function fails, the return value is zero. To get extended error information, call GetLastError.
 """
 
+GetNumberOfConsoleInputEvents = kernel32.GetNumberOfConsoleInputEvents
+GetNumberOfConsoleInputEvents.restype = BOOL
+GetNumberOfConsoleInputEvents.argtypes = [HANDLE, LPDWORD]
+GetNumberOfConsoleInputEvents.__doc__ = """
+Retrieves the number of unread input records in the console's input buffer.
+
+	BOOL WINAPI GetNumberOfConsoleInputEvents(
+		_In_   HANDLE hConsoleInput,
+		_Out_  LPDWORD lpcNumberOfEvents
+	);
+
+hConsoleInput [in]
+	A handle to the console input buffer. The handle must have the GENERIC_READ access right. For more information, see Console Buffer Security and Access Rights.
+lpcNumberOfEvents [out]
+	A pointer to a variable that receives the number of unread input records in the console's input buffer.
+"""
+
 GetConsoleWindow = kernel32.GetConsoleWindow
 GetForegroundWindow = user32.GetForegroundWindow
 GetForegroundWindow.restype = GetConsoleWindow.restype = HWND
@@ -558,6 +575,19 @@ def WriteOneConsoleInput(handle, record):
 	dw = DWORD(0)
 	return WriteConsoleInput(handle, pointer(record), 1, byref(dw)) > 0
 
+def ReadPendingConsoleInput(handle):
+	""" Read the input records already in the buffer, without waiting for more """
+	count = DWORD(0)
+	if not GetNumberOfConsoleInputEvents(handle, byref(count)):
+		raise WinError()
+	if count.value == 0:
+		return []
+	buf = (INPUT_RECORD * count.value)()
+	dw = DWORD(0)
+	if not ReadConsoleInput(handle, buf, count.value, byref(dw)):
+		raise WinError()
+	return buf[:dw.value]
+
 class Clipboard(object):
 
 	def __init__(self, hwnd = NULL):
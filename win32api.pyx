@@ -2,3 +2,4 @@ from win32api cimport *
 
 def ReadOneConsoleInput(handle): pass
 def WriteOneConsoleInput(handle, record): pass
+def ReadPendingConsoleInput(handle): pass